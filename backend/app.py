@@ -1,59 +1,237 @@
+import time
+
+# Начало импорта приложения: длительность импорта входит в этапы старта (см. /ready)
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import json
 import os
 import traceback
-import asyncpg
 
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 from asyncpg import Record
 from datetime import timedelta
-from typing import Annotated
-from fastapi import FastAPI, Depends, Query, Request
-from fastapi.responses import RedirectResponse
+from typing import Annotated, Any, Dict, List, Optional
+from fastapi import FastAPI, Body, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 from auth.auth_api import Authenticator
-from config import ACCESS_TOKEN_EXPIRE_MINUTES
-from db_service.database_api import PostgreSQLService
-from exceptions.app_exceptions import NoDataException, UserAlreadyExistException
-from exceptions.auth_exceptions import WrongCredentialsException
-from model.concentrate_models import Token, MonthData, ConcentrateRecord, SummaryResponse, User, UserCreate
-from utils.stat_utils import calculate_stats
+from middleware.admission_middleware import AdmissionController, AdmissionMiddleware
+from middleware.metrics_middleware import MetricsMiddleware
+from middleware.readiness_middleware import ReadinessMiddleware
+from config import ACCESS_TOKEN_EXPIRE_MINUTES, SUMMARY_ENGINE, BULK_INSERT_BATCH_SIZE, RESPONSE_CACHE_SIZE, \
+    RESPONSE_CACHE_TTL, EXPORT_BATCH_SIZE, APP_HOST, APP_PORT, APP_WORKERS, JOB_WORKERS_IN_PROCESS, \
+    JOB_POLL_INTERVAL, ADMISSION_CONTROL, BATCH_MAX_MONTHS, SNAPSHOT_DIR, SNAPSHOT_OPEN_FILES, QUALITY_SPEC, \
+    TRENDS_MAX_WINDOW, LOG_FILE, STARTUP_MODE, STARTUP_RETRY_INTERVAL, ORGANIZATION_SUMMARY_USERS
+from db_service.storage import get_storage, StorageBackend, WriteResult, MonthWriteOutcome, WRITE_MODES, \
+    BATCH_ROLLED_BACK_MESSAGE
+from exceptions.app_exceptions import NoDataException, UserAlreadyExistException, JobNotFoundException, \
+    JobNotFinishedException, InvalidBatchException, MonthChangedException, RowValidationException, \
+    PartialWriteModeException
+from exceptions.auth_exceptions import WrongCredentialsException, PermissionDeniedException
+from jobs.job_worker import JobWorker
+from model.concentrate_models import Token, MonthData, SummaryResponse, User, UserCreate, \
+    RangeSummaryItem, OrganizationSummaryItem, JobStatus, ClosedMonth, TrendsResponse, MonthRows
+from utils.cache import TTLCache
+from utils.column_validation import RowErrors, validate_records
+from utils.http_cache import make_etag, make_params_etag, make_job_etag, etag_matches, cache_headers
+from utils.batch_utils import validate_months, parse_months_sheet, month_error
+from utils.import_utils import iter_sheet_batches
+from utils.json_utils import dumps, json_response, month_data_content
+from utils.export_utils import EXPORT_MEDIA_TYPES, encode_export
+from utils.period_utils import PERIOD_PATTERN, parse_period, parse_period_range, shift_period, format_period
+from utils.month_snapshots import MonthSnapshotStore, MonthSnapshot
+from utils.metrics import registry, stats_samples, PROMETHEUS_CONTENT_TYPE
+from utils.startup import StartupTracker
+from utils.stat_utils import summarize_records, summarize_aggregates, summarize_partials, range_summary_item
+from utils.trend_utils import parse_spec, parse_metrics, build_trend_series, trends_cache_params
+from utils.vector_stats import records_to_matrix, calculate_stats_matrix
 
 
 # Инициализация приложения
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    До старта приложения создаем таблицы и вставляем дефолтных пользователей из initial_users.json
+    До старта приложения подключаем файл лога, создаем сервисы (см. create_services) и готовим БД (см. prepare_service):
+    при STARTUP_MODE=blocking запросы принимаются после подготовки, при STARTUP_MODE=background подготовка выполняется в
+    фоне с повтором при ошибках, а до ее завершения запросы получают 503 (см. ReadinessMiddleware и /ready). При
+    остановке приложения прерываем незавершенную подготовку, останавливаем воркер фоновых задач и закрываем пул.
 
     :param app: Основное приложение.
     :type app: FastAPI
     :return:
     """
-    await db_service.create_tables()
+    startup.record("import", time.perf_counter() - startup.started)
+    with startup.phase("logging"):
+        setup_file_logging()
+    with startup.phase("services"):
+        create_services()
+
+    preparation = None
+    try:
+        if STARTUP_MODE == "background":
+            preparation = asyncio.create_task(prepare_service(retry=True))
+        else:
+            await prepare_service()
+
+        yield
+    finally:
+        if preparation is not None:
+            preparation.cancel()
+            with suppress(asyncio.CancelledError):
+                await preparation
+        await job_worker.stop()
+        auth_service.password_hasher.shutdown()
+        await db_service.close_pool()
+
+
+def setup_file_logging():
+    """
+    Подключаем файл лога LOG_FILE. Выполняется при старте приложения, а не при импорте модуля, чтобы импорт
+    (например, в скриптах и тестах) не создавал каталог и файл лога.
+
+    :return:
+    """
+    if LOG_FILE:
+        logger.add(LOG_FILE, rotation="10 MB", retention="10 days", level="INFO")
+
+
+def create_services():
+    """
+    Создаем сервисы аутентификации, хранилища и воркер фоновых задач. Выполняется при старте приложения, а не при
+    импорте модуля, чтобы импорт не создавал пулы хэширования и потоки хранилища, а время их создания входило в
+    этапы старта.
+
+    :return:
+    """
+    global auth_service, db_service, job_worker
+    auth_service = Authenticator()
+    db_service = get_storage()
+    job_worker = JobWorker(db_service, JOB_WORKERS_IN_PROCESS)
+
+
+def peek_username(authorization: Optional[str]) -> Optional[str]:
+    """
+    Логин из заголовка Authorization для контроля нагрузки (см. Authenticator.peek_username), до создания сервисов
+    при старте - None.
+
+    :param authorization: Значение заголовка Authorization
+    :return:
+    """
+    return auth_service.peek_username(authorization) if auth_service is not None else None
 
+
+async def prepare_service(retry: bool = False):
+    """
+    Подготовка к приему запросов: пул соединений, схема БД и дефолтные пользователи, прогрев пула, воркер фоновых
+    задач (если JOB_WORKERS_IN_PROCESS > 0 и хранилище - PostgreSQL). Длительности этапов пишутся в startup.
+
+    :param retry: Повторять подготовку через STARTUP_RETRY_INTERVAL при ошибках (например, БД еще не запущена)
+    :return:
+    """
+    while True:
+        startup.attempts += 1
+        try:
+            await prepare_storage()
+            break
+        except Exception as e:
+            if not retry:
+                raise
+            startup.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Не удалось подготовить БД (попытка {startup.attempts}): {startup.last_error}, "
+                           f"повтор через {STARTUP_RETRY_INTERVAL} с")
+            await asyncio.sleep(STARTUP_RETRY_INTERVAL)
+
+    if JOB_WORKERS_IN_PROCESS > 0 and db_service.supports_jobs:
+        job_worker.start()
+    startup.set_ready()
+
+
+async def prepare_storage():
+    """
+    Создаем пул соединений, приводим схему к актуальной версии и вставляем дефолтных пользователей из
+    initial_users.json. Если схема актуальна и пользователи уже есть (обычный перезапуск), это проверяется двумя
+    запросами на соединении пула без блокировки. Иначе подготовка выполняется под advisory-блокировкой, чтобы
+    воркеры не выполняли ее одновременно. В конце открываем min_size соединений пула.
+
+    :return:
+    """
+    with startup.phase("db_pool"):
+        await db_service.init_pool()
+
+    default_users = load_default_users()
+    with startup.phase("schema_check"):
+        prepared = await db_service.schema_is_current() and not await get_missing_default_users(default_users)
+
+    if prepared:
+        logger.info("Схема БД в актуальном состоянии, дефолтные пользователи уже созданы")
+    else:
+        # При нескольких воркерах подготовку БД выполняет один из них
+        async with db_service.startup_lock():
+            with startup.phase("migrations"):
+                await db_service.create_tables()
+            with startup.phase("seed_users"):
+                await seed_default_users(default_users)
+
+    with startup.phase("warm_up"):
+        await db_service.warm_up()
+
+
+def load_default_users() -> List[Dict[str, str]]:
+    """
+    Дефолтные пользователи из initial_users.json.
+
+    :return:
+    """
     file_path = os.path.join(os.path.dirname(__file__), "initial_users.json")
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            default_users = json.load(f)
+            return json.load(f)
     except json.JSONDecodeError as e:
         logger.error(f"Ошибка создания дефолтных пользователей: {e}")
+        return []
+
+
+async def get_missing_default_users(default_users: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Дефолтные пользователи, которых еще нет в БД. Проверяются одним запросом.
+
+    :param default_users: Дефолтные пользователи
+    :return:
+    """
+    if not default_users:
+        return []
+    existing = set(await db_service.get_existing_usernames([user['username'] for user in default_users]))
+    return [user for user in default_users if user['username'] not in existing]
+
+
+async def seed_default_users(default_users: List[Dict[str, str]]):
+    """
+    Вставляем дефолтных пользователей. Уже существующие пользователи пропускаются без вычисления хэша bcrypt.
+
+    :param default_users: Дефолтные пользователи
+    :return:
+    """
+    missing = await get_missing_default_users(default_users)
+    if not missing:
+        logger.info("Дефолтные пользователи уже созданы")
         return
 
-    for user in default_users:
+    for user in missing:
         try:
-            await db_service.insert_user(user['username'], auth_service.get_password_hash(user['password']))
-        except asyncpg.exceptions.UniqueViolationError:
+            hashed_password = await auth_service.async_get_password_hash(user['password'])
+            await db_service.insert_user(user['username'], hashed_password)
+        except UserAlreadyExistException:
             # Дефолтные пользователи уже в бд
             pass
 
     logger.info(f"Дефолтные пользователи были созданы")
 
-    yield
 
-# Настройка логгирования
-logger.add("logs/concentrate_api.log", rotation="10 MB", retention="10 days", level="INFO")
+# Этапы старта и готовность приложения, отсчет от начала импорта модуля
+startup = StartupTracker(IMPORT_STARTED)
 
 app = FastAPI(
     title="API данных железного концентрата",
@@ -63,6 +241,20 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Сервисы создаются при старте приложения в create_services
+auth_service: Optional[Authenticator] = None
+db_service: Optional[StorageBackend] = None
+job_worker: Optional[JobWorker] = None
+admission = AdmissionController(peek_username)
+
+# Контроль нагрузки. Добавляется первым, чтобы выполняться внутри CORS (отказы читаются фронтендом) и метрик
+# (отказы видны в http_request_duration_seconds)
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+
+# Отказ 503 до готовности приложения. Добавляется внутри CORS и метрик, как и контроль нагрузки
+app.add_middleware(ReadinessMiddleware, startup=startup)
+
 # Настройка CORS
 app.add_middleware(
     CORSMiddleware,
@@ -78,9 +270,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Инициализация нужных сервисов
-auth_service = Authenticator()
-db_service = PostgreSQLService()
+# Метрики HTTP-запросов для /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Допустимые значения параметра mode при записи данных
+WRITE_MODE_PATTERN = f"^({'|'.join(WRITE_MODES)})$"
+# Режимы, в которых допустима частичная запись (partial=true): они не удаляют строки, отсутствующие в запросе
+PARTIAL_WRITE_MODES = ("append", "upsert")
+
+# Серверный кэш ответов за месяц: (вид, пользователь, год, месяц) -> (версия данных, JSON ответа в байтах).
+# В нем же хранятся тренды: ("trends", пользователь, параметры) -> (версия данных за период, JSON ответа)
+RESPONSE_CACHE_KINDS = ("data", "summary", "summary-extended")
+response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+# Нормы показателей для трендов по умолчанию
+DEFAULT_QUALITY_SPEC = parse_spec(item for item in QUALITY_SPEC.split(",") if item.strip())
+
+# Снимки закрытых месяцев с готовыми ответами тех же видов, что и в серверном кэше
+month_snapshots = MonthSnapshotStore(SNAPSHOT_DIR, SNAPSHOT_OPEN_FILES)
+
+# Состояние пула соединений, кэшей и пула хэширования в /metrics
+registry.add_collector(
+    "db_pool_connections", "Состояние пула соединений с БД", lambda: stats_samples(db_service.pool_stats(), "state")
+)
+registry.add_collector(
+    "auth_cache", "Счетчики кэшей аутентификации",
+    lambda: [sample for cache, stats in auth_service.cache_stats().items()
+             for sample in stats_samples(stats, "counter", {"cache": cache})]
+)
+registry.add_collector(
+    "password_hashing", "Состояние пула хэширования паролей",
+    lambda: stats_samples(auth_service.password_hasher.stats(), "state")
+)
+registry.add_collector(
+    "job_worker", "Счетчики воркера фоновых задач в процессе приложения",
+    lambda: stats_samples(job_worker.stats(), "state")
+)
+registry.add_collector(
+    "admission", "Состояние контроля нагрузки: ограничители частоты и одновременных запросов",
+    lambda: [sample for limiter, stats in admission.stats().items()
+             for sample in stats_samples(stats, "counter", {"limiter": limiter})]
+)
+registry.add_collector(
+    "response_cache", "Счетчики серверного кэша ответов за месяц", lambda: stats_samples(response_cache.stats(), "counter")
+)
+registry.add_collector(
+    "month_snapshots", "Счетчики снимков закрытых месяцев", lambda: stats_samples(month_snapshots.stats(), "counter")
+)
 
 
 @app.post("/token", response_model=Token)
@@ -108,31 +343,301 @@ async def login_for_access_token(
 
 @app.post("/api/concentrate-quality")
 async def save_concentrate_data(
-        month_data: MonthData,
-        request: Request
+        month_data: MonthRows,
+        request: Request,
+        replace: Annotated[bool, Query()] = False,
+        mode: Annotated[Optional[str], Query(pattern=WRITE_MODE_PATTERN)] = None,
+        partial: Annotated[bool, Query()] = False
 ):
     """
-    Сохраняем данные концентратов.
+    Сохраняем данные концентратов. Строки проверяются по колонкам за один проход, при ошибках ответ 400 содержит
+    ошибки всех строк (строка - индекс элемента data, колонка, значение и текст ошибки), и ничего не записывается.
+    С partial=true записываются строки без ошибок, а отклоненные строки возвращаются в ответе со status=partial.
 
     :param month_data: Модель данных
     :param request: запрос FastAPI
+    :param replace: Перезаписать данные пользователя за месяц (то же, что mode=replace)
+    :param mode: Режим записи: append, replace, upsert (добавить новые и обновить измененные строки) или sync
+        (как upsert, но строки, которых нет в таблице, удаляются). По умолчанию append
+    :param partial: Записать строки без ошибок, отклонив остальные (только в режимах append и upsert)
     :return:
     """
-    try:
-        current_user = await auth_service.get_user_from_request(request)
-        if not current_user:
-            return RedirectResponse('/')
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
 
-        logger.info(f"Пользователь {current_user['username']} сохраняет данные за {month_data.month}/{month_data.year}")
-        await db_service.set_concentrate_data(month_data, current_user)
+    mode = write_mode(mode, replace)
+    check_partial_mode(mode, partial)
+    errors = RowErrors()
+    records = validate_records(month_data.data, errors)
+    check_row_errors(errors, partial, len(records))
 
-        logger.info(f"Данные за {month_data.month}/{month_data.year} успешно сохранены")
-        return {"status": "ok"}
+    try:
+        logger.info(f"Пользователь {current_user['username']} сохраняет данные за {month_data.month}/{month_data.year} "
+                    f"(режим {mode}){rejected_rows_note(errors)}")
+        started = time.perf_counter()
+        result = await db_service.set_concentrate_data(
+            MonthData.model_construct(month=month_data.month, year=month_data.year, data=records), current_user, mode
+        )
+        elapsed = time.perf_counter() - started
+        invalidate_month_cache(current_user['id'], month_data.year, month_data.month)
+
+        logger.info(f"Данные за {month_data.month}/{month_data.year} успешно сохранены: {write_summary(result)} за "
+                    f"{elapsed:.3f} с ({rows_per_sec(result.rows, elapsed)} строк/с)")
+        return write_response(result, elapsed, errors, partial)
+    except HTTPException as e:
+        # Конфликты (409), недоступность БД (503) и т.п. возвращаются своим кодом, как в import и batch
+        logger.warning(f"Данные за {month_data.month}/{month_data.year} не были сохранены: {e.detail}")
+        raise
     except Exception as e:
         logger.error(f"Данные за {month_data.month}/{month_data.year} не были сохранены: {traceback.format_exc()}")
         return {"status": "error", "message": str(e)}
 
 
+@app.post("/api/concentrate-quality/import")
+async def import_concentrate_sheet(
+        month: Annotated[int, Query(..., gt=0, le=12)],
+        year: Annotated[int, Query(..., gt=2000)],
+        request: Request,
+        replace: Annotated[bool, Query()] = False,
+        mode: Annotated[Optional[str], Query(pattern=WRITE_MODE_PATTERN)] = None,
+        delimiter: Annotated[Optional[str], Query(max_length=1)] = None,
+        partial: Annotated[bool, Query()] = False
+):
+    """
+    Сохраняем данные концентратов из таблицы, вставленной из Excel (CSV/TSV в теле запроса).
+    Тело читается потоково, проверяется по колонкам и записывается пачками через COPY в одной транзакции.
+    Колонки: наименование, железо, кремний, алюминий, кальций, сера. Заголовок необязателен. Ошибки строк
+    (строка - номер строки документа) собираются по всей таблице, как в POST /api/concentrate-quality.
+
+    :param month: Месяц
+    :param year: Год
+    :param request: Запрос FastAPI
+    :param replace: Перезаписать данные пользователя за месяц (то же, что mode=replace)
+    :param mode: Режим записи: append, replace, upsert или sync, см. POST /api/concentrate-quality
+    :param delimiter: Разделитель колонок, по умолчанию определяется автоматически
+    :param partial: Записать строки без ошибок, отклонив остальные (только в режимах append и upsert)
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    mode = write_mode(mode, replace)
+    check_partial_mode(mode, partial)
+    logger.info(f"Пользователь {current_user['username']} импортирует таблицу за {month}/{year} (режим {mode})")
+    started = time.perf_counter()
+    errors = RowErrors()
+    batches = iter_sheet_batches(request.stream(), BULK_INSERT_BATCH_SIZE, delimiter, errors, partial)
+    result = await db_service.insert_concentrate_batches(month, year, current_user, batches, mode)
+    elapsed = time.perf_counter() - started
+    invalidate_month_cache(current_user['id'], year, month)
+
+    logger.info(f"Таблица за {month}/{year} импортирована: {write_summary(result)} за {elapsed:.3f} с "
+                f"({rows_per_sec(result.rows, elapsed)} строк/с){rejected_rows_note(errors)}")
+    return write_response(result, elapsed, errors, partial)
+
+
+@app.post("/api/concentrate-quality/batch")
+async def save_concentrate_batch(
+        months: Annotated[List[Any], Body()],
+        request: Request,
+        mode: Annotated[Optional[str], Query(pattern=WRITE_MODE_PATTERN)] = None,
+        atomic: Annotated[bool, Query()] = False
+):
+    """
+    Пакетное сохранение данных за несколько месяцев (например, загрузка истории за год) одним запросом: список
+    объектов в формате тела POST /api/concentrate-quality. Каждый месяц проверяется отдельно, все месяцы пишутся
+    одним соединением в одной транзакции, каждый - в своей точке сохранения. В ответе итог по каждому месяцу:
+    status=ok и счетчики строк или status=error и ошибки. Общий status: ok, partial (часть месяцев не записана) или
+    error (не записан ни один месяц).
+
+    :param months: Данные за месяцы
+    :param request: Запрос FastAPI
+    :param mode: Режим записи каждого месяца: append, replace, upsert или sync, см. POST /api/concentrate-quality
+    :param atomic: Записать все месяцы или, при ошибке в любом из них, ни одного
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    check_batch_size(len(months))
+    valid, rejected = validate_months(months)
+    return await write_batch(current_user, valid, rejected, write_mode(mode, False), atomic)
+
+
+@app.post("/api/concentrate-quality/batch/import")
+async def import_concentrate_batch_sheet(
+        request: Request,
+        mode: Annotated[Optional[str], Query(pattern=WRITE_MODE_PATTERN)] = None,
+        atomic: Annotated[bool, Query()] = False,
+        delimiter: Annotated[Optional[str], Query(max_length=1)] = None
+):
+    """
+    Пакетное сохранение данных за несколько месяцев из одной таблицы (CSV/TSV в теле запроса). Колонки: месяц
+    (ГГГГ-ММ или ММ.ГГГГ), наименование, железо, кремний, алюминий, кальций, сера. Заголовок необязателен, строки
+    месяцев могут идти в любом порядке. Запись и ответ - как в POST /api/concentrate-quality/batch.
+
+    :param request: Запрос FastAPI
+    :param mode: Режим записи каждого месяца: append, replace, upsert или sync, см. POST /api/concentrate-quality
+    :param atomic: Записать все месяцы или, при ошибке в любом из них, ни одного
+    :param delimiter: Разделитель колонок, по умолчанию определяется автоматически
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    valid, rejected = await parse_months_sheet(request.stream(), delimiter)
+    check_batch_size(len(valid) + len(rejected))
+    return await write_batch(current_user, valid, rejected, write_mode(mode, False), atomic)
+
+
+def check_batch_size(months: int):
+    """
+    Проверяем количество месяцев в пакете.
+
+    :param months: Количество месяцев
+    :return:
+    """
+    if not months:
+        raise InvalidBatchException("Пакет не содержит данных")
+    if months > BATCH_MAX_MONTHS:
+        raise InvalidBatchException(f"Месяцев в пакете: {months}, допускается не больше {BATCH_MAX_MONTHS}")
+
+
+async def write_batch(current_user: Record, valid: List[MonthData], rejected: List[Dict[str, Any]], mode: str,
+                      atomic: bool) -> Dict[str, Any]:
+    """
+    Запись проверенных месяцев пакета и ответ с итогом по каждому месяцу. При atomic и ошибках проверки в БД ничего
+    не пишется.
+
+    :param current_user: Пользователь
+    :param valid: Прошедшие проверку месяцы
+    :param rejected: Итоги отклоненных при проверке месяцев
+    :param mode: Режим записи
+    :param atomic: Записать все месяцы или ни одного
+    :return:
+    """
+    logger.info(f"Пользователь {current_user['username']} сохраняет пакет за {len(valid) + len(rejected)} мес. "
+                f"(режим {mode}{', атомарно' if atomic else ''}), не прошли проверку: {len(rejected)}")
+    started = time.perf_counter()
+    if atomic and rejected:
+        outcomes = [
+            MonthWriteOutcome(month_data.month, month_data.year, None, BATCH_ROLLED_BACK_MESSAGE)
+            for month_data in valid
+        ]
+    else:
+        outcomes = await db_service.insert_concentrate_months(valid, current_user, mode, atomic)
+    elapsed = time.perf_counter() - started
+
+    items = list(rejected)
+    totals = WriteResult(0, 0, 0, 0, 0)
+    for outcome in outcomes:
+        if outcome.error:
+            items.append(month_error(outcome.month, outcome.year, outcome.error))
+            continue
+        invalidate_month_cache(current_user['id'], outcome.year, outcome.month)
+        totals = WriteResult(*(total + value for total, value in zip(totals, outcome.result)))
+        items.append({"month": outcome.month, "year": outcome.year, "status": "ok", **outcome.result._asdict()})
+    items.sort(key=lambda item: (item["year"] or 0, item["month"] or 0))
+
+    written = sum(item["status"] == "ok" for item in items)
+    status = "ok" if written == len(items) else "partial" if written else "error"
+    logger.info(f"Пакет сохранен: записано месяцев {written} из {len(items)}, {write_summary(totals)} за "
+                f"{elapsed:.3f} с ({rows_per_sec(totals.rows, elapsed)} строк/с)")
+    return {"status": status, **totals._asdict(), "rows_per_sec": rows_per_sec(totals.rows, elapsed), "months": items}
+
+
+def check_partial_mode(mode: str, partial: bool):
+    """
+    Частичная запись допустима только в режимах, которые не удаляют строки, отсутствующие в запросе: иначе
+    отклоненная строка была бы удалена из сохраненных данных.
+
+    :param mode: Режим записи
+    :param partial: Частичная запись
+    :return:
+    """
+    if partial and mode not in PARTIAL_WRITE_MODES:
+        raise PartialWriteModeException(mode)
+
+
+def check_row_errors(errors: RowErrors, partial: bool, accepted: int):
+    """
+    Отказ в записи при ошибках строк: всегда без partial, с partial - если не осталось ни одной строки.
+
+    :param errors: Ошибки строк
+    :param partial: Частичная запись
+    :param accepted: Строк без ошибок
+    :return:
+    """
+    if errors.total and (not partial or not accepted):
+        raise RowValidationException(errors.as_dict())
+
+
+def rejected_rows_note(errors: RowErrors) -> str:
+    """
+    Отклоненные строки для логов.
+
+    :param errors: Ошибки строк
+    :return:
+    """
+    return f", отклонено строк: {errors.rejected_rows}" if errors.rejected_rows else ""
+
+
+def write_response(result: WriteResult, elapsed: float, errors: RowErrors, partial: bool) -> Dict[str, Any]:
+    """
+    Ответ записи данных за месяц. С partial в ответе отклоненные строки и их ошибки, status=partial, если они есть.
+
+    :param result: Итог записи
+    :param elapsed: Время записи, с
+    :param errors: Ошибки строк
+    :param partial: Частичная запись
+    :return:
+    """
+    response = {"status": "partial" if errors.total else "ok", **result._asdict(),
+                "rows_per_sec": rows_per_sec(result.rows, elapsed)}
+    if partial:
+        response.update(errors.as_dict())
+    return response
+
+
+def write_mode(mode: Optional[str], replace: bool) -> str:
+    """
+    Режим записи из параметров запроса: mode, либо replace для совместимости со старыми клиентами.
+
+    :param mode: Режим записи
+    :param replace: Перезаписать данные за месяц
+    :return:
+    """
+    if mode:
+        return mode
+    return "replace" if replace else "append"
+
+
+def write_summary(result: WriteResult) -> str:
+    """
+    Итог записи для логов.
+
+    :param result: Итог записи
+    :return:
+    """
+    return (f"{result.rows} строк, добавлено {result.inserted}, изменено {result.updated}, удалено {result.deleted}, "
+            f"без изменений {result.unchanged}")
+
+
+def rows_per_sec(rows: int, elapsed: float) -> float:
+    """
+    Скорость записи для ответа и логов.
+
+    :param rows: Количество строк
+    :param elapsed: Время в секундах
+    :return:
+    """
+    return round(rows / elapsed, 1) if elapsed > 0 else float(rows)
+
+
 @app.get("/api/concentrate-quality", response_model=MonthData)
 async def get_concentrate_data(
         month: Annotated[int, Query(..., gt=0, le=12)],
@@ -141,6 +646,8 @@ async def get_concentrate_data(
 ):
     """
     Получение данных за конкретный месяц и год. На фронте не используется.
+    Ответ содержит ETag по версии данных за месяц, при совпадении If-None-Match возвращается 304 без чтения строк.
+    Данные закрытого месяца отдаются из снимка.
 
     :param month: Месяц
     :param year: Год
@@ -152,28 +659,48 @@ async def get_concentrate_data(
         return RedirectResponse('/')
 
     logger.info(f"Пользователь {current_user['username']} запросил данные за {month}/{year}")
+    version = await db_service.get_data_version(month, year, current_user['id'])
+    etag = make_etag("data", current_user['id'], year, month, version)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+
+    cache_key = ("data", current_user['id'], year, month)
+    cached = response_cache.get(cache_key)
+    if cached and cached[0] == version:
+        return json_response(cached[1], headers=cache_headers(etag))
+
+    snapshot = month_snapshots.get(current_user['id'], year, month, version)
+    if snapshot:
+        return json_response(snapshot.body("data"), headers=cache_headers(etag))
+
     records = await db_service.get_concentrate_data(month, year, current_user['id'])
 
     if not records:
         logger.info(f"Нет данных за {month}/{year}")
-        return MonthData(month=month, year=year, data=[])
 
-    data = [ConcentrateRecord(**record) for record in records]
-    return MonthData(month=month, year=year, data=data)
+    # Строки из БД уже прошли проверку при записи, поэтому сериализуем их напрямую, без ConcentrateRecord/MonthData
+    body = dumps(month_data_content(month, year, records))
+    response_cache.set(cache_key, (version, body))
+    return json_response(body, headers=cache_headers(etag))
 
 
 @app.get("/api/concentrate-quality/summary", response_model=SummaryResponse)
 async def get_concentrate_summary(
         month: Annotated[int, Query(..., gt=0, le=12)],
         year: Annotated[int, Query(..., gt=2000)],
-        request: Request
+        request: Request,
+        extended: Annotated[bool, Query()] = False
 ):
     """
-    Получаем отчет за выбранный месяц и год.
+    Получаем отчет за выбранный месяц и год. По умолчанию отчет берется из помесячной сводки, при SUMMARY_ENGINE=sql
+    агрегаты считаются одним запросом в БД, при SUMMARY_ENGINE=numpy - векторно по строкам в приложении,
+    при SUMMARY_ENGINE=python - эталонным расчетом по строкам (используется для сверки результатов). Ответ содержит ETag по версии данных за месяц и кэшируется на сервере.
+    Отчет закрытого месяца отдается из снимка.
 
     :param month: Месяц
     :param year: Год
     :param request: Запрос FastAPI
+    :param extended: Добавить стандартное отклонение, медиану и 5-й/95-й процентили
     :return:
     """
     current_user = await auth_service.get_user_from_request(request)
@@ -181,33 +708,520 @@ async def get_concentrate_summary(
         return RedirectResponse('/')
 
     logger.info(f"Пользователь {current_user['username']} запросил отчет за {month}/{year}")
-    records = await db_service.get_concentrate_data(month, year, current_user['id'])
+    kind = "summary-extended" if extended else "summary"
+    version = await db_service.get_data_version(month, year, current_user['id'])
+    etag = make_etag(kind, current_user['id'], year, month, version)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=cache_headers(etag))
 
-    if not records:
+    cache_key = (kind, current_user['id'], year, month)
+    cached = response_cache.get(cache_key)
+    if cached and cached[0] == version:
+        return json_response(cached[1], headers=cache_headers(etag))
+
+    snapshot = month_snapshots.get(current_user['id'], year, month, version)
+    if snapshot:
+        return json_response(snapshot.body(kind), headers=cache_headers(etag))
+
+    summary = await build_summary(month, year, current_user['id'], extended)
+    if not summary:
         logger.warning(f"Нет данных для отчета за {month}/{year}")
         raise NoDataException
 
-    # Подготовка данных для статистики
-    iron_vals = [record["iron"] for record in records]
-    silicon_vals = [record["silicon"] for record in records]
-    aluminum_vals = [record["aluminum"] for record in records]
-    calcium_vals = [record["calcium"] for record in records]
-    sulfur_vals = [record["sulfur"] for record in records]
-
     logger.info(f"Отчет за {month}/{year} успешно сформирован")
 
-    return SummaryResponse(
-        month=month,
-        year=year,
-        count=len(records),
-        iron=calculate_stats(iron_vals),
-        silicon=calculate_stats(silicon_vals),
-        aluminum=calculate_stats(aluminum_vals),
-        calcium=calculate_stats(calcium_vals),
-        sulfur=calculate_stats(sulfur_vals)
+    body = dumps(summary.model_dump())
+    response_cache.set(cache_key, (version, body))
+    return json_response(body, headers=cache_headers(etag))
+
+
+async def build_summary(month: int, year: int, user_id: int, extended: bool) -> Optional[SummaryResponse]:
+    """
+    Формируем отчет за месяц выбранным в SUMMARY_ENGINE способом.
+
+    :param month: Месяц
+    :param year: Год
+    :param user_id: Id пользователя в БД
+    :param extended: Добавить дополнительные показатели
+    :return: Отчет или None, если данных нет
+    """
+    if SUMMARY_ENGINE == "python":
+        records = await db_service.get_concentrate_data(month, year, user_id)
+        count = len(records)
+        summary = summarize_records(records, extended) if records else None
+    elif SUMMARY_ENGINE == "numpy":
+        records = await db_service.get_concentrate_data(month, year, user_id)
+        count = len(records)
+        summary = calculate_stats_matrix(records_to_matrix(records), extended) if records else None
+    else:
+        if SUMMARY_ENGINE == "rollup" and not extended:
+            row = await db_service.get_monthly_stats(month, year, user_id)
+        else:
+            # Дополнительные показатели в сводке не хранятся, считаем их по строкам в БД
+            row = await db_service.get_concentrate_summary(month, year, user_id, extended)
+        count = row["count"] if row else 0
+        summary = summarize_aggregates(row, extended) if row else None
+
+    if not summary:
+        return None
+    return SummaryResponse(month=month, year=year, count=count, **summary)
+
+
+@app.post("/api/concentrate-quality/close", response_model=ClosedMonth)
+async def close_month(
+        month: Annotated[int, Query(..., gt=0, le=12)],
+        year: Annotated[int, Query(..., gt=2000)],
+        request: Request
+):
+    """
+    Закрываем месяц: сохраняем на диск снимок данных месяца с готовыми ответами GET /api/concentrate-quality и
+    /summary, после чего они отдаются из снимка без обращения к строкам в БД. Если данные за месяц потом изменятся,
+    снимок перестает использоваться и месяц снова считается открытым. Повторный вызов перестраивает снимок.
+
+    :param month: Месяц
+    :param year: Год
+    :param request: Запрос FastAPI
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    logger.info(f"Пользователь {current_user['username']} закрывает месяц {month}/{year}")
+    snapshot = await build_month_snapshot(month, year, current_user['id'])
+    month_snapshots.remember(current_user['id'], year, month, snapshot)
+    logger.info(f"Месяц {month}/{year} закрыт: {snapshot.count} строк, версия данных {snapshot.version}")
+    return ClosedMonth(
+        month=month, year=year, version=snapshot.version, count=snapshot.count, closed_at=snapshot.closed_at
+    )
+
+
+@app.delete("/api/concentrate-quality/close")
+async def reopen_month(
+        month: Annotated[int, Query(..., gt=0, le=12)],
+        year: Annotated[int, Query(..., gt=2000)],
+        request: Request
+):
+    """
+    Открываем закрытый месяц: удаляем его снимок.
+
+    :param month: Месяц
+    :param year: Год
+    :param request: Запрос FastAPI
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    reopened = month_snapshots.invalidate(current_user['id'], year, month)
+    logger.info(f"Пользователь {current_user['username']} открыл месяц {month}/{year}" if reopened
+                else f"Месяц {month}/{year} не был закрыт")
+    return {"status": "ok", "reopened": reopened}
+
+
+async def build_month_snapshot(month: int, year: int, user_id: int) -> MonthSnapshot:
+    """
+    Строим и сохраняем снимок месяца. Версия данных читается до и после чтения строк и отчетов: если данные
+    изменились в промежутке, снимок не сохраняется, так как содержал бы данные другой версии.
+
+    :param month: Месяц
+    :param year: Год
+    :param user_id: Id пользователя в БД
+    :return:
+    """
+    version = await db_service.get_data_version(month, year, user_id)
+    records = await db_service.get_concentrate_data(month, year, user_id)
+    if not records:
+        raise NoDataException
+    summary = await build_summary(month, year, user_id, extended=False)
+    summary_extended = await build_summary(month, year, user_id, extended=True)
+    if await db_service.get_data_version(month, year, user_id) != version:
+        raise MonthChangedException
+
+    bodies = {
+        "data": dumps(month_data_content(month, year, records)),
+        "summary": dumps(summary.model_dump()),
+        "summary-extended": dumps(summary_extended.model_dump()),
+    }
+    names = [record["name"] for record in records]
+    return await asyncio.to_thread(
+        month_snapshots.write, user_id, year, month, version, names, records_to_matrix(records).T, bodies
+    )
+
+
+@app.get("/api/concentrate-quality/range", response_model=RangeSummaryItem)
+async def get_concentrate_range_summary(
+        period_from: Annotated[str, Query(..., alias="from", pattern=PERIOD_PATTERN)],
+        period_to: Annotated[str, Query(..., alias="to", pattern=PERIOD_PATTERN)],
+        request: Request,
+        by_name: Annotated[bool, Query()] = False
+):
+    """
+    Отчет за период (from=2024-01&to=2025-06) одним запросом: по каждому месяцу, при by_name - по каждому концентрату
+    в месяце, и итог за весь период. Ответ передается потоком в формате NDJSON, по одному RangeSummaryItem в строке.
+
+    :param period_from: Начало периода, ГГГГ-ММ
+    :param period_to: Окончание периода включительно, ГГГГ-ММ
+    :param request: Запрос FastAPI
+    :param by_name: Добавить разбивку по концентратам
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    start, end = parse_period_range(period_from, period_to)
+    logger.info(f"Пользователь {current_user['username']} запросил отчет за период {period_from} - {period_to}")
+
+    rows = db_service.iter_period_summary(current_user['id'], start, end, by_name)
+    first = await anext(rows, None)
+    if first is None:
+        logger.warning(f"Нет данных для отчета за период {period_from} - {period_to}")
+        raise NoDataException
+
+    async def stream():
+        row = first
+        try:
+            while row is not None:
+                yield range_summary_item(row).model_dump_json(exclude_none=True) + "\n"
+                row = await anext(rows, None)
+        finally:
+            # Возвращаем соединение в пул, даже если клиент отключился посреди ответа
+            await rows.aclose()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/api/concentrate-quality/trends", response_model=TrendsResponse)
+async def get_concentrate_trends(
+        period_from: Annotated[str, Query(..., alias="from", pattern=PERIOD_PATTERN)],
+        period_to: Annotated[str, Query(..., alias="to", pattern=PERIOD_PATTERN)],
+        request: Request,
+        name: Annotated[Optional[List[str]], Query()] = None,
+        metric: Annotated[Optional[List[str]], Query()] = None,
+        window: Annotated[int, Query(ge=1, le=TRENDS_MAX_WINDOW)] = 3,
+        spec: Annotated[Optional[List[str]], Query()] = None
+):
+    """
+    Тренды по концентратам за период (from=2024-01&to=2025-12): для каждого концентрата - показатели по месяцам,
+    скользящее среднее за window календарных месяцев и флаги значений за пределами норм. Ряды строятся одним
+    запросом по всем месяцам периода. Ответ содержит ETag по версии данных за период и кэшируется на сервере.
+
+    :param period_from: Начало периода, ГГГГ-ММ
+    :param period_to: Окончание периода включительно, ГГГГ-ММ
+    :param request: Запрос FastAPI
+    :param name: Наименования концентратов (можно несколько), по умолчанию - все
+    :param metric: Показатели (можно несколько), по умолчанию - все
+    :param window: Окно скользящего среднего в месяцах
+    :param spec: Нормы показателей вида iron>=62 или sulfur<=0.3 (можно несколько), дополняют QUALITY_SPEC
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    start, end = parse_period_range(period_from, period_to)
+    metrics = parse_metrics(metric)
+    limits = parse_spec(spec or [], DEFAULT_QUALITY_SPEC)
+    logger.info(f"Пользователь {current_user['username']} запросил тренды за период {period_from} - {period_to}")
+
+    params = trends_cache_params(start, end, name, metrics, window, limits)
+    # Скользящее среднее в начале периода зависит и от месяцев перед ним
+    version = await db_service.get_period_version(current_user['id'], shift_period(start, 1 - window), end)
+    etag = make_params_etag("trends", current_user['id'], params, version)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+
+    cache_key = ("trends", current_user['id'], params)
+    cached = response_cache.get(cache_key)
+    if cached and cached[0] == version:
+        return json_response(cached[1], headers=cache_headers(etag))
+
+    rows = await db_service.get_concentrate_trends(current_user['id'], start, end, name, window)
+    if not rows:
+        logger.warning(f"Нет данных для трендов за период {period_from} - {period_to}")
+        raise NoDataException
+
+    trends = TrendsResponse(
+        period_from=format_period(start), period_to=format_period(end), window=window, metrics=metrics,
+        spec=limits, series=build_trend_series(rows, metrics, limits)
+    )
+    logger.info(f"Тренды за период {period_from} - {period_to} сформированы: {len(trends.series)} концентратов")
+
+    body = dumps(trends.model_dump())
+    response_cache.set(cache_key, (version, body))
+    return json_response(body, headers=cache_headers(etag))
+
+
+@app.get("/api/organization/summary", response_model=List[OrganizationSummaryItem])
+async def get_organization_summary(
+        period_from: Annotated[str, Query(..., alias="from", pattern=PERIOD_PATTERN)],
+        period_to: Annotated[str, Query(..., alias="to", pattern=PERIOD_PATTERN)],
+        request: Request,
+        users: Annotated[Optional[List[str]], Query(alias="user")] = None,
+        by_name: Annotated[bool, Query()] = False
+):
+    """
+    Отчет по всей организации за период (from=2024-01&to=2025-06): по каждому месяцу, при by_name - по каждому
+    концентрату в месяце, и итог за период. Считается объединением частичных агрегатов пользователей из помесячной
+    сводки (количество, сумма, минимум, максимум, сумма квадратов), поэтому среднее, минимум, максимум и
+    стандартное отклонение точные, а строки данных для этого не читаются. Отчет раскрывает данные всех
+    пользователей, поэтому доступен только логинам из ORGANIZATION_SUMMARY_USERS, остальным - 403.
+
+    :param period_from: Начало периода, ГГГГ-ММ
+    :param period_to: Окончание периода включительно, ГГГГ-ММ
+    :param request: Запрос FastAPI
+    :param users: Только данные указанных пользователей (user=admin&user=operator), по умолчанию - все
+    :param by_name: Добавить разбивку по концентратам
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+    if current_user['username'] not in ORGANIZATION_SUMMARY_USERS:
+        logger.warning(f"Пользователю {current_user['username']} отказано в доступе к отчету по организации")
+        raise PermissionDeniedException
+
+    start, end = parse_period_range(period_from, period_to)
+    logger.info(f"Пользователь {current_user['username']} запросил отчет по организации за период {period_from} - "
+                f"{period_to}")
+
+    rows = await db_service.get_organization_summary(start, end, users, by_name)
+    if not rows:
+        logger.warning(f"Нет данных для отчета по организации за период {period_from} - {period_to}")
+        raise NoDataException
+
+    items = [
+        OrganizationSummaryItem(
+            kind=row["kind"], month=row["month"], year=row["year"], name=row["name"],
+            users=row["users"], count=row["count"], **summarize_partials(row)
+        ).model_dump(exclude_none=True)
+        for row in rows
+    ]
+    return json_response(dumps(items))
+
+
+@app.get("/api/concentrate-quality/export")
+async def export_concentrate_data(
+        request: Request,
+        export_format: Annotated[str, Query(alias="format", pattern="^(csv|ndjson|columnar)$")] = "csv",
+        period_from: Annotated[Optional[str], Query(alias="from", pattern=PERIOD_PATTERN)] = None,
+        period_to: Annotated[Optional[str], Query(alias="to", pattern=PERIOD_PATTERN)] = None
+):
+    """
+    Потоковая выгрузка данных пользователя за период (по умолчанию - вся история) в CSV, NDJSON или колоночном
+    двоичном формате (см. utils/export_utils.py). Строки читаются серверным курсором пачками, поэтому расход памяти
+    не зависит от объема выгрузки.
+
+    :param request: Запрос FastAPI
+    :param export_format: csv, ndjson или columnar
+    :param period_from: Начало периода, ГГГГ-ММ
+    :param period_to: Окончание периода включительно, ГГГГ-ММ
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    start = parse_period(period_from) if period_from else None
+    end = parse_period(period_to) if period_to else None
+    if start and end:
+        start, end = parse_period_range(period_from, period_to)
+    logger.info(f"Пользователь {current_user['username']} выгружает данные в формате {export_format}")
+
+    batches = db_service.iter_concentrate_rows(current_user['id'], start, end, EXPORT_BATCH_SIZE)
+
+    async def stream():
+        try:
+            async for chunk in encode_export(batches, export_format):
+                yield chunk
+        finally:
+            # Возвращаем соединение в пул, даже если клиент отключился посреди выгрузки
+            await batches.aclose()
+
+    extension = "bin" if export_format == "columnar" else export_format
+    return StreamingResponse(
+        stream(),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="concentrate_quality.{extension}"'}
     )
 
 
+@app.post("/api/jobs/import", response_model=JobStatus, status_code=202)
+async def submit_import_job(
+        month: Annotated[int, Query(..., gt=0, le=12)],
+        year: Annotated[int, Query(..., gt=2000)],
+        request: Request,
+        mode: Annotated[str, Query(pattern=WRITE_MODE_PATTERN)] = "replace",
+        delimiter: Annotated[Optional[str], Query(max_length=1)] = None,
+        partial: Annotated[bool, Query()] = False
+):
+    """
+    Ставим импорт таблицы в очередь фоновых задач. Параметры и тело запроса как у POST
+    /api/concentrate-quality/import, ответ возвращается сразу после сохранения таблицы в задаче, запись выполняет
+    воркер. Состояние задачи - GET /api/jobs/{job_id}, итог записи - GET /api/jobs/{job_id}/result.
+
+    :param month: Месяц
+    :param year: Год
+    :param request: Запрос FastAPI
+    :param mode: Режим записи: append, replace, upsert или sync
+    :param delimiter: Разделитель колонок, по умолчанию определяется автоматически
+    :param partial: Записать строки без ошибок, отклонив остальные (только в режимах append и upsert)
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    check_partial_mode(mode, partial)
+    payload = await request.body()
+    job = await db_service.submit_job(
+        "import", current_user['id'],
+        {"month": month, "year": year, "mode": mode, "delimiter": delimiter, "partial": partial}, payload
+    )
+    logger.info(f"Пользователь {current_user['username']} поставил в очередь импорт таблицы за {month}/{year} "
+                f"({len(payload)} байт), задача {job['id']}")
+    return job_status(job)
+
+
+@app.post("/api/jobs/report", response_model=JobStatus, status_code=202)
+async def submit_report_job(
+        period_from: Annotated[str, Query(..., alias="from", pattern=PERIOD_PATTERN)],
+        period_to: Annotated[str, Query(..., alias="to", pattern=PERIOD_PATTERN)],
+        request: Request,
+        by_name: Annotated[bool, Query()] = False
+):
+    """
+    Ставим отчет за период в очередь фоновых задач. Параметры как у GET /api/concentrate-quality/range, результат
+    (NDJSON) сохраняется в задаче и может скачиваться повторно.
+
+    :param period_from: Начало периода, ГГГГ-ММ
+    :param period_to: Окончание периода включительно, ГГГГ-ММ
+    :param request: Запрос FastAPI
+    :param by_name: Добавить разбивку по концентратам
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    start, end = parse_period_range(period_from, period_to)
+    job = await db_service.submit_job("report", current_user['id'], {"from": start, "to": end, "by_name": by_name})
+    logger.info(f"Пользователь {current_user['username']} поставил в очередь отчет за период {period_from} - "
+                f"{period_to}, задача {job['id']}")
+    return job_status(job)
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: int, request: Request):
+    """
+    Состояние фоновой задачи пользователя.
+
+    :param job_id: Id задачи
+    :param request: Запрос FastAPI
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    job = await db_service.get_job(job_id, current_user['id'])
+    if not job:
+        raise JobNotFoundException
+    return job_status(job)
+
+
+@app.get("/api/jobs/{job_id}/events", response_model=JobStatus)
+async def stream_job_status(job_id: int, request: Request):
+    """
+    Состояние фоновой задачи потоком NDJSON: JobStatus при каждом изменении статуса, поток завершается, когда
+    задача выполнена (done) или завершилась с ошибкой (failed). Состояние проверяется раз в JOB_POLL_INTERVAL
+    секунд, соединение с БД между проверками не удерживается.
+
+    :param job_id: Id задачи
+    :param request: Запрос FastAPI
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    job = await db_service.get_job(job_id, current_user['id'])
+    if not job:
+        raise JobNotFoundException
+
+    async def stream():
+        current, previous = job, None
+        while True:
+            if current["status"] != previous:
+                previous = current["status"]
+                yield job_status(current).model_dump_json() + "\n"
+            if previous in ("done", "failed"):
+                return
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            current = await db_service.get_job(job_id, current_user['id'])
+            if current is None:
+                return
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: int, request: Request):
+    """
+    Результат выполненной задачи: итог записи (JSON) для импорта или NDJSON для отчета. Результат не меняется,
+    поэтому ETag зависит только от задачи и при совпадении If-None-Match возвращается 304.
+
+    :param job_id: Id задачи
+    :param request: Запрос FastAPI
+    :return:
+    """
+    current_user = await auth_service.get_user_from_request(request)
+    if not current_user:
+        return RedirectResponse('/')
+
+    etag = make_job_etag(current_user['id'], job_id)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        job = await db_service.get_job(job_id, current_user['id'])
+        if job and job["status"] == "done":
+            return Response(status_code=304, headers=cache_headers(etag))
+
+    job = await db_service.get_job_result(job_id, current_user['id'])
+    if not job:
+        raise JobNotFoundException
+    if job["status"] != "done":
+        raise JobNotFinishedException(job["status"])
+
+    headers = cache_headers(etag)
+    if job["kind"] == "report":
+        headers["Content-Disposition"] = f'attachment; filename="concentrate_report_{job_id}.ndjson"'
+    return Response(job["result"], media_type=job["result_type"], headers=headers)
+
+
+def job_status(job: Record) -> JobStatus:
+    """
+    Модель состояния задачи из строки jobs.
+
+    :param job: Строка jobs (колонки JOB_STATUS_COLUMNS)
+    :return:
+    """
+    return JobStatus(**{**job, "params": json.loads(job["params"])})
+
+
+def invalidate_month_cache(user_id: int, year: int, month: int):
+    """
+    Удаляем из серверного кэша ответы за месяц после записи данных.
+
+    :param user_id: Id пользователя в БД
+    :param year: Год
+    :param month: Месяц
+    :return:
+    """
+    for kind in RESPONSE_CACHE_KINDS:
+        response_cache.pop((kind, user_id, year, month))
+
+
 @app.post("/users/", response_model=User)
 async def create_user(user: UserCreate):
     """
@@ -219,16 +1233,111 @@ async def create_user(user: UserCreate):
     try:
         logger.info(f"Создаем нового пользователя: {user.username}")
         db_user = await db_service.insert_user(user.username,
-            auth_service.get_password_hash(user.password))
-    except asyncpg.exceptions.UniqueViolationError:
+            await auth_service.async_get_password_hash(user.password))
+    except UserAlreadyExistException:
         logger.warning(f"Пользователь {user.username} уже существует")
-        raise UserAlreadyExistException
+        raise
 
     logger.info(f"Пользователь {user.username} успешно создан")
     return User(**db_user)
 
 
+@app.get("/api/service/db-pool")
+async def get_db_pool_stats():
+    """
+    Состояние пула соединений с БД: размер, занятые и свободные соединения, ожидающие запросы.
+
+    :return:
+    """
+    return db_service.pool_stats()
+
+
+@app.get("/api/service/auth-cache")
+async def get_auth_cache_stats():
+    """
+    Счетчики кэша аутентификации: попадания, промахи, вытеснения.
+
+    :return:
+    """
+    return auth_service.cache_stats()
+
+
+@app.get("/api/service/password-hashing")
+async def get_password_hashing_stats():
+    """
+    Состояние пула хэширования паролей: глубина очереди, выполняемые и завершенные операции.
+
+    :return:
+    """
+    return auth_service.password_hasher.stats()
+
+
+@app.get("/api/service/job-worker")
+async def get_job_worker_stats():
+    """
+    Счетчики воркера фоновых задач в процессе приложения: выполняемые, выполненные и завершенные с ошибкой задачи.
+
+    :return:
+    """
+    return job_worker.stats()
+
+
+@app.get("/api/service/admission")
+async def get_admission_stats():
+    """
+    Состояние контроля нагрузки: допущенные и отклоненные запросы по ограничителям частоты, выполняемые и
+    ожидающие запросы по группам маршрутов.
+
+    :return:
+    """
+    return admission.stats()
+
+
+@app.get("/api/service/response-cache")
+async def get_response_cache_stats():
+    """
+    Счетчики серверного кэша ответов за месяц.
+
+    :return:
+    """
+    return response_cache.stats()
+
+
+@app.get("/api/service/month-snapshots")
+async def get_month_snapshot_stats():
+    """
+    Счетчики снимков закрытых месяцев в текущем процессе.
+
+    :return:
+    """
+    return month_snapshots.stats()
+
+
+@app.get("/ready")
+async def get_readiness():
+    """
+    Готовность приложения принимать запросы: 200, когда пул соединений создан и прогрет, схема БД актуальна
+    и дефолтные пользователи созданы, иначе 503. В ответе - число попыток подготовки, последняя ошибка и
+    длительности этапов старта, с.
+
+    :return:
+    """
+    return JSONResponse(startup.stats(), status_code=200 if startup.ready else 503)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Метрики приложения в текстовом формате Prometheus: задержки и размеры ответов по маршрутам, время получения
+    соединения и выполнения запросов к БД, время bcrypt и JWT, состояние пулов и кэшей.
+
+    :return:
+    """
+    return Response(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="172.20.0.3", port=8000)
+    # Для нескольких воркеров uvicorn приложение передается строкой импорта
+    uvicorn.run("app:app", host=APP_HOST, port=APP_PORT, workers=APP_WORKERS)
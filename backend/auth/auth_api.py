@@ -1,26 +1,41 @@
+import time
 import traceback
 import jwt
 
 from loguru import logger
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Dict
 from asyncpg import Record
 from datetime import datetime, timedelta
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
-from config import SECRET_KEY, ALGORITHM
-from db_service.database_api import PostgreSQLService
+from auth.password_hashing import PasswordHasher, build_crypt_context
+from config import SECRET_KEY, ALGORITHM, AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL, AUTH_USER_CACHE_SIZE, \
+    AUTH_USER_CACHE_TTL, BCRYPT_ROUNDS, PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, \
+    PASSWORD_HASH_MAX_CONCURRENCY, PASSWORD_HASH_MAX_QUEUE
+from db_service.storage import get_storage
 from exceptions.auth_exceptions import CredentialsException, CorruptedTokenException
 from model.concentrate_models import TokenData
 from patterns.singleton import Singleton
+from utils.cache import TTLCache
+from utils.metrics import JWT_SECONDS
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
 
 
 class Authenticator(Singleton):
     def __init__(self):
         try:
             super().__init__()
-            self.pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__ident="2b", deprecated="auto")
+            self.password_hasher = PasswordHasher(
+                BCRYPT_ROUNDS, PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS,
+                PASSWORD_HASH_MAX_CONCURRENCY, PASSWORD_HASH_MAX_QUEUE
+            )
             self.oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-            self.db_service = PostgreSQLService()
+            self.db_service = get_storage()
+            # Кэш токен -> логин (не дольше срока действия токена) и логин -> запись пользователя
+            self.token_cache = TTLCache(AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL)
+            self.user_cache = TTLCache(AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+            self.db_service.add_user_change_listener(self.invalidate_user)
         except:
             logger.error(f"Ошибка при инициализации класса Authenticator - {traceback.format_exc()}")
 
@@ -39,22 +54,30 @@ class Authenticator(Singleton):
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
         to_encode.update({"exp": expire})
+        started = time.perf_counter()
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        JWT_SECONDS.observe(time.perf_counter() - started, operation="encode")
         return encoded_jwt
 
     async def authenticate_user(self, username: str, password: str) -> Optional[Record]:
         """
-        Аутентификация пользователя.
+        Аутентификация пользователя. Проверка пароля выполняется в пуле хэширования, хэш с устаревшей стоимостью
+        bcrypt заменяется новым.
 
         :param username: Логин пользователя
         :param password: Пароль пользователя
         :return:
         """
-        user = await self.db_service.get_user(username)
+        user = await self.get_user(username)
         if not user:
             return None
-        if not self.verify_password(password, user["hashed_password"]):
+
+        verified, new_hash = await self.password_hasher.verify_and_update(password, user["hashed_password"])
+        if not verified:
             return None
+        if new_hash:
+            logger.info(f"Хэш пароля пользователя {username} обновлен до стоимости {BCRYPT_ROUNDS}")
+            await self.db_service.update_user_password(username, new_hash)
         return user
 
     async def get_current_user(self, token: str) -> Record:
@@ -64,22 +87,89 @@ class Authenticator(Singleton):
         :param token: Токен
         :return:
         """
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            username: str = payload.get("sub")
-            if username is None:
+        username = self.decode_username(token)
+        user = await self.get_user(username)
+        if user is None:
+            raise CredentialsException
+        return user
+
+    def decode_username(self, token: str, log_errors: bool = True) -> str:
+        """
+        Логин из токена с проверкой подписи и срока действия. Результат кэшируется до истечения токена.
+
+        :param token: Токен
+        :param log_errors: Писать ошибку JWT в лог
+        :return:
+        """
+        username = self.token_cache.get(token)
+        if username is None:
+            started = time.perf_counter()
+            try:
+                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+                username: str = payload.get("sub")
+                if username is None:
+                    raise CredentialsException
+
+                token_data = TokenData(username=username)
+            except jwt.PyJWTError as e:
+                if log_errors:
+                    logger.error(f"Ошибка JWT: {e}")
                 raise CredentialsException
+            finally:
+                JWT_SECONDS.observe(time.perf_counter() - started, operation="decode")
 
-            token_data = TokenData(username=username)
-        except jwt.PyJWTError as e:
-            logger.error(f"Ошибка JWT: {e}")
-            raise CredentialsException
+            username = token_data.username
+            expires_in = payload["exp"] - time.time() if "exp" in payload else None
+            self.token_cache.set(token, username, expires_in)
+        return username
 
-        user = await self.db_service.get_user(username=token_data.username)
+    def peek_username(self, authorization: Optional[str]) -> Optional[str]:
+        """
+        Логин из заголовка Authorization без обращения к БД и без исключений, например, для ограничения частоты
+        запросов до маршрутизации. Невалидный токен дает None без записи в лог: ошибку токена залогирует проверка
+        авторизации в обработчике запроса.
+
+        :param authorization: Значение заголовка Authorization
+        :return:
+        """
+        if not authorization or not authorization.startswith("Bearer "):
+            return None
+        try:
+            return self.decode_username(authorization.split(" ")[1], log_errors=False)
+        except CredentialsException:
+            return None
+
+    async def get_user(self, username: str) -> Optional[Record]:
+        """
+        Получаем пользователя по логину с кэшированием.
+
+        :param username: Логин пользователя
+        :return:
+        """
+        user = self.user_cache.get(username)
         if user is None:
-            raise CredentialsException
+            user = await self.db_service.get_user(username=username)
+            if user is not None:
+                self.user_cache.set(username, user)
         return user
 
+    def invalidate_user(self, username: str):
+        """
+        Удаляем пользователя из кэша. Вызывается при изменении пользователя в БД.
+
+        :param username: Логин пользователя
+        :return:
+        """
+        self.user_cache.pop(username)
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Счетчики кэшей аутентификации.
+
+        :return:
+        """
+        return {"tokens": self.token_cache.stats(), "users": self.user_cache.stats()}
+
     async def get_user_from_request(self, request):
         """
         Получаем пользователя из запроса.
@@ -96,6 +186,15 @@ class Authenticator(Singleton):
         current_user = await self.get_current_user(token)
         return current_user
 
+    @property
+    def pwd_context(self) -> "CryptContext":
+        """
+        Контекст passlib создается при первом обращении, а не в конструкторе.
+
+        :return:
+        """
+        return build_crypt_context(BCRYPT_ROUNDS)
+
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """
         Верификация пароля.
@@ -113,4 +212,13 @@ class Authenticator(Singleton):
         :param password: Пароль
         :return:
         """
-        return self.pwd_context.hash(password)
\ No newline at end of file
+        return self.pwd_context.hash(password)
+
+    async def async_get_password_hash(self, password: str) -> str:
+        """
+        Формирует хэш пароля в пуле хэширования, не блокирует event loop.
+
+        :param password: Пароль
+        :return:
+        """
+        return await self.password_hasher.hash(password)
\ No newline at end of file
@@ -0,0 +1,178 @@
+import asyncio
+import time
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from exceptions.auth_exceptions import PasswordHashingOverloadedException
+from utils.metrics import PASSWORD_HASH_WAIT_SECONDS, PASSWORD_HASH_SECONDS
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+@lru_cache(maxsize=None)
+def build_crypt_context(rounds: int) -> "CryptContext":
+    """
+    Контекст passlib для bcrypt с заданной стоимостью. Хэши с другой стоимостью считаются устаревшими и
+    перехэшируются при успешной проверке пароля. Кэшируется отдельно в каждом процессе. passlib импортируется
+    при первом вызове, а не при импорте модуля, чтобы не замедлять старт приложения.
+
+    :param rounds: Стоимость bcrypt (log2 числа раундов)
+    :return:
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["bcrypt"],
+        bcrypt__ident="2b",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+        deprecated="auto"
+    )
+
+
+def hash_password(password: str, rounds: int) -> str:
+    """
+    Хэш пароля. Функция уровня модуля, чтобы ее можно было выполнять в пуле процессов.
+
+    :param password: Пароль
+    :param rounds: Стоимость bcrypt
+    :return:
+    """
+    return build_crypt_context(rounds).hash(password)
+
+
+def verify_and_update_password(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    """
+    Проверка пароля. Если хэш получен с другой стоимостью, возвращается новый хэш.
+
+    :param password: Пароль
+    :param hashed_password: Хэш из БД
+    :param rounds: Стоимость bcrypt
+    :return: (пароль верный, новый хэш или None)
+    """
+    return build_crypt_context(rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Выполнение bcrypt в пуле потоков или процессов с ограничением числа одновременных операций, чтобы хэширование
+    не блокировало event loop.
+    """
+
+    def __init__(self, rounds: int, executor_kind: str, workers: int, max_concurrency: int, max_queue: int):
+        """
+        :param rounds: Стоимость bcrypt
+        :param executor_kind: thread или process
+        :param workers: Размер пула
+        :param max_concurrency: Максимум одновременно выполняемых операций
+        :param max_queue: Максимум ожидающих операций, при превышении запрос отклоняется (0 - без ограничения)
+        """
+        self.rounds = rounds
+        self.executor_kind = executor_kind
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def executor(self) -> Executor:
+        """
+        Пул создается при первом использовании.
+
+        :return:
+        """
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, func: Callable, *args) -> Any:
+        """
+        Выполняем функцию хэширования в пуле с учетом ограничения параллелизма.
+
+        :param func: Функция уровня модуля
+        :param args: Аргументы
+        :return:
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        if self.max_queue and self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHashingOverloadedException
+
+        operation = func.__name__
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        PASSWORD_HASH_WAIT_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started, operation=operation)
+            self.active -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        """
+        Асинхронный хэш пароля.
+
+        :param password: Пароль
+        :return:
+        """
+        return await self.run(hash_password, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Асинхронная проверка пароля с получением нового хэша при смене стоимости.
+
+        :param password: Пароль
+        :param hashed_password: Хэш из БД
+        :return:
+        """
+        return await self.run(verify_and_update_password, password, hashed_password, self.rounds)
+
+    def shutdown(self):
+        """
+        Останавливаем пул.
+
+        :return:
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Состояние пула хэширования: глубина очереди, выполняемые и завершенные операции.
+
+        :return:
+        """
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.waiting,
+            "active": self.active,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,76 @@
+"""
+Сравнение двух прогонов бенчмарков одного вида (load_test или micro).
+
+    python -m benchmarks.compare benchmarks/results/load-old.json benchmarks/results/load-new.json
+"""
+import argparse
+import json
+import sys
+
+from typing import Dict, Iterator, Tuple
+
+
+# Метрики, по которым сравниваются прогоны: (путь внутри результата, больше - лучше)
+LOAD_METRICS = (
+    (("throughput_rps",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("errors",), False),
+)
+MICRO_METRICS = (
+    (("best_us",), False),
+    (("median_us",), False),
+)
+
+
+def load(path: str) -> Dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def iter_rows(old: Dict, new: Dict) -> Iterator[Tuple[str, str, float, float, bool]]:
+    """
+    Пары значений общих сценариев двух прогонов.
+
+    :param old: Базовый прогон
+    :param new: Новый прогон
+    :return: (сценарий, метрика, старое значение, новое значение, больше - лучше)
+    """
+    section, metrics = ("scenarios", LOAD_METRICS) if old["kind"] == "load" else ("cases", MICRO_METRICS)
+    for name in old[section]:
+        if name not in new[section]:
+            continue
+        for path, higher_is_better in metrics:
+            old_value, new_value = old[section][name], new[section][name]
+            for key in path:
+                old_value, new_value = old_value[key], new_value[key]
+            yield name, ".".join(path), old_value, new_value, higher_is_better
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов двух прогонов бенчмарков")
+    parser.add_argument("old", help="Базовый прогон")
+    parser.add_argument("new", help="Новый прогон")
+    parser.add_argument("--threshold", type=float, default=10, help="Порог регрессии, %%")
+    args = parser.parse_args()
+
+    old, new = load(args.old), load(args.new)
+    if old["kind"] != new["kind"]:
+        sys.exit(f"Нельзя сравнить прогоны разного вида: {old['kind']} и {new['kind']}")
+    print(f"{old.get('commit')} ({old['started_at']}) -> {new.get('commit')} ({new['started_at']})")
+
+    regressions = 0
+    for name, metric, old_value, new_value, higher_is_better in iter_rows(old, new):
+        change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+        regression = (change < -args.threshold) if higher_is_better else (change > args.threshold)
+        regressions += regression
+        print(f"{name:<34} {metric:<16} {old_value:>12} -> {new_value:>12}  {change:+7.1f}%"
+              f"{'  РЕГРЕССИЯ' if regression else ''}")
+
+    # Ненулевой код возврата, чтобы сравнение можно было использовать как проверку
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Нагрузочный тест API: засеивает N пользователей x M месяцев x K концентратов и прогоняет сценарии
+/token, POST /api/concentrate-quality, GET /api/concentrate-quality и /summary с заданной конкурентностью.
+Результат (пропускная способность, p50/p95/p99) сохраняется в JSON для сравнения прогонов (benchmarks/compare.py).
+
+Запуск из каталога backend:
+
+    python -m benchmarks.load_test --base-url http://localhost:8000
+    python -m benchmarks.load_test --in-process    # приложение в том же процессе, БД из DATABASE_URL
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from benchmarks.report import latency_summary, save_results
+
+
+# Период, за который засеиваются данные, чтобы не пересекаться с реальными
+BENCH_YEAR = 2090
+BENCH_PASSWORD = "benchmark-password"
+
+
+def make_month_data(month: int, year: int, concentrates: int, rng: random.Random) -> Dict[str, Any]:
+    """
+    Тело запроса с данными за месяц.
+
+    :param month: Месяц
+    :param year: Год
+    :param concentrates: Количество концентратов
+    :param rng: Генератор случайных чисел
+    :return:
+    """
+    return {
+        "month": month,
+        "year": year,
+        "data": [
+            {
+                "name": f"Концентрат {index}",
+                "iron": round(rng.uniform(55, 70), 2),
+                "silicon": round(rng.uniform(2, 8), 2),
+                "aluminum": round(rng.uniform(0.5, 3), 2),
+                "calcium": round(rng.uniform(0.1, 2), 2),
+                "sulfur": round(rng.uniform(0.01, 0.5), 2),
+            }
+            for index in range(concentrates)
+        ],
+    }
+
+
+def month_of(index: int) -> Dict[str, int]:
+    """
+    Месяц и год по порядковому номеру засеянного месяца.
+
+    :param index: Номер месяца с 0
+    :return:
+    """
+    return {"month": index % 12 + 1, "year": BENCH_YEAR + index // 12}
+
+
+async def seed(client: httpx.AsyncClient, args, rng: random.Random) -> List[Dict[str, str]]:
+    """
+    Создаем пользователей, получаем токены и записываем данные за все месяцы.
+
+    :param client: HTTP-клиент
+    :param args: Аргументы командной строки
+    :param rng: Генератор случайных чисел
+    :return: Список пользователей с логином и заголовками авторизации
+    """
+    users = []
+    for index in range(args.users):
+        username = f"bench_user_{index}"
+        response = await client.post("/users/", json={"username": username, "password": BENCH_PASSWORD})
+        if response.status_code not in (200, 400):
+            response.raise_for_status()
+
+        response = await client.post("/token", data={"username": username, "password": BENCH_PASSWORD})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        users.append({"username": username, "headers": {"Authorization": f"Bearer {token}"}})
+
+    for user in users:
+        for index in range(args.months):
+            period = month_of(index)
+            response = await client.post(
+                "/api/concentrate-quality", params={"replace": True}, headers=user["headers"],
+                json=make_month_data(period["month"], period["year"], args.concentrates, rng)
+            )
+            response.raise_for_status()
+    return users
+
+
+def is_error(response: httpx.Response) -> bool:
+    """
+    Ошибочный ответ. Запись данных сообщает об ошибке статусом в теле ответа при коде 200.
+
+    :param response: Ответ
+    :return:
+    """
+    if response.status_code >= 400:
+        return True
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        return isinstance(body, dict) and body.get("status") == "error"
+    return False
+
+
+async def run_scenario(name: str, request: Callable[[int], Awaitable[httpx.Response]],
+                       requests: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Выполняем requests запросов сценария не более чем по concurrency одновременно.
+
+    :param name: Название сценария
+    :param request: Функция запроса по номеру запроса
+    :param requests: Количество запросов
+    :param concurrency: Конкурентность
+    :return: Результаты сценария
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for number in counter:
+            started = time.perf_counter()
+            try:
+                response = await request(number)
+                if is_error(response):
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(requests / duration, 1) if duration else 0.0,
+        "latency_ms": latency_summary(latencies),
+    }
+    print(f"{name:<10} {result['throughput_rps']:>9} rps  p50={result['latency_ms']['p50']} "
+          f"p95={result['latency_ms']['p95']} p99={result['latency_ms']['p99']} ms  errors={errors}")
+    return result
+
+
+async def run(args) -> Dict[str, Any]:
+    """
+    Засеиваем данные и прогоняем выбранные сценарии.
+
+    :param args: Аргументы командной строки
+    :return: Результаты прогона
+    """
+    rng = random.Random(args.seed)
+    if args.in_process:
+        # Тест измеряет само приложение, поэтому контроль нагрузки по умолчанию выключен: все запросы идут с одного
+        # IP и от нескольких пользователей и иначе упирались бы в ограничение частоты
+        os.environ.setdefault("ADMISSION_CONTROL", "false")
+        from app import app
+        transport = httpx.ASGITransport(app=app)
+        lifespan = app.router.lifespan_context(app)
+        base_url = "http://benchmark"
+    else:
+        transport, lifespan, base_url = None, None, args.base_url
+
+    if lifespan is not None:
+        await lifespan.__aenter__()
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+            users = await seed(client, args, rng)
+            bodies = [make_month_data(**month_of(index % args.months), concentrates=args.concentrates, rng=rng)
+                      for index in range(min(args.requests, 50))]
+
+            def user_of(number: int) -> Dict[str, Any]:
+                return users[number % len(users)]
+
+            scenarios = {
+                "token": lambda number: client.post(
+                    "/token", data={"username": user_of(number)["username"], "password": BENCH_PASSWORD}
+                ),
+                "save": lambda number: client.post(
+                    "/api/concentrate-quality", params={"replace": True}, headers=user_of(number)["headers"],
+                    json=bodies[number % len(bodies)]
+                ),
+                "month": lambda number: client.get(
+                    "/api/concentrate-quality", params=month_of(number % args.months),
+                    headers=user_of(number)["headers"]
+                ),
+                "summary": lambda number: client.get(
+                    "/api/concentrate-quality/summary", params=month_of(number % args.months),
+                    headers=user_of(number)["headers"]
+                ),
+            }
+
+            results = {}
+            for name in args.scenarios:
+                results[name] = await run_scenario(name, scenarios[name], args.requests, args.concurrency)
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    return {
+        "kind": "load",
+        "config": {
+            "target": "in-process" if args.in_process else args.base_url,
+            "users": args.users,
+            "months": args.months,
+            "concentrates": args.concentrates,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "summary_engine": os.getenv("SUMMARY_ENGINE"),
+        },
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API данных железного концентрата")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", default="http://localhost:8000", help="Адрес запущенного бэкенда")
+    target.add_argument("--in-process", action="store_true", help="Запустить приложение в этом же процессе")
+    parser.add_argument("--users", type=int, default=2, help="Количество пользователей (N)")
+    parser.add_argument("--months", type=int, default=12, help="Количество месяцев на пользователя (M)")
+    parser.add_argument("--concentrates", type=int, default=50, help="Количество концентратов в месяце (K)")
+    parser.add_argument("--requests", type=int, default=500, help="Количество запросов в каждом сценарии")
+    parser.add_argument("--concurrency", type=int, default=20, help="Количество одновременных запросов")
+    parser.add_argument("--scenarios", nargs="+", default=["token", "save", "month", "summary"],
+                        choices=["token", "save", "month", "summary"], help="Сценарии")
+    parser.add_argument("--timeout", type=float, default=30, help="Таймаут запроса, с")
+    parser.add_argument("--seed", type=int, default=0, help="Начальное значение генератора")
+    parser.add_argument("--output", help="Файл результатов, по умолчанию benchmarks/results/load-<время>.json")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    path = save_results(results, args.output)
+    print(f"Результаты сохранены в {path}")
+
+
+if __name__ == "__main__":
+    main()
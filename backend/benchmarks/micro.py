@@ -0,0 +1,106 @@
+"""
+Микробенчмарки горячих участков без БД и HTTP: расчет отчета (calculate_stats, summarize_records,
+calculate_stats_matrix), валидация ConcentrateRecord/MonthData и по колонкам (validate_records) и декодирование JWT.
+
+Запуск из каталога backend:
+
+    python -m benchmarks.micro --records 1000
+"""
+import argparse
+import random
+import timeit
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict
+
+import jwt
+
+from benchmarks.report import save_results
+from config import SECRET_KEY, ALGORITHM
+from model.concentrate_models import ConcentrateRecord, MonthData, CONCENTRATE_METRICS
+from utils.column_validation import RowErrors, validate_records
+from utils.stat_utils import calculate_stats, summarize_records
+from utils.vector_stats import records_to_matrix, calculate_stats_matrix
+
+
+def make_records(count: int, rng: random.Random) -> list:
+    """
+    Случайные строки концентратов в виде словарей, как их возвращает БД.
+
+    :param count: Количество строк
+    :param rng: Генератор случайных чисел
+    :return:
+    """
+    return [
+        {"name": f"Концентрат {index}", **{metric: round(rng.uniform(0, 70), 2) for metric in CONCENTRATE_METRICS}}
+        for index in range(count)
+    ]
+
+
+def measure(function: Callable[[], Any], repeat: int, number: int) -> Dict[str, float]:
+    """
+    Время одного вызова: лучший и медианный из repeat замеров по number вызовов.
+
+    :param function: Функция без аргументов
+    :param repeat: Количество замеров
+    :param number: Вызовов в замере
+    :return: Время в микросекундах
+    """
+    timings = sorted(timing / number * 1e6 for timing in timeit.repeat(function, repeat=repeat, number=number))
+    return {"best_us": round(timings[0], 3), "median_us": round(timings[len(timings) // 2], 3), "number": number}
+
+
+def run(args) -> Dict[str, Any]:
+    """
+    Прогоняем микробенчмарки.
+
+    :param args: Аргументы командной строки
+    :return: Результаты прогона
+    """
+    rng = random.Random(args.seed)
+    records = make_records(args.records, rng)
+    month_payload = {"month": 1, "year": 2025, "data": records}
+    token = jwt.encode(
+        {"sub": "administrator", "exp": datetime.utcnow() + timedelta(minutes=30)}, SECRET_KEY, algorithm=ALGORITHM
+    )
+
+    cases = {
+        "calculate_stats": lambda: {
+            metric: calculate_stats([record[metric] for record in records]) for metric in CONCENTRATE_METRICS
+        },
+        "summarize_records": lambda: summarize_records(records, extended=False),
+        "summarize_records_extended": lambda: summarize_records(records, extended=True),
+        "calculate_stats_matrix": lambda: calculate_stats_matrix(records_to_matrix(records)),
+        "calculate_stats_matrix_extended": lambda: calculate_stats_matrix(records_to_matrix(records), extended=True),
+        "concentrate_record_validate": lambda: ConcentrateRecord.model_validate(records[0]),
+        "month_data_validate": lambda: MonthData.model_validate(month_payload),
+        "columnar_validate": lambda: validate_records(records, RowErrors()),
+        "jwt_decode": lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]),
+    }
+
+    results = {}
+    for name in args.cases or cases:
+        # Вызовов в замере подбираем так, чтобы замер занимал около 0.2 с
+        number, _ = timeit.Timer(cases[name]).autorange()
+        results[name] = measure(cases[name], args.repeat, number)
+        print(f"{name:<34} best={results[name]['best_us']:>12} us  median={results[name]['median_us']:>12} us")
+
+    return {"kind": "micro", "config": {"records": args.records, "repeat": args.repeat}, "cases": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки расчета отчета, валидации и JWT")
+    parser.add_argument("--records", type=int, default=1000, help="Количество строк концентратов")
+    parser.add_argument("--repeat", type=int, default=5, help="Количество замеров")
+    parser.add_argument("--cases", nargs="+", help="Запускать только указанные бенчмарки")
+    parser.add_argument("--seed", type=int, default=0, help="Начальное значение генератора")
+    parser.add_argument("--output", help="Файл результатов, по умолчанию benchmarks/results/micro-<время>.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    path = save_results(results, args.output)
+    print(f"Результаты сохранены в {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Процентиль с линейной интерполяцией по отсортированному списку.
+
+    :param sorted_values: Отсортированные значения
+    :param fraction: Доля от 0 до 1
+    :return:
+    """
+    if not sorted_values:
+        return 0.0
+    position = fraction * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """
+    Сводка задержек в миллисекундах.
+
+    :param latencies: Задержки в секундах
+    :return:
+    """
+    values = sorted(latency * 1000 for latency in latencies)
+    if not values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 0.5), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    """
+    Текущий коммит репозитория, чтобы результаты можно было сопоставить с изменениями.
+
+    :return:
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results: Dict[str, Any], path: Optional[str] = None) -> str:
+    """
+    Сохраняем результаты прогона в JSON вместе с описанием окружения.
+
+    :param results: Результаты
+    :param path: Путь к файлу, по умолчанию benchmarks/results/<вид>-<время>.json
+    :return: Путь к файлу
+    """
+    started_at = datetime.now()
+    results = {
+        **results,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+    }
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{results['kind']}-{started_at:%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    return path
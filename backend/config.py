@@ -16,4 +16,114 @@ POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DATABASE_URL = os.getenv("DATABASE_URL",
     f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}/{POSTGRES_DB}")
 
+# Хранилище данных: postgres - PostgreSQL из DATABASE_URL, sqlite - встроенная БД в файле SQLITE_PATH (для
+# установки на одной площадке), memory - данные в памяти процесса без сохранения (для CI и бенчмарков)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/concentrate.db")
+# Количество потоков (и соединений) чтения SQLite, запись выполняется одним отдельным потоком
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", 4))
 
+# Пул соединений с БД
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# Общий лимит соединений всех воркеров (0 - без ограничения), при заданном значении пул каждого воркера не больше
+# DB_POOL_TOTAL_MAX_SIZE / APP_WORKERS
+DB_POOL_TOTAL_MAX_SIZE = int(os.getenv("DB_POOL_TOTAL_MAX_SIZE", 0))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 10))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+
+# Способ расчета отчета: rollup - готовая помесячная сводка, sql - агрегация в БД одним запросом,
+# numpy - векторный расчет по строкам в приложении, python - эталонный расчет по строкам в приложении
+SUMMARY_ENGINE = os.getenv("SUMMARY_ENGINE", "rollup")
+
+# Пакетная запись данных: copy - COPY через copy_records_to_table, executemany - пакетный INSERT
+BULK_INSERT_METHOD = os.getenv("BULK_INSERT_METHOD", "copy")
+BULK_INSERT_BATCH_SIZE = int(os.getenv("BULK_INSERT_BATCH_SIZE", 5000))
+# Максимум месяцев в одном запросе пакетной записи
+BATCH_MAX_MONTHS = int(os.getenv("BATCH_MAX_MONTHS", 120))
+
+# Необязательные миграции схемы: покрывающий индекс для отчетов и секционирование concentrate_quality по году
+CONCENTRATE_COVERING_INDEX = os.getenv("CONCENTRATE_COVERING_INDEX", "false").lower() == "true"
+CONCENTRATE_PARTITION_BY_YEAR = os.getenv("CONCENTRATE_PARTITION_BY_YEAR", "false").lower() == "true"
+
+# Кэш аутентификации: расшифрованные токены и записи пользователей
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 1024))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 1024))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", 60))
+
+# Хэширование паролей: стоимость bcrypt (хэши с другой стоимостью перехэшируются при входе) и пул для bcrypt
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+PASSWORD_HASH_MAX_CONCURRENCY = int(os.getenv("PASSWORD_HASH_MAX_CONCURRENCY", 4))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 100))
+
+# Серверный кэш ответов за месяц (данные и отчет), ключ включает версию данных
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 512))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+
+# Тренды по концентратам: нормы показателей по умолчанию через запятую (например, iron>=62,sulfur<=0.3), для
+# значений за пределами норм выставляются флаги; максимальное окно скользящего среднего в месяцах
+QUALITY_SPEC = os.getenv("QUALITY_SPEC", "")
+TRENDS_MAX_WINDOW = int(os.getenv("TRENDS_MAX_WINDOW", 24))
+
+# Отчет по организации: логины через запятую, которым доступны данные всех пользователей
+ORGANIZATION_SUMMARY_USERS = [
+    username.strip() for username in os.getenv("ORGANIZATION_SUMMARY_USERS", "admin").split(",") if username.strip()
+]
+
+# Снимки закрытых месяцев: каталог файлов (отображаются в память при чтении) и максимум открытых снимков в процессе
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "data/snapshots")
+SNAPSHOT_OPEN_FILES = int(os.getenv("SNAPSHOT_OPEN_FILES", 256))
+
+# Размер пачки строк при потоковой выгрузке
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+# Метрики: порог медленного вызова PostgreSQLService для записи в лог, мс (0 - не логировать)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 0))
+
+# Файл лога (пусто - только консоль). Файл и каталог создаются при старте приложения, а не при импорте
+LOG_FILE = os.getenv("LOG_FILE", "logs/concentrate_api.log")
+
+# Старт приложения: blocking - запросы принимаются после подготовки БД, background - сервер стартует сразу, БД
+# готовится в фоне с повтором через STARTUP_RETRY_INTERVAL, с, до готовности запросы получают 503 (см. /ready)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "blocking")
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", 2))
+
+# Сервер приложения: адрес, порт и количество процессов-воркеров uvicorn
+APP_HOST = os.getenv("APP_HOST", "172.20.0.3")
+APP_PORT = int(os.getenv("APP_PORT", 8000))
+APP_WORKERS = int(os.getenv("APP_WORKERS", 1))
+
+# Фоновые задачи (импорт таблиц, отчеты за период): количество задач, выполняемых одновременно в процессе
+# приложения (0 - задачи выполняет только отдельный воркер manage.py worker), интервал опроса очереди, с,
+# время без heartbeat, после которого задача считается зависшей, с, число попыток и срок хранения задач, дни
+JOB_WORKERS_IN_PROCESS = int(os.getenv("JOB_WORKERS_IN_PROCESS", 1))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", 60))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 7))
+
+# Контроль нагрузки: ограничение частоты запросов корзинами токенов (запросов в секунду и допустимая пачка,
+# 0 - без ограничения) по пользователю из JWT, по IP и отдельно для /token по IP
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", 50))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", 100))
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", 100))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", 200))
+RATE_LIMIT_TOKEN_RATE = float(os.getenv("RATE_LIMIT_TOKEN_RATE", 2))
+RATE_LIMIT_TOKEN_BURST = float(os.getenv("RATE_LIMIT_TOKEN_BURST", 10))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000))
+# Одновременные запросы и очередь по группам маршрутов: вход (bcrypt), запись данных, отчеты и выгрузки
+# (0 - без ограничения), максимальное ожидание в очереди, с
+ADMISSION_TOKEN_CONCURRENCY = int(os.getenv("ADMISSION_TOKEN_CONCURRENCY", 8))
+ADMISSION_TOKEN_QUEUE = int(os.getenv("ADMISSION_TOKEN_QUEUE", 32))
+ADMISSION_WRITE_CONCURRENCY = int(os.getenv("ADMISSION_WRITE_CONCURRENCY", 4))
+ADMISSION_WRITE_QUEUE = int(os.getenv("ADMISSION_WRITE_QUEUE", 16))
+ADMISSION_REPORT_CONCURRENCY = int(os.getenv("ADMISSION_REPORT_CONCURRENCY", 8))
+ADMISSION_REPORT_QUEUE = int(os.getenv("ADMISSION_REPORT_QUEUE", 16))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+# Максимальный размер тела запроса, байт: общий и для импорта таблиц
+MAX_REQUEST_BODY_SIZE = int(os.getenv("MAX_REQUEST_BODY_SIZE", 10 * 1024 * 1024))
+MAX_IMPORT_BODY_SIZE = int(os.getenv("MAX_IMPORT_BODY_SIZE", 100 * 1024 * 1024))
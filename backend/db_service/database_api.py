@@ -1,68 +1,286 @@
+import asyncio
 import asyncpg
+import json
+import time
 
+from collections import Counter
 from contextlib import asynccontextmanager
 from loguru import logger
-from config import DATABASE_URL
-from asyncpg import Record
-from typing import Optional
+from config import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TOTAL_MAX_SIZE, \
+    DB_POOL_ACQUIRE_TIMEOUT, DB_STATEMENT_CACHE_SIZE, BULK_INSERT_METHOD, APP_WORKERS
+from asyncpg import Connection, Record
+from asyncpg.pool import Pool
+from fastapi import HTTPException
+from typing import Any, Optional, Dict, List, AsyncIterable, AsyncIterator, Callable, Tuple
 
-from model.concentrate_models import MonthData
+from db_service.instrumentation import instrument_db_methods, record_acquire
+from db_service.migrations import apply_migrations, get_pending_versions
+from db_service.rollup import add_batch_to_monthly_stats, add_rows_to_monthly_stats, refresh_monthly_stats, \
+    bump_data_version, lock_month, STATS_COLUMNS
+from db_service.storage import StorageBackend, WriteResult, MonthWriteOutcome, BATCH_ROLLED_BACK_MESSAGE, single_batch
+from exceptions.app_exceptions import DatabaseUnavailableException, DuplicateConcentrateException, \
+    UserAlreadyExistException
+from model.concentrate_models import MonthData, ConcentrateRecord, CONCENTRATE_METRICS
 from patterns.singleton import Singleton
+from utils.period_utils import shift_period
 
 
-class PostgreSQLService(Singleton):
+# Порядок колонок при пакетной записи в concentrate_quality
+CONCENTRATE_INSERT_COLUMNS = ["name", *CONCENTRATE_METRICS, "month", "year", "created_by"]
+
+# Временная таблица загружаемых строк для режимов upsert и sync
+STAGING_COLUMNS = ["name", *CONCENTRATE_METRICS]
+CREATE_STAGING_TABLE = f"""
+CREATE TEMP TABLE concentrate_staging (
+    name TEXT NOT NULL,
+    {", ".join(f"{metric} NUMERIC(5,2) NOT NULL" for metric in CONCENTRATE_METRICS)}
+) ON COMMIT DROP;
+"""
+
+# Добавление новых и обновление измененных строк месяца. Строки без изменений не обновляются и не возвращаются.
+# Добавленные строки отличаются от обновленных по именам, которые были в месяце до записи: все части запроса видят
+# один снимок данных (xmax = 0 для этого не подходит, системные колонки недоступны в секционированной таблице)
+UPSERT_FROM_STAGING = f"""
+WITH existing AS (
+    SELECT q.name FROM concentrate_quality q JOIN concentrate_staging s ON s.name = q.name
+    WHERE q.month = $1 AND q.year = $2 AND q.created_by = $3
+), upserted AS (
+    INSERT INTO concentrate_quality AS q ({", ".join(CONCENTRATE_INSERT_COLUMNS)})
+    SELECT name, {", ".join(CONCENTRATE_METRICS)}, $1, $2, $3 FROM concentrate_staging
+    ON CONFLICT (created_by, year, month, name) DO UPDATE SET
+        {", ".join(f"{metric} = EXCLUDED.{metric}" for metric in CONCENTRATE_METRICS)}
+    WHERE ({", ".join(f"q.{metric}" for metric in CONCENTRATE_METRICS)})
+        IS DISTINCT FROM ({", ".join(f"EXCLUDED.{metric}" for metric in CONCENTRATE_METRICS)})
+    RETURNING q.name, {", ".join(f"q.{metric}" for metric in CONCENTRATE_METRICS)}
+)
+SELECT NOT EXISTS (SELECT 1 FROM existing e WHERE e.name = u.name) AS inserted,
+    {", ".join(f"u.{metric}" for metric in CONCENTRATE_METRICS)}
+FROM upserted u;
+"""
+
+DELETE_MISSING_FROM_STAGING = """
+DELETE FROM concentrate_quality q
+WHERE q.month = $1 AND q.year = $2 AND q.created_by = $3
+    AND NOT EXISTS (SELECT 1 FROM concentrate_staging s WHERE s.name = q.name);
+"""
+
+
+async def write_rows(con: Connection, table: str, columns: List[str], rows: List[tuple]):
+    """
+    Пакетная запись строк: COPY через copy_records_to_table или executemany при BULK_INSERT_METHOD=executemany.
+
+    :param con: Соединение с БД
+    :param table: Таблица
+    :param columns: Колонки
+    :param rows: Строки
+    :return:
+    """
+    if BULK_INSERT_METHOD == "executemany":
+        placeholders = ", ".join(f"${index}" for index in range(1, len(columns) + 1))
+        await con.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders});", rows)
+    else:
+        await con.copy_records_to_table(table, records=rows, columns=columns)
+
+
+# Ключ advisory-блокировки, под которой выполняются миграции и создание дефолтных пользователей
+STARTUP_LOCK_KEY = 0x636F6E63  # "conc"
+
+# Канал LISTEN/NOTIFY, которым воркеры оповещаются о новых задачах
+JOBS_CHANNEL = "concentrate_jobs"
+
+# Колонки состояния задачи без входных данных и результата
+JOB_STATUS_COLUMNS = """id, kind, status, params::text AS params, attempts, error, result_type,
+    octet_length(result) AS result_size, created_at, started_at, finished_at"""
+
+
+def worker_pool_sizes() -> Tuple[int, int]:
+    """
+    Размер пула соединений одного воркера: DB_POOL_MIN_SIZE/DB_POOL_MAX_SIZE, но при заданном DB_POOL_TOTAL_MAX_SIZE
+    общий лимит делится поровну между APP_WORKERS воркерами.
+
+    :return: (min_size, max_size)
+    """
+    max_size = DB_POOL_MAX_SIZE
+    if DB_POOL_TOTAL_MAX_SIZE:
+        max_size = max(1, min(max_size, DB_POOL_TOTAL_MAX_SIZE // max(APP_WORKERS, 1)))
+    return min(DB_POOL_MIN_SIZE, max_size), max_size
+
+
+@instrument_db_methods
+class PostgreSQLService(StorageBackend, Singleton):
+    name = "postgres"
+    supports_jobs = True
+    # Атрибуты класса, чтобы повторный вызов конструктора синглтона не сбрасывал пул
+    pool: Optional[Pool] = None
+    _waiting: int = 0
+
     def __init__(self):
         super().__init__()
 
+    async def init_pool(self):
+        """
+        Создаем пул соединений с БД. Вызывается один раз при старте приложения.
+
+        :return:
+        """
+        if self.pool is not None:
+            return
+
+        min_size, max_size = worker_pool_sizes()
+        self.pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=min_size,
+            max_size=max_size,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE
+        )
+        logger.info(f"Пул соединений с БД создан (min={min_size}, max={max_size})")
+
+    async def close_pool(self):
+        """
+        Закрываем пул соединений с БД при остановке приложения.
+
+        :return:
+        """
+        if self.pool is None:
+            return
+
+        await self.pool.close()
+        self.pool = None
+        logger.info("Пул соединений с БД закрыт")
+
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        Текущее состояние пула соединений.
+
+        :return:
+        """
+        if self.pool is None:
+            return {"size": 0, "min_size": 0, "max_size": 0, "in_use": 0, "idle": 0, "waiting": self._waiting}
+
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            "size": size,
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "in_use": size - idle,
+            "idle": idle,
+            "waiting": self._waiting
+        }
+
     @asynccontextmanager
-    async def connect(self, dsn: str):
+    async def connect(self):
         """
-        Асинхронный контекстный менедежер обращения к БД.
+        Асинхронный контекстный менедежер обращения к БД. Соединение берется из пула, если пул еще не создан
+        (например, при запуске вне приложения), открывается отдельное соединение.
 
-        :param dsn: Строка обращения к БД
         :return:
         """
-        conn = await asyncpg.connect(dsn)
+        started = time.perf_counter()
+        if self.pool is None:
+            conn = await asyncpg.connect(DATABASE_URL, statement_cache_size=DB_STATEMENT_CACHE_SIZE)
+            record_acquire(time.perf_counter() - started)
+            try:
+                yield conn
+            finally:
+                await conn.close()
+            return
+
+        self._waiting += 1
+        try:
+            conn = await self.pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Не удалось получить соединение из пула за {DB_POOL_ACQUIRE_TIMEOUT} с")
+            raise DatabaseUnavailableException
+        finally:
+            self._waiting -= 1
+        record_acquire(time.perf_counter() - started)
+
         try:
             yield conn
+        finally:
+            await self.pool.release(conn)
+
+    @asynccontextmanager
+    async def startup_lock(self):
+        """
+        Advisory-блокировка PostgreSQL на время подготовки БД при старте. При нескольких воркерах миграции и создание
+        дефолтных пользователей выполняет первый получивший блокировку, остальные ждут и застают БД готовой.
+        Блокировка берется на отдельном соединении, чтобы не занимать соединение пула.
+
+        :return:
+        """
+        conn = await asyncpg.connect(DATABASE_URL, statement_cache_size=0)
+        try:
+            started = time.perf_counter()
+            await conn.execute("SELECT pg_advisory_lock($1);", STARTUP_LOCK_KEY)
+            logger.info(f"Получена блокировка подготовки БД за {time.perf_counter() - started:.3f} с")
+            try:
+                yield
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1);", STARTUP_LOCK_KEY)
+        finally:
+            await conn.close()
+
+    @asynccontextmanager
+    async def listen(self, channel: str, callback: Callable[[str], None]):
+        """
+        Подписка на уведомления NOTIFY канала. LISTEN держит соединение все время подписки, поэтому оно открывается
+        отдельно от пула.
+
+        :param channel: Канал
+        :param callback: Обработчик, принимает содержимое уведомления
+        :return:
+        """
+        conn = await asyncpg.connect(DATABASE_URL, statement_cache_size=0)
+
+        def on_notification(connection, pid, notification_channel, payload):
+            callback(payload)
+
+        try:
+            await conn.add_listener(channel, on_notification)
+            yield conn
         finally:
             await conn.close()
 
     async def create_tables(self):
         """
-        Создаем необходимые дефолтные таблицы.
+        Приводим схему БД к актуальной версии: применяем непримененные миграции из db_service/migrations.py.
+
+        :return:
+        """
+        async with self.connect() as con:
+            applied = await apply_migrations(con)
+            if applied:
+                logger.info(f"Схема БД обновлена, применены версии: {applied}")
+            else:
+                logger.info("Схема БД в актуальном состоянии")
+
+    async def schema_is_current(self) -> bool:
+        """
+        Все включенные миграции применены. Проверяется на соединении пула без advisory-блокировки, поэтому
+        перезапуск с актуальной схемой не открывает отдельное соединение для блокировки.
 
         :return:
         """
-        create_users_table = """
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT NOT NULL UNIQUE,
-            hashed_password TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT TRUE
-        );
+        async with self.connect() as con:
+            return not await get_pending_versions(con)
+
+    async def warm_up(self):
         """
+        Открываем min_size соединений пула одновременно и проверяем их запросом, чтобы первые запросы после
+        готовности не ждали открытия соединений.
 
-        create_concentrate_table = """
-        CREATE TABLE IF NOT EXISTS concentrate_quality (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            iron NUMERIC(5,2) NOT NULL,
-            silicon NUMERIC(5,2) NOT NULL,
-            aluminum NUMERIC(5,2) NOT NULL,
-            calcium NUMERIC(5,2) NOT NULL,
-            sulfur NUMERIC(5,2) NOT NULL,
-            month INTEGER NOT NULL,
-            year INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by INTEGER REFERENCES users(id)
-        );
+        :return:
         """
+        if self.pool is None:
+            return
 
-        async with self.connect(DATABASE_URL) as con:
-            await con.execute(create_users_table)
-            await con.execute(create_concentrate_table)
-            logger.info("Таблицы были созданы")
+        async def ping():
+            async with self.pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as con:
+                await con.fetchval("SELECT 1;")
+
+        await asyncio.gather(*(ping() for _ in range(self.pool.get_min_size())))
 
     async def get_user(self, username: str) -> Optional[Record]:
         """
@@ -71,38 +289,211 @@ class PostgreSQLService(Singleton):
         :param username: Логин пользователя
         :return:
         """
-        async with self.connect(DATABASE_URL) as con:
+        async with self.connect() as con:
             return await con.fetchrow("SELECT * FROM users WHERE username = $1;", username)
 
-    async def set_concentrate_data(self, month_data: MonthData, current_user: str, replace_data: bool =False):
+    async def insert_concentrate_batches(self, month: int, year: int, current_user: Record,
+                                         batches: AsyncIterable[List[ConcentrateRecord]],
+                                         mode: str = "append") -> WriteResult:
         """
-        Запись в БД информации по концентрату.
+        Пакетная запись данных концентратов за месяц в одной транзакции. Пачки можно подавать по мере чтения
+        запроса, не накапливая весь документ в памяти. Ошибка в любой пачке откатывает всю запись.
 
-        :param month_data: Модель данных
-        :param current_user: Логин пользователя
-        :param replace_data: Переменная, отвечающая за замену данных в БД. Если True, то данные за выбранные месяц будут
-            перезаписаны.
-        :return:
+        append и replace записывают пачки напрямую COPY (или executemany при BULK_INSERT_METHOD=executemany),
+        replace предварительно удаляет данные за месяц. upsert и sync загружают таблицу во временную таблицу и
+        записывают только разницу: новые строки добавляются, строки с измененными показателями обновляются через
+        INSERT ... ON CONFLICT, при sync строки, которых нет в таблице, удаляются. Так правка одной ячейки большого
+        месяца стоит пропорционально изменениям, а повторная отправка той же таблицы ничего не меняет.
+
+        В той же транзакции обновляется сводка concentrate_monthly_stats (инкрементально, если строки только
+        добавлялись, иначе пересчетом месяца) и, если данные изменились, версия данных за месяц.
+
+        :param month: Месяц
+        :param year: Год
+        :param current_user: Пользователь
+        :param batches: Асинхронный итератор пачек записей
+        :param mode: Режим записи, см. WRITE_MODES
+        :return: Количество полученных, добавленных, измененных, удаленных и неизмененных строк
         """
-        async with self.connect(DATABASE_URL) as con:
+        async with self.connect() as con:
             async with con.transaction():
-                # Удаляем старые данные за этот месяц
-                if replace_data:
-                    await con.execute(
-                        "DELETE FROM concentrate_quality WHERE month = $1 AND year = $2;",
-                        month_data.month, month_data.year
-                    )
+                return await self._write_month(con, month, year, current_user["id"], batches, mode)
 
-                # Сохраняем новые данные
-                for record in month_data.data:
-                    await con.execute(
-                        """INSERT INTO concentrate_quality 
-                        (name, iron, silicon, aluminum, calcium, sulfur, month, year, created_by)
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9);""",
-                        record.name, record.iron, record.silicon,
-                        record.aluminum, record.calcium, record.sulfur,
-                        month_data.month, month_data.year, current_user["id"]
-                    )
+    async def insert_concentrate_months(self, months: List[MonthData], current_user: Record, mode: str = "append",
+                                        atomic: bool = False) -> List[MonthWriteOutcome]:
+        """
+        Пакетная запись данных за несколько месяцев одним соединением в одной транзакции. Каждый месяц записывается
+        как в insert_concentrate_batches, но внутри своей точки сохранения: ошибка месяца (например, повторяющиеся
+        концентраты) откатывает только его, остальные месяцы записываются. При atomic=True ошибка любого месяца
+        откатывает весь пакет, но остальные месяцы все равно проверяются записью, чтобы вернуть все ошибки сразу.
+
+        Месяцы записываются в порядке (год, месяц), поэтому параллельные пакеты берут блокировки месяцев в одном
+        порядке и не взаимоблокируются.
+
+        :param months: Данные за месяцы, месяцы не должны повторяться
+        :param current_user: Пользователь
+        :param mode: Режим записи, см. WRITE_MODES
+        :param atomic: Записать все месяцы или ни одного
+        :return: Итог по каждому месяцу в порядке записи
+        """
+        user_id = current_user["id"]
+        outcomes = []
+        async with self.connect() as con:
+            transaction = con.transaction()
+            await transaction.start()
+            try:
+                for month_data in sorted(months, key=lambda item: (item.year, item.month)):
+                    try:
+                        async with con.transaction():
+                            result = await self._write_month(
+                                con, month_data.month, month_data.year, user_id, single_batch(month_data.data), mode
+                            )
+                        outcomes.append(MonthWriteOutcome(month_data.month, month_data.year, result, None))
+                    except (HTTPException, asyncpg.PostgresError) as e:
+                        error = str(e.detail) if isinstance(e, HTTPException) else str(e)
+                        outcomes.append(MonthWriteOutcome(month_data.month, month_data.year, None, error))
+            except BaseException:
+                await transaction.rollback()
+                raise
+
+            if atomic and any(outcome.error for outcome in outcomes):
+                await transaction.rollback()
+                return [
+                    outcome if outcome.error else outcome._replace(result=None, error=BATCH_ROLLED_BACK_MESSAGE)
+                    for outcome in outcomes
+                ]
+            await transaction.commit()
+        return outcomes
+
+    async def _write_month(self, con, month: int, year: int, user_id: int,
+                           batches: AsyncIterable[List[ConcentrateRecord]], mode: str) -> WriteResult:
+        """
+        Запись данных за месяц в текущей транзакции соединения: блокировка месяца, запись в режиме mode и, если
+        данные изменились, новая версия данных.
+
+        :param con: Соединение с БД (внутри транзакции записи)
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :param batches: Асинхронный итератор пачек записей
+        :param mode: Режим записи, см. WRITE_MODES
+        :return:
+        """
+        await lock_month(con, user_id, year, month)
+        if mode in ("upsert", "sync"):
+            result = await self._merge_batches(con, month, year, user_id, batches, mode == "sync")
+        else:
+            result = await self._insert_batches(con, month, year, user_id, batches, mode == "replace")
+
+        if result.inserted or result.updated or result.deleted:
+            await bump_data_version(con, user_id, year, month)
+        return result
+
+    @staticmethod
+    async def _insert_batches(con, month: int, year: int, user_id: int,
+                              batches: AsyncIterable[List[ConcentrateRecord]], replace_data: bool) -> WriteResult:
+        """
+        Запись пачек в режимах append и replace. Концентраты, которые уже есть в месяце или повторяются в таблице,
+        отклоняются до записи, чтобы ошибка была понятной, а не нарушением уникального индекса.
+
+        :param con: Соединение с БД (внутри транзакции записи)
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :param batches: Асинхронный итератор пачек записей
+        :param replace_data: Удалить данные пользователя за месяц перед записью
+        :return:
+        """
+        deleted = 0
+        if replace_data:
+            status = await con.execute(
+                "DELETE FROM concentrate_quality WHERE month = $1 AND year = $2 AND created_by = $3;",
+                month, year, user_id
+            )
+            deleted = int(status.split()[-1])
+
+        total = 0
+        async for batch in batches:
+            if not batch:
+                continue
+
+            names = [record.name for record in batch]
+            duplicates = {name for name, count in Counter(names).items() if count > 1}
+            duplicates.update(row["name"] for row in await con.fetch(
+                """SELECT name FROM concentrate_quality
+                WHERE month = $1 AND year = $2 AND created_by = $3 AND name = ANY($4::text[]);""",
+                month, year, user_id, names
+            ))
+            if duplicates:
+                raise DuplicateConcentrateException(sorted(duplicates)[:10])
+
+            rows = [
+                (record.name, record.iron, record.silicon, record.aluminum, record.calcium, record.sulfur,
+                 month, year, user_id)
+                for record in batch
+            ]
+            await write_rows(con, "concentrate_quality", CONCENTRATE_INSERT_COLUMNS, rows)
+            if not replace_data:
+                await add_batch_to_monthly_stats(con, user_id, year, month, batch)
+            total += len(rows)
+
+        if replace_data:
+            await refresh_monthly_stats(con, user_id, year, month)
+        return WriteResult(rows=total, inserted=total, updated=0, deleted=deleted, unchanged=0)
+
+    @staticmethod
+    async def _merge_batches(con, month: int, year: int, user_id: int,
+                             batches: AsyncIterable[List[ConcentrateRecord]], delete_missing: bool) -> WriteResult:
+        """
+        Запись пачек в режимах upsert и sync через временную таблицу.
+
+        :param con: Соединение с БД (внутри транзакции записи)
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :param batches: Асинхронный итератор пачек записей
+        :param delete_missing: Удалить строки месяца, которых нет в таблице (режим sync)
+        :return:
+        """
+        await con.execute(CREATE_STAGING_TABLE)
+        total = 0
+        async for batch in batches:
+            if not batch:
+                continue
+            rows = [
+                (record.name, record.iron, record.silicon, record.aluminum, record.calcium, record.sulfur)
+                for record in batch
+            ]
+            await write_rows(con, "concentrate_staging", STAGING_COLUMNS, rows)
+            total += len(rows)
+
+        duplicates = await con.fetch(
+            "SELECT name FROM concentrate_staging GROUP BY name HAVING COUNT(*) > 1 ORDER BY name LIMIT 10;"
+        )
+        if duplicates:
+            raise DuplicateConcentrateException([row["name"] for row in duplicates])
+
+        changed = await con.fetch(UPSERT_FROM_STAGING, month, year, user_id)
+        inserted_rows = [row for row in changed if row["inserted"]]
+        updated = len(changed) - len(inserted_rows)
+
+        deleted = 0
+        if delete_missing:
+            status = await con.execute(DELETE_MISSING_FROM_STAGING, month, year, user_id)
+            deleted = int(status.split()[-1])
+        # Пакетная запись нескольких месяцев создает временную таблицу заново в той же транзакции
+        await con.execute("DROP TABLE concentrate_staging;")
+
+        # Минимум и максимум нельзя уменьшить инкрементально, поэтому при изменении и удалении сводка пересчитывается
+        if updated or deleted:
+            await refresh_monthly_stats(con, user_id, year, month)
+        elif inserted_rows:
+            await add_rows_to_monthly_stats(con, user_id, year, month, inserted_rows)
+
+        return WriteResult(
+            rows=total, inserted=len(inserted_rows), updated=updated, deleted=deleted,
+            unchanged=total - len(changed)
+        )
 
     async def get_concentrate_data(self, month: str, year: str, user_id: int):
         """
@@ -113,7 +504,7 @@ class PostgreSQLService(Singleton):
         :param user_id: Id пользователя в БД
         :return:
         """
-        async with self.connect(DATABASE_URL) as con:
+        async with self.connect() as con:
             records = await con.fetch(
                 """SELECT name, iron, silicon, aluminum, calcium, sulfur 
                 FROM concentrate_quality 
@@ -122,6 +513,287 @@ class PostgreSQLService(Singleton):
             )
             return records
 
+    async def get_concentrate_summary(self, month: int, year: int, user_id: int,
+                                      extended: bool = False) -> Optional[Record]:
+        """
+        Считает агрегаты по всем показателям концентратов за месяц одним запросом в БД.
+        Для каждого показателя возвращаются колонки <metric>_sum, <metric>_min, <metric>_max, а при extended также
+        <metric>_stddev, <metric>_median, <metric>_p5, <metric>_p95.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя в БД
+        :param extended: Считать дополнительные показатели
+        :return: Строка с агрегатами или None, если данных нет
+        """
+        columns = ["COUNT(*) AS count"]
+        for metric in CONCENTRATE_METRICS:
+            columns += [
+                f"SUM({metric}) AS {metric}_sum",
+                f"MIN({metric}) AS {metric}_min",
+                f"MAX({metric}) AS {metric}_max"
+            ]
+            if extended:
+                columns += [
+                    f"stddev_samp({metric})::float8 AS {metric}_stddev",
+                    f"percentile_cont(0.5) WITHIN GROUP (ORDER BY {metric}) AS {metric}_median",
+                    f"percentile_cont(0.05) WITHIN GROUP (ORDER BY {metric}) AS {metric}_p5",
+                    f"percentile_cont(0.95) WITHIN GROUP (ORDER BY {metric}) AS {metric}_p95"
+                ]
+
+        async with self.connect() as con:
+            row = await con.fetchrow(
+                f"""SELECT {", ".join(columns)}
+                FROM concentrate_quality
+                WHERE month = $1 AND year = $2 AND created_by = $3;""",
+                month, year, user_id
+            )
+            if not row or not row["count"]:
+                return None
+            return row
+
+    async def iter_period_summary(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int],
+                                  by_name: bool = False) -> AsyncIterator[Record]:
+        """
+        Агрегаты за период одним запросом с GROUPING SETS: по каждому месяцу, при by_name - по каждому концентрату
+        в месяце, и по всему периоду. Строки читаются курсором в хронологическом порядке, итоговая строка - последней.
+        Колонки совпадают с get_concentrate_summary, дополнительно year, month, name и kind.
+
+        :param user_id: Id пользователя в БД
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param by_name: Добавить разбивку по концентратам
+        :return:
+        """
+        columns = ["COUNT(*) AS count"]
+        for metric in CONCENTRATE_METRICS:
+            columns += [f"SUM({metric}) AS {metric}_sum", f"MIN({metric}) AS {metric}_min",
+                        f"MAX({metric}) AS {metric}_max"]
+        if by_name:
+            grouping_sets = "(year, month), (year, month, name), ()"
+            name_columns = "name, CASE WHEN GROUPING(year) = 1 THEN 'overall' " \
+                           "WHEN GROUPING(name) = 1 THEN 'month' ELSE 'name' END AS kind"
+        else:
+            grouping_sets = "(year, month), ()"
+            name_columns = "NULL::text AS name, CASE WHEN GROUPING(year) = 1 THEN 'overall' ELSE 'month' END AS kind"
+
+        query = f"""
+        SELECT year, month, {name_columns}, {", ".join(columns)}
+        FROM concentrate_quality
+        WHERE created_by = $1 AND (year, month) >= ($2, $3) AND (year, month) <= ($4, $5)
+        GROUP BY GROUPING SETS ({grouping_sets})
+        ORDER BY year NULLS LAST, month, name NULLS FIRST;
+        """
+
+        async with self.connect() as con:
+            async with con.transaction():
+                async for row in con.cursor(query, user_id, *period_from, *period_to):
+                    if row["count"]:
+                        yield row
+
+    async def get_concentrate_trends(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int],
+                                     names: Optional[List[str]] = None,
+                                     window: int = 3) -> List[Record]:
+        """
+        Ряды по концентратам за период одним запросом: строки отбираются по индексу (created_by, name, year, month),
+        скользящее среднее считается оконной функцией по календарным месяцам. Месяцы перед началом периода
+        читаются, чтобы среднее в начале периода считалось по полному окну, и отбрасываются после расчета.
+
+        :param user_id: Id пользователя в БД
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param names: Наименования концентратов, по умолчанию - все
+        :param window: Окно скользящего среднего в месяцах
+        :return:
+        """
+        conditions = ["created_by = $1", "(year, month) >= ($2, $3)", "(year, month) <= ($4, $5)"]
+        args: List[Any] = [user_id, *shift_period(period_from, 1 - window), *period_to, window - 1, *period_from]
+        if names:
+            conditions.append(f"name = ANY(${len(args) + 1}::text[])")
+            args.append(names)
+        rolling = ", ".join(f"AVG({metric}) OVER w AS {metric}_rolling" for metric in CONCENTRATE_METRICS)
+
+        async with self.connect() as con:
+            return await con.fetch(
+                f"""SELECT * FROM (
+                    SELECT name, year, month, iron, silicon, aluminum, calcium, sulfur, {rolling}
+                    FROM concentrate_quality
+                    WHERE {" AND ".join(conditions)}
+                    WINDOW w AS (PARTITION BY name ORDER BY year * 12 + month
+                                 RANGE BETWEEN $6::integer PRECEDING AND CURRENT ROW)
+                ) trends
+                WHERE (year, month) >= ($7, $8)
+                ORDER BY name, year, month;""",
+                *args
+            )
+
+    async def iter_concentrate_rows(self, user_id: int, period_from: Optional[Tuple[int, int]] = None,
+                                    period_to: Optional[Tuple[int, int]] = None,
+                                    batch_size: int = 1000) -> AsyncIterator[List[Record]]:
+        """
+        Читает строки пользователя серверным курсором пачками по batch_size, в памяти держится только одна пачка.
+
+        :param user_id: Id пользователя в БД
+        :param period_from: Начало периода (год, месяц), по умолчанию - вся история
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param batch_size: Размер пачки
+        :return:
+        """
+        conditions = ["created_by = $1"]
+        args = [user_id]
+        if period_from:
+            conditions.append(f"(year, month) >= (${len(args) + 1}, ${len(args) + 2})")
+            args += period_from
+        if period_to:
+            conditions.append(f"(year, month) <= (${len(args) + 1}, ${len(args) + 2})")
+            args += period_to
+
+        async with self.connect() as con:
+            async with con.transaction():
+                cursor = await con.cursor(
+                    f"""SELECT year, month, name, iron, silicon, aluminum, calcium, sulfur
+                    FROM concentrate_quality
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY year, month, id;""",
+                    *args
+                )
+                while rows := await cursor.fetch(batch_size):
+                    yield rows
+
+    async def get_monthly_stats(self, month: int, year: int, user_id: int) -> Optional[Record]:
+        """
+        Читает готовую сводку за месяц из concentrate_monthly_stats. Колонки совпадают с get_concentrate_summary
+        без дополнительных показателей.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя в БД
+        :return: Строка сводки или None, если данных нет
+        """
+        async with self.connect() as con:
+            return await con.fetchrow(
+                f"""SELECT {", ".join(STATS_COLUMNS)}
+                FROM concentrate_monthly_stats
+                WHERE created_by = $1 AND year = $2 AND month = $3;""",
+                user_id, year, month
+            )
+
+    async def get_organization_summary(self, period_from: Tuple[int, int], period_to: Tuple[int, int],
+                                       usernames: Optional[List[str]] = None, by_name: bool = False) -> List[Record]:
+        """
+        Частичные агрегаты по всем пользователям (или только по usernames) за период: по каждому месяцу и по всему
+        периоду. Объединяются строки помесячной сводки concentrate_monthly_stats, по одной на пользователя и месяц,
+        поэтому объем чтения зависит от числа пользователей и месяцев, а не от числа строк данных.
+
+        При by_name добавляются агрегаты по каждому концентрату в месяце. Концентрат уникален в месяце пользователя,
+        поэтому его частичный агрегат - сама строка concentrate_quality, они читаются по индексу периода.
+
+        Колонки: kind (month, name, overall), year, month, name, users (пользователей с данными), count и
+        <metric>_sum, <metric>_min, <metric>_max, <metric>_sumsq. Строки концентратов идут после строки своего
+        месяца, итоговая строка - последней.
+
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param usernames: Только данные указанных пользователей
+        :param by_name: Добавить разбивку по концентратам
+        :return:
+        """
+        args = [*period_from, *period_to]
+        users_join = ""
+        if usernames:
+            args.append(usernames)
+            users_join = "JOIN users u ON u.id = t.created_by AND u.username = ANY($5::text[])"
+        period = "(t.year, t.month) >= ($1, $2) AND (t.year, t.month) <= ($3, $4)"
+
+        partials = ", ".join(
+            f"SUM(t.{metric}_sum) AS {metric}_sum, MIN(t.{metric}_min) AS {metric}_min, "
+            f"MAX(t.{metric}_max) AS {metric}_max, SUM(t.{metric}_sumsq) AS {metric}_sumsq"
+            for metric in CONCENTRATE_METRICS
+        )
+        months_query = f"""
+        SELECT t.year, t.month, NULL::text AS name,
+            CASE WHEN GROUPING(t.year) = 1 THEN 'overall' ELSE 'month' END AS kind,
+            COUNT(DISTINCT t.created_by) AS users, SUM(t.count) AS count, {partials}
+        FROM concentrate_monthly_stats t {users_join}
+        WHERE {period}
+        GROUP BY GROUPING SETS ((t.year, t.month), ())
+        ORDER BY t.year NULLS LAST, t.month;
+        """
+
+        aggregates = ", ".join(
+            f"SUM(t.{metric}) AS {metric}_sum, MIN(t.{metric}) AS {metric}_min, "
+            f"MAX(t.{metric}) AS {metric}_max, SUM(t.{metric} * t.{metric}) AS {metric}_sumsq"
+            for metric in CONCENTRATE_METRICS
+        )
+        names_query = f"""
+        SELECT t.year, t.month, t.name, 'name' AS kind,
+            COUNT(DISTINCT t.created_by) AS users, COUNT(*) AS count, {aggregates}
+        FROM concentrate_quality t {users_join}
+        WHERE {period}
+        GROUP BY t.year, t.month, t.name
+        ORDER BY t.year, t.month, t.name;
+        """
+
+        async with self.connect() as con:
+            async with con.transaction(isolation="repeatable_read", readonly=True):
+                months = [row for row in await con.fetch(months_query, *args) if row["count"]]
+                names = await con.fetch(names_query, *args) if by_name and months else []
+
+        names_by_month: Dict[Tuple[int, int], List[Record]] = {}
+        for row in names:
+            names_by_month.setdefault((row["year"], row["month"]), []).append(row)
+
+        rows = []
+        for row in months:
+            rows.append(row)
+            if row["kind"] == "month":
+                rows += names_by_month.get((row["year"], row["month"]), [])
+        return rows
+
+    async def get_data_version(self, month: int, year: int, user_id: int) -> int:
+        """
+        Версия данных пользователя за месяц, меняется при каждой записи. 0 - данные не записывались.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя в БД
+        :return:
+        """
+        async with self.connect() as con:
+            version = await con.fetchval(
+                "SELECT version FROM concentrate_data_versions WHERE created_by = $1 AND year = $2 AND month = $3;",
+                user_id, year, month
+            )
+            return version or 0
+
+    async def get_period_version(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int]) -> int:
+        """
+        Версия данных пользователя за период: наибольшая версия месяцев периода.
+
+        :param user_id: Id пользователя в БД
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :return:
+        """
+        async with self.connect() as con:
+            version = await con.fetchval(
+                """SELECT MAX(version) FROM concentrate_data_versions
+                WHERE created_by = $1 AND (year, month) >= ($2, $3) AND (year, month) <= ($4, $5);""",
+                user_id, *period_from, *period_to
+            )
+            return version or 0
+
+    async def get_existing_usernames(self, usernames: List[str]) -> List[str]:
+        """
+        Логины из списка, которые уже есть в БД. Проверяется одним запросом.
+
+        :param usernames: Логины
+        :return:
+        """
+        async with self.connect() as con:
+            rows = await con.fetch("SELECT username FROM users WHERE username = ANY($1::text[]);", usernames)
+        return [row["username"] for row in rows]
+
     async def insert_user(self, username, hashed_password):
         """
         Добавляем нового пользователя в БД.
@@ -130,11 +802,183 @@ class PostgreSQLService(Singleton):
         :param hashed_password: Хешированный пароль
         :return:
         """
-        async with self.connect(DATABASE_URL) as con:
+        try:
+            async with self.connect() as con:
+                async with con.transaction():
+                    db_user = await con.fetchrow(
+                        """INSERT INTO users (username, hashed_password)
+                        VALUES ($1, $2) RETURNING id, username, is_active;""",
+                        username, hashed_password
+                    )
+        except asyncpg.exceptions.UniqueViolationError:
+            raise UserAlreadyExistException
+        self.notify_user_changed(username)
+        return db_user
+
+    async def update_user_password(self, username: str, hashed_password: str):
+        """
+        Обновляем хэш пароля пользователя.
+
+        :param username: Логин пользователя
+        :param hashed_password: Хешированный пароль
+        :return:
+        """
+        async with self.connect() as con:
+            await con.execute("UPDATE users SET hashed_password = $2 WHERE username = $1;", username, hashed_password)
+        self.notify_user_changed(username)
+
+    async def submit_job(self, kind: str, user_id: int, params: Dict[str, Any],
+                         payload: Optional[bytes] = None) -> Record:
+        """
+        Ставим задачу в очередь. Воркеры оповещаются через NOTIFY, который доставляется после фиксации транзакции.
+
+        :param kind: Вид задачи, см. jobs/job_handlers.py
+        :param user_id: Id пользователя в БД
+        :param params: Параметры задачи
+        :param payload: Входные данные (например, таблица для импорта)
+        :return: Состояние задачи
+        """
+        async with self.connect() as con:
             async with con.transaction():
-                db_user = await con.fetchrow(
-                    """INSERT INTO users (username, hashed_password)
-                    VALUES ($1, $2) RETURNING id, username, is_active;""",
-                    username, hashed_password
+                job = await con.fetchrow(
+                    f"""INSERT INTO jobs (kind, created_by, params, payload)
+                    VALUES ($1, $2, $3::jsonb, $4) RETURNING {JOB_STATUS_COLUMNS};""",
+                    kind, user_id, json.dumps(params), payload
+                )
+                await con.execute("SELECT pg_notify($1, $2);", JOBS_CHANNEL, str(job["id"]))
+        return job
+
+    async def claim_job(self, worker: str) -> Optional[Record]:
+        """
+        Забираем первую задачу из очереди. FOR UPDATE SKIP LOCKED пропускает задачи, которые в этот момент забирают
+        другие воркеры, поэтому воркеры не ждут друг друга и не получают одну задачу дважды.
+
+        :param worker: Идентификатор воркера
+        :return: Задача со входными данными или None, если очередь пуста
+        """
+        async with self.connect() as con:
+            return await con.fetchrow(
+                """UPDATE jobs
+                SET status = 'running', worker = $1, attempts = attempts + 1,
+                    started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status = 'queued' ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1
                 )
-                return db_user
+                RETURNING id, kind, created_by, params::text AS params, payload, attempts;""",
+                worker
+            )
+
+    async def heartbeat_job(self, job_id: int, worker: str):
+        """
+        Отмечаем, что воркер еще выполняет задачу.
+
+        :param job_id: Id задачи
+        :param worker: Идентификатор воркера
+        :return:
+        """
+        async with self.connect() as con:
+            await con.execute(
+                """UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = $1 AND worker = $2 AND status = 'running';""",
+                job_id, worker
+            )
+
+    async def finish_job(self, job_id: int, worker: str, result: bytes, result_type: str) -> bool:
+        """
+        Сохраняем результат задачи. Входные данные больше не нужны и удаляются.
+
+        :param job_id: Id задачи
+        :param worker: Идентификатор воркера
+        :param result: Результат
+        :param result_type: MIME-тип результата
+        :return: False, если задача тем временем была передана другому воркеру
+        """
+        async with self.connect() as con:
+            status = await con.execute(
+                """UPDATE jobs
+                SET status = 'done', result = $3, result_type = $4, payload = NULL, finished_at = CURRENT_TIMESTAMP
+                WHERE id = $1 AND worker = $2 AND status = 'running';""",
+                job_id, worker, result, result_type
+            )
+        return status.split()[-1] != "0"
+
+    async def fail_job(self, job_id: int, worker: str, error: str):
+        """
+        Завершаем задачу с ошибкой.
+
+        :param job_id: Id задачи
+        :param worker: Идентификатор воркера
+        :param error: Текст ошибки
+        :return:
+        """
+        async with self.connect() as con:
+            await con.execute(
+                """UPDATE jobs
+                SET status = 'failed', error = $3, payload = NULL, finished_at = CURRENT_TIMESTAMP
+                WHERE id = $1 AND worker = $2 AND status = 'running';""",
+                job_id, worker, error
+            )
+
+    async def get_job(self, job_id: int, user_id: int) -> Optional[Record]:
+        """
+        Состояние задачи пользователя без входных данных и результата.
+
+        :param job_id: Id задачи
+        :param user_id: Id пользователя в БД
+        :return: Состояние задачи или None, если задачи нет или она принадлежит другому пользователю
+        """
+        async with self.connect() as con:
+            return await con.fetchrow(
+                f"SELECT {JOB_STATUS_COLUMNS} FROM jobs WHERE id = $1 AND created_by = $2;", job_id, user_id
+            )
+
+    async def get_job_result(self, job_id: int, user_id: int) -> Optional[Record]:
+        """
+        Результат задачи пользователя.
+
+        :param job_id: Id задачи
+        :param user_id: Id пользователя в БД
+        :return: Статус, результат и его тип или None, если задачи нет или она принадлежит другому пользователю
+        """
+        async with self.connect() as con:
+            return await con.fetchrow(
+                "SELECT kind, status, result, result_type FROM jobs WHERE id = $1 AND created_by = $2;",
+                job_id, user_id
+            )
+
+    async def requeue_stale_jobs(self, stale_after: float, max_attempts: int) -> List[Record]:
+        """
+        Возвращаем в очередь задачи, воркер которых перестал отправлять heartbeat (процесс остановлен или упал).
+        Задачи, исчерпавшие max_attempts попыток, завершаются с ошибкой.
+
+        :param stale_after: Время без heartbeat, с
+        :param max_attempts: Максимальное число попыток
+        :return: Id и новый статус задач
+        """
+        async with self.connect() as con:
+            return await con.fetch(
+                """UPDATE jobs
+                SET status = CASE WHEN attempts >= $2 THEN 'failed' ELSE 'queued' END,
+                    error = CASE WHEN attempts >= $2 THEN 'Превышено число попыток выполнения' END,
+                    finished_at = CASE WHEN attempts >= $2 THEN CURRENT_TIMESTAMP END,
+                    payload = CASE WHEN attempts >= $2 THEN NULL ELSE payload END,
+                    worker = NULL
+                WHERE status = 'running' AND heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+                RETURNING id, status;""",
+                stale_after, max_attempts
+            )
+
+    async def delete_old_jobs(self, retention_days: int) -> int:
+        """
+        Удаляем завершенные задачи старше retention_days дней.
+
+        :param retention_days: Срок хранения, дни
+        :return: Количество удаленных задач
+        """
+        async with self.connect() as con:
+            status = await con.execute(
+                """DELETE FROM jobs
+                WHERE status IN ('done', 'failed') AND finished_at < CURRENT_TIMESTAMP - make_interval(days => $1);""",
+                retention_days
+            )
+        return int(status.split()[-1])
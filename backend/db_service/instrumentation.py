@@ -0,0 +1,156 @@
+import functools
+import inspect
+import time
+
+from asyncpg import Record
+from contextvars import ContextVar
+from loguru import logger
+from typing import Any, Optional
+
+from config import SLOW_QUERY_THRESHOLD_MS
+from utils.metrics import DB_ACQUIRE_SECONDS, DB_QUERY_SECONDS, DB_ROWS_RETURNED, DB_ERRORS, DB_SLOW_QUERIES
+
+
+class QuerySpan:
+    """
+    Замер одного вызова метода PostgreSQLService: ожидание соединения накапливается отдельно от общего времени.
+    """
+
+    def __init__(self, method: str):
+        self.method = method
+        self.acquire = 0.0
+        self.total = 0.0
+        self.rows = 0
+
+
+_current_span: ContextVar[Optional[QuerySpan]] = ContextVar("db_query_span", default=None)
+
+
+def record_acquire(seconds: float):
+    """
+    Учитываем время получения соединения (из пула или нового). Вызывается из PostgreSQLService.connect.
+
+    :param seconds: Время ожидания, с
+    :return:
+    """
+    span = _current_span.get()
+    DB_ACQUIRE_SECONDS.observe(seconds, method=span.method if span else "other")
+    if span is not None:
+        span.acquire += seconds
+
+
+def count_rows(result: Any) -> int:
+    """
+    Количество строк в результате метода: список строк или пачка, одна строка, либо ничего.
+
+    :param result: Результат
+    :return:
+    """
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, (Record, dict)):
+        return 1
+    return 0
+
+
+def finish_span(span: QuerySpan, failed: bool):
+    """
+    Записываем замер в метрики и, если вызов дольше SLOW_QUERY_THRESHOLD_MS, в лог.
+
+    :param span: Замер
+    :param failed: Вызов завершился ошибкой
+    :return:
+    """
+    DB_QUERY_SECONDS.observe(max(span.total - span.acquire, 0.0), method=span.method)
+    DB_ROWS_RETURNED.observe(span.rows, method=span.method)
+    if failed:
+        DB_ERRORS.inc(method=span.method)
+
+    if SLOW_QUERY_THRESHOLD_MS and span.total * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        DB_SLOW_QUERIES.inc(method=span.method)
+        logger.warning(f"Медленный вызов БД {span.method}: {span.total * 1000:.1f} мс, из них ожидание соединения "
+                       f"{span.acquire * 1000:.1f} мс, строк {span.rows}")
+
+
+def timed_coroutine(method: str, func):
+    """
+    Обертка асинхронного метода с замером времени.
+
+    :param method: Имя метода для меток
+    :param func: Метод
+    :return:
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        span = QuerySpan(method)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        failed = False
+        try:
+            result = await func(*args, **kwargs)
+            span.rows = count_rows(result)
+            return result
+        except Exception:
+            failed = True
+            raise
+        finally:
+            span.total = time.perf_counter() - started
+            _current_span.reset(token)
+            finish_span(span, failed)
+
+    return wrapper
+
+
+def timed_generator(method: str, func):
+    """
+    Обертка асинхронного генератора с замером времени. Учитывается только время получения элементов, время
+    обработки элементов вызывающим кодом (например, отправка ответа клиенту) в замер не входит.
+
+    :param method: Имя метода для меток
+    :param func: Метод-генератор
+    :return:
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        span = QuerySpan(method)
+        generator = func(*args, **kwargs)
+        failed = False
+        try:
+            while True:
+                token = _current_span.set(span)
+                started = time.perf_counter()
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    span.total += time.perf_counter() - started
+                    _current_span.reset(token)
+                span.rows += count_rows(item) if isinstance(item, list) else 1
+                yield item
+        except Exception:
+            failed = True
+            raise
+        finally:
+            await generator.aclose()
+            finish_span(span, failed)
+
+    return wrapper
+
+
+def instrument_db_methods(cls):
+    """
+    Декоратор класса: оборачивает все публичные асинхронные методы и генераторы замером времени ожидания
+    соединения, выполнения и количества возвращенных строк.
+
+    :param cls: Класс сервиса БД
+    :return:
+    """
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith("_"):
+            continue
+        if inspect.isasyncgenfunction(attribute):
+            setattr(cls, name, timed_generator(name, attribute))
+        elif inspect.iscoroutinefunction(attribute):
+            setattr(cls, name, timed_coroutine(name, attribute))
+    return cls
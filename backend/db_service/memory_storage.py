@@ -0,0 +1,337 @@
+import numpy as np
+
+from fastapi import HTTPException
+from loguru import logger
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+from config import APP_WORKERS
+from db_service.instrumentation import instrument_db_methods
+from db_service.storage import StorageBackend, WriteResult, MonthWriteOutcome, MonthWritePlan, \
+    BATCH_ROLLED_BACK_MESSAGE, plan_month_write, aggregate_columns, hundredths_to_decimal
+from exceptions.app_exceptions import UserAlreadyExistException
+from model.concentrate_models import MonthData, ConcentrateRecord, CONCENTRATE_METRICS
+from patterns.singleton import Singleton
+
+
+class MonthColumns:
+    """
+    Данные пользователя за месяц в колоночном виде: наименования и массив показателей в сотых долях процента
+    (строка массива - показатель в порядке CONCENTRATE_METRICS, колонка - концентрат). Массив не изменяется на месте:
+    запись создает новый объект, поэтому читатели без блокировок видят согласованные данные.
+    """
+    __slots__ = ("names", "values")
+
+    def __init__(self, names: List[str], values: np.ndarray):
+        self.names = names
+        self.values = values
+
+    def rows(self) -> Dict[str, Tuple[int, ...]]:
+        """
+        Данные месяца по наименованию, для плана записи.
+
+        :return:
+        """
+        return dict(zip(self.names, map(tuple, self.values.T.tolist())))
+
+    def apply(self, plan: MonthWritePlan) -> "MonthColumns":
+        """
+        Данные месяца после записи по плану.
+
+        :param plan: План записи
+        :return:
+        """
+        deleted = set(plan.deletes)
+        keep = [position for position, name in enumerate(self.names) if name not in deleted]
+        names = [self.names[position] for position in keep]
+        values = self.values[:, keep]
+        if plan.updates:
+            values = values.copy()
+            index = {name: position for position, name in enumerate(names)}
+            for name, row in plan.updates:
+                values[:, index[name]] = row
+
+        if plan.inserts:
+            names = names + [name for name, _ in plan.inserts]
+            inserted = np.array([row for _, row in plan.inserts], dtype=np.int32).T
+            values = np.concatenate([values, inserted], axis=1)
+        return MonthColumns(names, values)
+
+    def records(self) -> List[Dict[str, Any]]:
+        """
+        Строки месяца в формате get_concentrate_data, показатели - Decimal, как NUMERIC из PostgreSQL.
+
+        :return:
+        """
+        columns = [[hundredths_to_decimal(value) for value in row] for row in self.values.tolist()]
+        return [
+            {"name": name, **dict(zip(CONCENTRATE_METRICS, values))}
+            for name, values in zip(self.names, zip(*columns))
+        ]
+
+
+EMPTY_MONTH = MonthColumns([], np.zeros((len(CONCENTRATE_METRICS), 0), dtype=np.int32))
+
+
+@instrument_db_methods
+class MemoryStorageService(StorageBackend, Singleton):
+    """
+    Хранилище в памяти процесса. Данные не сохраняются между запусками и не разделяются между процессами, поэтому
+    подходит для CI, бенчмарков и демонстрации, но не для работы с несколькими воркерами.
+
+    Методы не содержат ожиданий, поэтому каждый из них выполняется целиком без переключения задач и атомарен без
+    блокировок.
+    """
+    name = "memory"
+    # Атрибуты класса, чтобы повторный вызов конструктора синглтона не сбрасывал данные
+    users: Dict[str, Dict[str, Any]] = {}
+    months: Dict[Tuple[int, int, int], MonthColumns] = {}
+    versions: Dict[Tuple[int, int, int], int] = {}
+    _last_version: int = 0
+
+    async def init_pool(self):
+        """
+        Соединений нет, при нескольких воркерах предупреждаем, что данные у каждого свои.
+
+        :return:
+        """
+        if APP_WORKERS > 1:
+            logger.warning(f"Хранилище memory используется в {APP_WORKERS} воркерах: данные у каждого воркера свои")
+
+    async def close_pool(self):
+        """
+        Соединений нет.
+
+        :return:
+        """
+
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        Состояние хранилища: пользователи, месяцы и строки данных.
+
+        :return:
+        """
+        return {
+            "users": len(self.users),
+            "months": len(self.months),
+            "rows": sum(len(month.names) for month in self.months.values()),
+        }
+
+    async def create_tables(self):
+        """
+        Схемы нет.
+
+        :return:
+        """
+        logger.info("Используется хранилище в памяти, данные не сохраняются между запусками")
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        Пользователь по логину.
+
+        :param username: Логин пользователя
+        :return:
+        """
+        return self.users.get(username)
+
+    async def get_existing_usernames(self, usernames: List[str]) -> List[str]:
+        """
+        Логины из списка, которые уже есть в хранилище.
+
+        :param usernames: Логины
+        :return:
+        """
+        return [username for username in usernames if username in self.users]
+
+    async def insert_user(self, username: str, hashed_password: str) -> Dict[str, Any]:
+        """
+        Добавляем нового пользователя.
+
+        :param username: Логин пользователя
+        :param hashed_password: Хешированный пароль
+        :return:
+        """
+        if username in self.users:
+            raise UserAlreadyExistException
+
+        user = {"id": len(self.users) + 1, "username": username, "hashed_password": hashed_password, "is_active": True}
+        self.users[username] = user
+        self.notify_user_changed(username)
+        return {key: user[key] for key in ("id", "username", "is_active")}
+
+    async def update_user_password(self, username: str, hashed_password: str):
+        """
+        Обновляем хэш пароля пользователя.
+
+        :param username: Логин пользователя
+        :param hashed_password: Хешированный пароль
+        :return:
+        """
+        if username in self.users:
+            self.users[username] = {**self.users[username], "hashed_password": hashed_password}
+        self.notify_user_changed(username)
+
+    async def insert_concentrate_batches(self, month: int, year: int, current_user: Mapping[str, Any],
+                                         batches: AsyncIterable[List[ConcentrateRecord]],
+                                         mode: str = "append") -> WriteResult:
+        """
+        Запись данных за месяц. Пачки сначала собираются целиком, затем месяц заменяется одной операцией, поэтому
+        ошибка в любой пачке ничего не меняет.
+
+        :param month: Месяц
+        :param year: Год
+        :param current_user: Пользователь
+        :param batches: Асинхронный итератор пачек записей
+        :param mode: Режим записи, см. WRITE_MODES
+        :return:
+        """
+        records = [record async for batch in batches for record in batch]
+        key = (current_user["id"], year, month)
+        updated, result = self._write_month(self.months.get(key, EMPTY_MONTH), records, mode)
+        self._store_month(key, updated, result)
+        return result
+
+    async def insert_concentrate_months(self, months: List[MonthData], current_user: Mapping[str, Any],
+                                        mode: str = "append", atomic: bool = False) -> List[MonthWriteOutcome]:
+        """
+        Пакетная запись данных за несколько месяцев. Новые данные месяцев сохраняются только после проверки всех
+        месяцев, поэтому при atomic и ошибке не меняется ни один месяц.
+
+        :param months: Данные за месяцы, месяцы не должны повторяться
+        :param current_user: Пользователь
+        :param mode: Режим записи, см. WRITE_MODES
+        :param atomic: Записать все месяцы или ни одного
+        :return:
+        """
+        outcomes, written = [], []
+        for month_data in sorted(months, key=lambda item: (item.year, item.month)):
+            key = (current_user["id"], month_data.year, month_data.month)
+            try:
+                updated, result = self._write_month(self.months.get(key, EMPTY_MONTH), month_data.data, mode)
+            except HTTPException as e:
+                outcomes.append(MonthWriteOutcome(month_data.month, month_data.year, None, str(e.detail)))
+                continue
+            outcomes.append(MonthWriteOutcome(month_data.month, month_data.year, result, None))
+            written.append((key, updated, result))
+
+        if atomic and any(outcome.error for outcome in outcomes):
+            return [
+                outcome if outcome.error else outcome._replace(result=None, error=BATCH_ROLLED_BACK_MESSAGE)
+                for outcome in outcomes
+            ]
+        for key, updated, result in written:
+            self._store_month(key, updated, result)
+        return outcomes
+
+    @staticmethod
+    def _write_month(current: MonthColumns, records: List[ConcentrateRecord],
+                     mode: str) -> Tuple[MonthColumns, WriteResult]:
+        """
+        Новые данные месяца после записи в режиме mode.
+
+        :param current: Текущие данные месяца
+        :param records: Записываемые записи
+        :param mode: Режим записи
+        :return: (данные месяца, итог записи)
+        """
+        plan = plan_month_write(current.rows(), records, mode)
+        return current.apply(plan), plan.result
+
+    def _store_month(self, key: Tuple[int, int, int], month: MonthColumns, result: WriteResult):
+        """
+        Сохраняем данные месяца и, если они изменились, новую версию данных.
+
+        :param key: (пользователь, год, месяц)
+        :param month: Данные месяца
+        :param result: Итог записи
+        :return:
+        """
+        if not (result.inserted or result.updated or result.deleted):
+            return
+        if month.names:
+            self.months[key] = month
+        else:
+            self.months.pop(key, None)
+        MemoryStorageService._last_version += 1
+        self.versions[key] = self._last_version
+
+    async def get_concentrate_data(self, month: int, year: int, user_id: int) -> List[Dict[str, Any]]:
+        """
+        Данные пользователя за месяц.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :return:
+        """
+        return self.months.get((user_id, year, month), EMPTY_MONTH).records()
+
+    async def get_concentrate_summary(self, month: int, year: int, user_id: int,
+                                      extended: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Агрегаты за месяц векторно по колонкам месяца.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :param extended: Считать дополнительные показатели
+        :return:
+        """
+        return aggregate_columns(self.months.get((user_id, year, month), EMPTY_MONTH).values, extended)
+
+    async def get_data_version(self, month: int, year: int, user_id: int) -> int:
+        """
+        Версия данных пользователя за месяц.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :return:
+        """
+        return self.versions.get((user_id, year, month), 0)
+
+    async def get_period_version(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int]) -> int:
+        """
+        Версия данных пользователя за период.
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :return:
+        """
+        return max((
+            version for (created_by, year, month), version in self.versions.items()
+            if created_by == user_id and period_from <= (year, month) <= period_to
+        ), default=0)
+
+    async def iter_concentrate_rows(self, user_id: int, period_from: Optional[Tuple[int, int]] = None,
+                                    period_to: Optional[Tuple[int, int]] = None,
+                                    batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Строки пользователя за период пачками по batch_size.
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц), по умолчанию - вся история
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param batch_size: Размер пачки
+        :return:
+        """
+        periods = sorted(
+            (year, month) for created_by, year, month in self.months
+            if created_by == user_id and (not period_from or (year, month) >= period_from)
+            and (not period_to or (year, month) <= period_to)
+        )
+        batch = []
+        for year, month in periods:
+            data = self.months.get((user_id, year, month))
+            if data is None:
+                continue
+            batch += [
+                {"year": year, "month": month, "name": name,
+                 **{metric: hundredths_to_decimal(value) for metric, value in zip(CONCENTRATE_METRICS, values)}}
+                for name, values in zip(data.names, data.values.T.tolist())
+            ]
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+        if batch:
+            yield batch
@@ -0,0 +1,258 @@
+from asyncpg import Connection
+from loguru import logger
+from typing import Callable, List, NamedTuple, Tuple
+
+from config import CONCENTRATE_COVERING_INDEX, CONCENTRATE_PARTITION_BY_YEAR
+from db_service.rollup import CREATE_MONTHLY_STATS_TABLE, BACKFILL_MONTHLY_STATS, CREATE_DATA_VERSIONS_TABLE, \
+    BACKFILL_DATA_VERSIONS, REFRESH_DEDUPLICATED_MONTHS, ADD_SUMSQ_COLUMNS, BACKFILL_SUMSQ_COLUMNS
+
+
+class Migration(NamedTuple):
+    """
+    Версионированная миграция схемы БД.
+
+    version - номер версии, миграции применяются по возрастанию;
+    description - описание для schema_version и логов;
+    statements - SQL-выражения, выполняются в одной транзакции;
+    enabled - необязательные миграции применяются только при включенной настройке и могут быть применены позже.
+    """
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+    enabled: Callable[[], bool] = lambda: True
+
+
+CREATE_SCHEMA_VERSION_TABLE = """
+CREATE TABLE schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Перевод concentrate_quality в секционированную по году таблицу. Индексы старой таблицы (кроме первичного ключа)
+# пересоздаются на новой, поэтому миграцию можно включить и после применения последующих версий.
+PARTITION_CONCENTRATE_BY_YEAR = """
+DO $$
+DECLARE
+    index_defs TEXT[];
+    index_def TEXT;
+    partition_year INTEGER;
+BEGIN
+    SELECT COALESCE(array_agg(indexdef), '{}') INTO index_defs
+    FROM pg_indexes
+    WHERE schemaname = current_schema() AND tablename = 'concentrate_quality'
+        AND indexname <> 'concentrate_quality_pkey';
+
+    ALTER TABLE concentrate_quality RENAME TO concentrate_quality_unpartitioned;
+    ALTER SEQUENCE concentrate_quality_id_seq OWNED BY NONE;
+
+    CREATE TABLE concentrate_quality (
+        id INTEGER NOT NULL DEFAULT nextval('concentrate_quality_id_seq'),
+        name TEXT NOT NULL,
+        iron NUMERIC(5,2) NOT NULL,
+        silicon NUMERIC(5,2) NOT NULL,
+        aluminum NUMERIC(5,2) NOT NULL,
+        calcium NUMERIC(5,2) NOT NULL,
+        sulfur NUMERIC(5,2) NOT NULL,
+        month INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by INTEGER REFERENCES users(id),
+        PRIMARY KEY (id, year)
+    ) PARTITION BY RANGE (year);
+
+    FOR partition_year IN
+        SELECT generate_series(
+            LEAST(COALESCE(MIN(year), extract(year FROM now())::int), extract(year FROM now())::int),
+            extract(year FROM now())::int + 5
+        ) FROM concentrate_quality_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE concentrate_quality_y%s PARTITION OF concentrate_quality FOR VALUES FROM (%s) TO (%s)',
+            partition_year, partition_year, partition_year + 1
+        );
+    END LOOP;
+    CREATE TABLE concentrate_quality_default PARTITION OF concentrate_quality DEFAULT;
+
+    INSERT INTO concentrate_quality SELECT * FROM concentrate_quality_unpartitioned;
+    DROP TABLE concentrate_quality_unpartitioned;
+    ALTER SEQUENCE concentrate_quality_id_seq OWNED BY concentrate_quality.id;
+
+    FOREACH index_def IN ARRAY index_defs LOOP
+        EXECUTE replace(index_def, 'concentrate_quality_unpartitioned', 'concentrate_quality');
+    END LOOP;
+END
+$$;
+"""
+
+# Удаление дубликатов концентрата в месяце пользователя перед созданием уникального индекса: остается последняя
+# записанная строка. Затронутые месяцы сохраняются во временную таблицу для пересчета сводки и версий.
+DEDUPLICATE_CONCENTRATE_QUALITY = (
+    """
+    CREATE TEMP TABLE deduplicated_months (
+        created_by INTEGER, year INTEGER, month INTEGER
+    ) ON COMMIT DROP;
+    """,
+    """
+    WITH removed AS (
+        DELETE FROM concentrate_quality q
+        USING (
+            SELECT id, year, row_number() OVER (
+                PARTITION BY created_by, year, month, name ORDER BY id DESC
+            ) AS position
+            FROM concentrate_quality
+        ) d
+        WHERE q.id = d.id AND q.year = d.year AND d.position > 1
+        RETURNING q.created_by, q.year, q.month
+    )
+    INSERT INTO deduplicated_months SELECT DISTINCT created_by, year, month FROM removed;
+    """,
+    *REFRESH_DEDUPLICATED_MONTHS,
+)
+
+# Очередь фоновых задач (импорт таблиц, отчеты за период). Воркеры забирают задачи через FOR UPDATE SKIP LOCKED,
+# входные данные и результат хранятся в самой задаче
+CREATE_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    created_by INTEGER NOT NULL REFERENCES users(id),
+    params JSONB NOT NULL DEFAULT '{}',
+    payload BYTEA,
+    result BYTEA,
+    result_type TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    heartbeat_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_queued ON jobs (id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS ix_jobs_running ON jobs (heartbeat_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS ix_jobs_user ON jobs (created_by, id);
+"""
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Таблицы users и concentrate_quality", (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            hashed_password TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS concentrate_quality (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            iron NUMERIC(5,2) NOT NULL,
+            silicon NUMERIC(5,2) NOT NULL,
+            aluminum NUMERIC(5,2) NOT NULL,
+            calcium NUMERIC(5,2) NOT NULL,
+            sulfur NUMERIC(5,2) NOT NULL,
+            month INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by INTEGER REFERENCES users(id)
+        );
+        """,
+    )),
+    Migration(2, "Индекс concentrate_quality (created_by, year, month)", (
+        "CREATE INDEX IF NOT EXISTS ix_concentrate_quality_user_period "
+        "ON concentrate_quality (created_by, year, month);",
+    )),
+    Migration(3, "Покрывающий индекс concentrate_quality для отчетов", (
+        "CREATE INDEX IF NOT EXISTS ix_concentrate_quality_user_period_covering "
+        "ON concentrate_quality (created_by, year, month) INCLUDE (name, iron, silicon, aluminum, calcium, sulfur);",
+        "DROP INDEX IF EXISTS ix_concentrate_quality_user_period;",
+    ), enabled=lambda: CONCENTRATE_COVERING_INDEX),
+    Migration(4, "Секционирование concentrate_quality по году", (
+        PARTITION_CONCENTRATE_BY_YEAR,
+    ), enabled=lambda: CONCENTRATE_PARTITION_BY_YEAR),
+    Migration(5, "Помесячная сводка concentrate_monthly_stats", (
+        CREATE_MONTHLY_STATS_TABLE,
+        BACKFILL_MONTHLY_STATS,
+    )),
+    Migration(6, "Версии данных concentrate_data_versions", (
+        CREATE_DATA_VERSIONS_TABLE,
+        BACKFILL_DATA_VERSIONS,
+    )),
+    Migration(7, "Уникальный концентрат в месяце пользователя", (
+        *DEDUPLICATE_CONCENTRATE_QUALITY,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_concentrate_quality_user_period_name "
+        "ON concentrate_quality (created_by, year, month, name);",
+        # Индекс версии 2 - префикс уникального и больше не нужен
+        "DROP INDEX IF EXISTS ix_concentrate_quality_user_period;",
+    )),
+    Migration(8, "Очередь фоновых задач jobs", (
+        CREATE_JOBS_TABLE,
+    )),
+    Migration(9, "Сумма квадратов в сводке и индексы по периоду для отчета по организации", (
+        ADD_SUMSQ_COLUMNS,
+        BACKFILL_SUMSQ_COLUMNS,
+        "CREATE INDEX IF NOT EXISTS ix_concentrate_monthly_stats_period ON concentrate_monthly_stats (year, month);",
+        "CREATE INDEX IF NOT EXISTS ix_concentrate_quality_period ON concentrate_quality (year, month);",
+    )),
+    Migration(10, "Индекс concentrate_quality по концентрату для трендов", (
+        "CREATE INDEX IF NOT EXISTS ix_concentrate_quality_user_name_period "
+        "ON concentrate_quality (created_by, name, year, month);",
+    )),
+]
+
+
+async def get_applied_versions(con: Connection) -> List[int]:
+    """
+    Список примененных версий схемы.
+
+    :param con: Соединение с БД
+    :return:
+    """
+    if not await con.fetchval("SELECT to_regclass('schema_version') IS NOT NULL;"):
+        return []
+    return [row["version"] for row in await con.fetch("SELECT version FROM schema_version ORDER BY version;")]
+
+
+async def get_pending_versions(con: Connection) -> List[int]:
+    """
+    Список включенных, но еще не примененных версий схемы.
+
+    :param con: Соединение с БД
+    :return:
+    """
+    applied = set(await get_applied_versions(con))
+    return [migration.version for migration in MIGRATIONS if migration.enabled() and migration.version not in applied]
+
+
+async def apply_migrations(con: Connection) -> List[int]:
+    """
+    Применяем непримененные миграции по возрастанию версии. Каждая миграция выполняется в своей транзакции вместе
+    с записью в schema_version, поэтому повторно не выполняется.
+
+    :param con: Соединение с БД
+    :return: Список примененных за этот вызов версий
+    """
+    applied = set(await get_applied_versions(con))
+    if not applied and not await con.fetchval("SELECT to_regclass('schema_version') IS NOT NULL;"):
+        await con.execute(CREATE_SCHEMA_VERSION_TABLE)
+
+    newly_applied = []
+    for migration in MIGRATIONS:
+        if migration.version in applied or not migration.enabled():
+            continue
+
+        async with con.transaction():
+            for statement in migration.statements:
+                await con.execute(statement)
+            await con.execute(
+                "INSERT INTO schema_version (version, description) VALUES ($1, $2);",
+                migration.version, migration.description
+            )
+        logger.info(f"Применена миграция {migration.version}: {migration.description}")
+        newly_applied.append(migration.version)
+
+    return newly_applied
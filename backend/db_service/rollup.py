@@ -0,0 +1,231 @@
+from asyncpg import Connection, Record
+from typing import List, Optional
+
+from model.concentrate_models import ConcentrateRecord, CONCENTRATE_METRICS
+
+
+# Помесячная сводка concentrate_monthly_stats: количество строк и сумма/минимум/максимум по каждому показателю для
+# (пользователь, год, месяц). Обновляется в той же транзакции, что и запись данных концентратов.
+BASE_STATS_COLUMNS = ["count"] + [f"{metric}_{aggregate}" for metric in CONCENTRATE_METRICS
+                                  for aggregate in ("sum", "min", "max")]
+# Сумма квадратов по каждому показателю (миграция 9): вместе с количеством и суммой позволяет точно посчитать
+# стандартное отклонение по объединению сводок нескольких пользователей и месяцев
+SUMSQ_COLUMNS = [f"{metric}_sumsq" for metric in CONCENTRATE_METRICS]
+STATS_COLUMNS = BASE_STATS_COLUMNS + SUMSQ_COLUMNS
+
+CREATE_MONTHLY_STATS_TABLE = f"""
+CREATE TABLE IF NOT EXISTS concentrate_monthly_stats (
+    created_by INTEGER NOT NULL REFERENCES users(id),
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    {", ".join(f"{metric}_sum NUMERIC NOT NULL, {metric}_min NUMERIC(5,2) NOT NULL, "
+               f"{metric}_max NUMERIC(5,2) NOT NULL" for metric in CONCENTRATE_METRICS)},
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (created_by, year, month)
+);
+"""
+
+_BASE_AGGREGATE_EXPRESSIONS = ", ".join(
+    ["COUNT(*)"] + [f"SUM({metric}), MIN({metric}), MAX({metric})" for metric in CONCENTRATE_METRICS]
+)
+_AGGREGATE_EXPRESSIONS = ", ".join(
+    [_BASE_AGGREGATE_EXPRESSIONS] + [f"SUM({metric} * {metric})" for metric in CONCENTRATE_METRICS]
+)
+
+# Пересчет сводки по строкам concentrate_quality, условие отбора подставляется через format
+_REFRESH_FROM_RAW = f"""
+INSERT INTO concentrate_monthly_stats (created_by, year, month, {", ".join(STATS_COLUMNS)})
+SELECT created_by, year, month, {_AGGREGATE_EXPRESSIONS}
+FROM concentrate_quality
+WHERE {{condition}}
+GROUP BY created_by, year, month;
+"""
+
+# Тот же пересчет по колонкам сводки до миграции 9, им пользуются миграции 5 и 7
+_REFRESH_BASE_FROM_RAW = f"""
+INSERT INTO concentrate_monthly_stats (created_by, year, month, {", ".join(BASE_STATS_COLUMNS)})
+SELECT created_by, year, month, {_BASE_AGGREGATE_EXPRESSIONS}
+FROM concentrate_quality
+WHERE {{condition}}
+GROUP BY created_by, year, month;
+"""
+
+# Инкрементальное добавление пачки: агрегаты пачки считаются в БД по массивам значений с приведением к
+# NUMERIC(5,2), как при записи в concentrate_quality, и складываются с существующей строкой сводки
+ADD_BATCH_TO_MONTHLY_STATS = f"""
+INSERT INTO concentrate_monthly_stats AS s (created_by, year, month, {", ".join(STATS_COLUMNS)})
+SELECT $1, $2, $3, {_AGGREGATE_EXPRESSIONS}
+FROM unnest({", ".join(f"${index}::numeric(5,2)[]" for index in range(4, 4 + len(CONCENTRATE_METRICS)))})
+    AS batch({", ".join(CONCENTRATE_METRICS)})
+ON CONFLICT (created_by, year, month) DO UPDATE SET
+    count = s.count + EXCLUDED.count,
+    {", ".join(f"{metric}_sum = s.{metric}_sum + EXCLUDED.{metric}_sum, "
+               f"{metric}_min = LEAST(s.{metric}_min, EXCLUDED.{metric}_min), "
+               f"{metric}_max = GREATEST(s.{metric}_max, EXCLUDED.{metric}_max)" for metric in CONCENTRATE_METRICS)},
+    {", ".join(f"{column} = s.{column} + EXCLUDED.{column}" for column in SUMSQ_COLUMNS)},
+    updated_at = CURRENT_TIMESTAMP;
+"""
+
+BACKFILL_MONTHLY_STATS = _REFRESH_BASE_FROM_RAW.format(condition="created_by IS NOT NULL")
+
+# Миграция 9: колонки суммы квадратов и их заполнение по истории
+ADD_SUMSQ_COLUMNS = f"""
+ALTER TABLE concentrate_monthly_stats
+    {", ".join(f"ADD COLUMN IF NOT EXISTS {column} NUMERIC NOT NULL DEFAULT 0" for column in SUMSQ_COLUMNS)};
+"""
+
+BACKFILL_SUMSQ_COLUMNS = f"""
+UPDATE concentrate_monthly_stats s SET {", ".join(f"{column} = r.{column}" for column in SUMSQ_COLUMNS)}
+FROM (
+    SELECT created_by, year, month, {", ".join(f"SUM({metric} * {metric}) AS {metric}_sumsq"
+                                               for metric in CONCENTRATE_METRICS)}
+    FROM concentrate_quality
+    WHERE created_by IS NOT NULL
+    GROUP BY created_by, year, month
+) r
+WHERE s.created_by = r.created_by AND s.year = r.year AND s.month = r.month;
+"""
+
+# Версия данных за (пользователь, год, месяц). Значения берутся из общей последовательности и только растут, поэтому
+# по версии можно формировать ETag и ключи кэша, даже если данные месяца удалялись.
+CREATE_DATA_VERSIONS_TABLE = """
+CREATE SEQUENCE IF NOT EXISTS concentrate_data_version_seq;
+CREATE TABLE IF NOT EXISTS concentrate_data_versions (
+    created_by INTEGER NOT NULL REFERENCES users(id),
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    version BIGINT NOT NULL DEFAULT nextval('concentrate_data_version_seq'),
+    PRIMARY KEY (created_by, year, month)
+);
+"""
+
+BACKFILL_DATA_VERSIONS = """
+INSERT INTO concentrate_data_versions (created_by, year, month)
+SELECT created_by, year, month FROM concentrate_monthly_stats
+ON CONFLICT DO NOTHING;
+"""
+
+# Пересчет сводки и версий данных за месяцы из временной таблицы deduplicated_months (created_by, year, month),
+# используется миграцией удаления дубликатов
+REFRESH_DEDUPLICATED_MONTHS = (
+    """
+    DELETE FROM concentrate_monthly_stats s USING deduplicated_months d
+    WHERE s.created_by = d.created_by AND s.year = d.year AND s.month = d.month;
+    """,
+    _REFRESH_BASE_FROM_RAW.format(
+        condition="(created_by, year, month) IN (SELECT created_by, year, month FROM deduplicated_months)"
+    ),
+    """
+    UPDATE concentrate_data_versions v SET version = nextval('concentrate_data_version_seq')
+    FROM deduplicated_months d
+    WHERE v.created_by = d.created_by AND v.year = d.year AND v.month = d.month;
+    """,
+)
+
+
+async def lock_month(con: Connection, user_id: int, year: int, month: int):
+    """
+    Транзакционная advisory-блокировка месяца пользователя: параллельные записи за один месяц выполняются по очереди,
+    иначе перезапись может не увидеть чужие строки, а пересчет сводки - упасть на конфликте ключа.
+
+    :param con: Соединение с БД (внутри транзакции записи данных)
+    :param user_id: Id пользователя
+    :param year: Год
+    :param month: Месяц
+    :return:
+    """
+    await con.execute("SELECT pg_advisory_xact_lock($1, $2);", user_id, year * 12 + month)
+
+
+async def add_batch_to_monthly_stats(con: Connection, user_id: int, year: int, month: int,
+                                     batch: List[ConcentrateRecord]):
+    """
+    Инкрементально добавляем пачку записей в сводку за месяц.
+
+    :param con: Соединение с БД (внутри транзакции записи данных)
+    :param user_id: Id пользователя
+    :param year: Год
+    :param month: Месяц
+    :param batch: Пачка записей
+    :return:
+    """
+    columns = [[getattr(record, metric) for record in batch] for metric in CONCENTRATE_METRICS]
+    await con.execute(ADD_BATCH_TO_MONTHLY_STATS, user_id, year, month, *columns)
+
+
+async def add_rows_to_monthly_stats(con: Connection, user_id: int, year: int, month: int, rows: List[Record]):
+    """
+    Инкрементально добавляем в сводку за месяц строки, прочитанные из БД (например, RETURNING вставки).
+
+    :param con: Соединение с БД (внутри транзакции записи данных)
+    :param user_id: Id пользователя
+    :param year: Год
+    :param month: Месяц
+    :param rows: Строки с колонками показателей
+    :return:
+    """
+    columns = [[row[metric] for row in rows] for metric in CONCENTRATE_METRICS]
+    await con.execute(ADD_BATCH_TO_MONTHLY_STATS, user_id, year, month, *columns)
+
+
+async def refresh_monthly_stats(con: Connection, user_id: int, year: int, month: int):
+    """
+    Пересчитываем сводку за месяц по строкам concentrate_quality. Если данных не осталось, строка сводки удаляется.
+
+    :param con: Соединение с БД (внутри транзакции записи данных)
+    :param user_id: Id пользователя
+    :param year: Год
+    :param month: Месяц
+    :return:
+    """
+    await con.execute(
+        "DELETE FROM concentrate_monthly_stats WHERE created_by = $1 AND year = $2 AND month = $3;",
+        user_id, year, month
+    )
+    await con.execute(
+        _REFRESH_FROM_RAW.format(condition="created_by = $1 AND year = $2 AND month = $3"),
+        user_id, year, month
+    )
+
+
+async def bump_data_version(con: Connection, user_id: int, year: int, month: int):
+    """
+    Увеличиваем версию данных за месяц. Вызывается в транзакции записи данных.
+
+    :param con: Соединение с БД
+    :param user_id: Id пользователя
+    :param year: Год
+    :param month: Месяц
+    :return:
+    """
+    await con.execute(
+        """INSERT INTO concentrate_data_versions (created_by, year, month) VALUES ($1, $2, $3)
+        ON CONFLICT (created_by, year, month) DO UPDATE SET version = nextval('concentrate_data_version_seq');""",
+        user_id, year, month
+    )
+
+
+async def rebuild_monthly_stats(con: Connection, user_id: Optional[int] = None, year: Optional[int] = None) -> int:
+    """
+    Полностью перестраиваем сводку по истории. Можно ограничить пользователем и/или годом.
+
+    :param con: Соединение с БД
+    :param user_id: Id пользователя
+    :param year: Год
+    :return: Количество строк сводки
+    """
+    conditions = ["created_by IS NOT NULL"]
+    args = []
+    if user_id is not None:
+        args.append(user_id)
+        conditions.append(f"created_by = ${len(args)}")
+    if year is not None:
+        args.append(year)
+        conditions.append(f"year = ${len(args)}")
+    condition = " AND ".join(conditions)
+
+    async with con.transaction():
+        await con.execute(f"DELETE FROM concentrate_monthly_stats WHERE {condition};", *args)
+        result = await con.execute(_REFRESH_FROM_RAW.format(condition=condition), *args)
+    return int(result.split()[-1])
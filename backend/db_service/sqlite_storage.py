@@ -0,0 +1,538 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from loguru import logger
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Mapping, Optional, Tuple
+
+from config import SQLITE_PATH, SQLITE_READERS
+from db_service.instrumentation import instrument_db_methods
+from db_service.storage import StorageBackend, WriteResult, MonthWriteOutcome, BATCH_ROLLED_BACK_MESSAGE, \
+    plan_month_write, aggregate_columns, hundredths_to_decimal
+from exceptions.app_exceptions import UserAlreadyExistException
+from model.concentrate_models import MonthData, ConcentrateRecord, CONCENTRATE_METRICS
+from patterns.singleton import Singleton
+from utils.period_utils import shift_period
+
+
+# Схема встроенной БД. Показатели хранятся целыми числами в сотых долях процента: суммы и сравнения точные, как у
+# NUMERIC(5,2) в PostgreSQL. Версия данных за месяц берется больше всех выданных, поэтому, как и в PostgreSQL, только
+# растет.
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS concentrate_quality (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_by INTEGER NOT NULL REFERENCES users(id),
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    {", ".join(f"{metric} INTEGER NOT NULL" for metric in CONCENTRATE_METRICS)},
+    UNIQUE (created_by, year, month, name)
+);
+CREATE INDEX IF NOT EXISTS ix_concentrate_quality_user_name_period
+    ON concentrate_quality (created_by, name, year, month);
+CREATE TABLE IF NOT EXISTS concentrate_data_versions (
+    created_by INTEGER NOT NULL REFERENCES users(id),
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (created_by, year, month)
+) WITHOUT ROWID;
+"""
+
+METRIC_COLUMNS = ", ".join(CONCENTRATE_METRICS)
+MONTH_CONDITION = "created_by = ? AND year = ? AND month = ?"
+
+INSERT_ROW = f"""INSERT INTO concentrate_quality (created_by, year, month, name, {METRIC_COLUMNS})
+VALUES (?, ?, ?, ?, {", ".join("?" for _ in CONCENTRATE_METRICS)});"""
+UPDATE_ROW = f"""UPDATE concentrate_quality SET {", ".join(f"{metric} = ?" for metric in CONCENTRATE_METRICS)}
+WHERE {MONTH_CONDITION} AND name = ?;"""
+BUMP_DATA_VERSION = """INSERT INTO concentrate_data_versions (created_by, year, month, version)
+VALUES (?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM concentrate_data_versions))
+ON CONFLICT (created_by, year, month) DO UPDATE SET version = excluded.version;"""
+
+
+def open_connection(path: str) -> sqlite3.Connection:
+    """
+    Соединение со встроенной БД в режиме WAL: читатели не блокируют запись и друг друга. Транзакции записи
+    открываются явно (BEGIN IMMEDIATE), поэтому соединение в режиме autocommit.
+
+    :param path: Файл БД
+    :return:
+    """
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    return conn
+
+
+def write_month(conn: sqlite3.Connection, user_id: int, year: int, month: int, records: List[ConcentrateRecord],
+                mode: str) -> WriteResult:
+    """
+    Запись данных за месяц в текущей транзакции: изменения считаются по текущим строкам месяца (plan_month_write) и
+    записываются пакетно, если данные изменились - новая версия данных.
+
+    :param conn: Соединение (внутри транзакции записи)
+    :param user_id: Id пользователя
+    :param year: Год
+    :param month: Месяц
+    :param records: Записываемые записи
+    :param mode: Режим записи, см. WRITE_MODES
+    :return:
+    """
+    period = (user_id, year, month)
+    existing = {
+        row[0]: tuple(row[1:]) for row in conn.execute(
+            f"SELECT name, {METRIC_COLUMNS} FROM concentrate_quality WHERE {MONTH_CONDITION};", period
+        )
+    }
+    plan = plan_month_write(existing, records, mode)
+
+    if mode == "replace":
+        conn.execute(f"DELETE FROM concentrate_quality WHERE {MONTH_CONDITION};", period)
+    elif plan.deletes:
+        conn.executemany(
+            f"DELETE FROM concentrate_quality WHERE {MONTH_CONDITION} AND name = ?;",
+            [(*period, name) for name in plan.deletes]
+        )
+    conn.executemany(UPDATE_ROW, [(*values, *period, name) for name, values in plan.updates])
+    conn.executemany(INSERT_ROW, [(*period, name, *values) for name, values in plan.inserts])
+
+    if plan.result.inserted or plan.result.updated or plan.result.deleted:
+        conn.execute(BUMP_DATA_VERSION, period)
+    return plan.result
+
+
+class BatchRolledBack(Exception):
+    """
+    Пакет месяцев отменен при atomic=True: транзакция откатывается, итоги месяцев возвращаются вызывающему коду.
+    """
+
+    def __init__(self, outcomes: List[MonthWriteOutcome]):
+        super().__init__("batch rolled back")
+        self.outcomes = outcomes
+
+
+def write_months(conn: sqlite3.Connection, user_id: int, months: List[MonthData], mode: str,
+                 atomic: bool) -> List[MonthWriteOutcome]:
+    """
+    Пакетная запись месяцев в текущей транзакции, каждый месяц - в своей точке сохранения.
+
+    :param conn: Соединение (внутри транзакции записи)
+    :param user_id: Id пользователя
+    :param months: Данные за месяцы
+    :param mode: Режим записи
+    :param atomic: Записать все месяцы или ни одного
+    :return:
+    """
+    outcomes = []
+    for month_data in sorted(months, key=lambda item: (item.year, item.month)):
+        conn.execute("SAVEPOINT month;")
+        try:
+            result = write_month(conn, user_id, month_data.year, month_data.month, month_data.data, mode)
+        except (HTTPException, sqlite3.DatabaseError) as e:
+            conn.execute("ROLLBACK TO month;")
+            error = str(e.detail) if isinstance(e, HTTPException) else str(e)
+            outcomes.append(MonthWriteOutcome(month_data.month, month_data.year, None, error))
+        else:
+            outcomes.append(MonthWriteOutcome(month_data.month, month_data.year, result, None))
+        conn.execute("RELEASE month;")
+
+    if atomic and any(outcome.error for outcome in outcomes):
+        raise BatchRolledBack([
+            outcome if outcome.error else outcome._replace(result=None, error=BATCH_ROLLED_BACK_MESSAGE)
+            for outcome in outcomes
+        ])
+    return outcomes
+
+
+@instrument_db_methods
+class SQLiteService(StorageBackend, Singleton):
+    """
+    Встроенная БД SQLite в одном файле (SQLITE_PATH) для установки на одной площадке без сервера PostgreSQL.
+    Драйвер sqlite3 блокирующий, поэтому запросы выполняются в потоках: чтение - в пуле из SQLITE_READERS потоков,
+    у каждого свое соединение, запись - в одном отдельном потоке. В режиме WAL чтение идет параллельно с записью,
+    а записи выполняются по очереди и не ждут освобождения блокировки файла.
+    """
+    name = "sqlite"
+    # Атрибуты класса, чтобы повторный вызов конструктора синглтона не сбрасывал потоки
+    _readers: Optional[ThreadPoolExecutor] = None
+    _writer: Optional[ThreadPoolExecutor] = None
+    _local = threading.local()
+    _connections: List[sqlite3.Connection] = []
+    _connections_lock = threading.Lock()
+    _reading: int = 0
+    _writing: int = 0
+
+    async def init_pool(self):
+        """
+        Создаем потоки чтения и записи. Соединения открываются в потоках при первом запросе.
+
+        :return:
+        """
+        if self._readers is not None:
+            return
+
+        directory = os.path.dirname(SQLITE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        SQLiteService._readers = ThreadPoolExecutor(max(SQLITE_READERS, 1), thread_name_prefix="sqlite-read")
+        SQLiteService._writer = ThreadPoolExecutor(1, thread_name_prefix="sqlite-write")
+        logger.info(f"Встроенная БД {SQLITE_PATH}, потоков чтения: {max(SQLITE_READERS, 1)}")
+
+    async def close_pool(self):
+        """
+        Останавливаем потоки и закрываем соединения.
+
+        :return:
+        """
+        if self._readers is None:
+            return
+
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        SQLiteService._readers = SQLiteService._writer = None
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        SQLiteService._local = threading.local()
+        logger.info("Соединения со встроенной БД закрыты")
+
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        Состояние соединений: открытые соединения, выполняемые чтения и записи.
+
+        :return:
+        """
+        return {
+            "connections": len(self._connections),
+            "readers": max(SQLITE_READERS, 1),
+            "reading": self._reading,
+            "writing": self._writing,
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Соединение текущего потока, открывается при первом обращении.
+
+        :return:
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_connection(SQLITE_PATH)
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _in_transaction(self, func: Callable, *args):
+        """
+        Выполняем функцию в транзакции записи соединения текущего потока.
+
+        :param func: Функция, первый аргумент - соединение
+        :param args: Остальные аргументы
+        :return:
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK;")
+            raise
+        conn.execute("COMMIT;")
+        return result
+
+    async def _read(self, func: Callable, *args):
+        """
+        Выполняем чтение в потоке чтения.
+
+        :param func: Функция, первый аргумент - соединение
+        :param args: Остальные аргументы
+        :return:
+        """
+        if self._readers is None:
+            await self.init_pool()
+        SQLiteService._reading += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._readers, lambda: func(self._connection(), *args)
+            )
+        finally:
+            SQLiteService._reading -= 1
+
+    async def _write(self, func: Callable, *args):
+        """
+        Выполняем запись в потоке записи в одной транзакции.
+
+        :param func: Функция, первый аргумент - соединение
+        :param args: Остальные аргументы
+        :return:
+        """
+        if self._writer is None:
+            await self.init_pool()
+        SQLiteService._writing += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._writer, lambda: self._in_transaction(func, *args)
+            )
+        finally:
+            SQLiteService._writing -= 1
+
+    async def create_tables(self):
+        """
+        Создаем таблицы встроенной БД, если их нет.
+
+        :return:
+        """
+        def create(conn: sqlite3.Connection):
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+
+        await self._write(create)
+        logger.info(f"Схема встроенной БД {SQLITE_PATH} в актуальном состоянии")
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        Пользователь по логину.
+
+        :param username: Логин пользователя
+        :return:
+        """
+        row = await self._read(lambda conn: conn.execute(
+            "SELECT id, username, hashed_password, is_active FROM users WHERE username = ?;", (username,)
+        ).fetchone())
+        if row is None:
+            return None
+        return {"id": row[0], "username": row[1], "hashed_password": row[2], "is_active": bool(row[3])}
+
+    async def get_existing_usernames(self, usernames: List[str]) -> List[str]:
+        """
+        Логины из списка, которые уже есть в БД. Проверяется одним запросом.
+
+        :param usernames: Логины
+        :return:
+        """
+        rows = await self._read(lambda conn: conn.execute(
+            "SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?));", (json.dumps(usernames),)
+        ).fetchall())
+        return [row[0] for row in rows]
+
+    async def insert_user(self, username: str, hashed_password: str) -> Dict[str, Any]:
+        """
+        Добавляем нового пользователя.
+
+        :param username: Логин пользователя
+        :param hashed_password: Хешированный пароль
+        :return:
+        """
+        def insert(conn: sqlite3.Connection):
+            return conn.execute(
+                "INSERT INTO users (username, hashed_password) VALUES (?, ?) RETURNING id, username, is_active;",
+                (username, hashed_password)
+            ).fetchone()
+
+        try:
+            row = await self._write(insert)
+        except sqlite3.IntegrityError:
+            raise UserAlreadyExistException
+        self.notify_user_changed(username)
+        return {"id": row[0], "username": row[1], "is_active": bool(row[2])}
+
+    async def update_user_password(self, username: str, hashed_password: str):
+        """
+        Обновляем хэш пароля пользователя.
+
+        :param username: Логин пользователя
+        :param hashed_password: Хешированный пароль
+        :return:
+        """
+        await self._write(lambda conn: conn.execute(
+            "UPDATE users SET hashed_password = ? WHERE username = ?;", (hashed_password, username)
+        ))
+        self.notify_user_changed(username)
+
+    async def insert_concentrate_batches(self, month: int, year: int, current_user: Mapping[str, Any],
+                                         batches: AsyncIterable[List[ConcentrateRecord]],
+                                         mode: str = "append") -> WriteResult:
+        """
+        Запись данных за месяц в одной транзакции. Пачки собираются до начала транзакции, чтобы поток записи не
+        ждал чтения запроса.
+
+        :param month: Месяц
+        :param year: Год
+        :param current_user: Пользователь
+        :param batches: Асинхронный итератор пачек записей
+        :param mode: Режим записи, см. WRITE_MODES
+        :return:
+        """
+        records = [record async for batch in batches for record in batch]
+        return await self._write(write_month, current_user["id"], year, month, records, mode)
+
+    async def insert_concentrate_months(self, months: List[MonthData], current_user: Mapping[str, Any],
+                                        mode: str = "append", atomic: bool = False) -> List[MonthWriteOutcome]:
+        """
+        Пакетная запись данных за несколько месяцев в одной транзакции, каждый месяц - в своей точке сохранения.
+
+        :param months: Данные за месяцы, месяцы не должны повторяться
+        :param current_user: Пользователь
+        :param mode: Режим записи, см. WRITE_MODES
+        :param atomic: Записать все месяцы или ни одного
+        :return:
+        """
+        try:
+            return await self._write(write_months, current_user["id"], months, mode, atomic)
+        except BatchRolledBack as e:
+            return e.outcomes
+
+    async def get_concentrate_data(self, month: int, year: int, user_id: int) -> List[Dict[str, Any]]:
+        """
+        Данные пользователя за месяц.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :return:
+        """
+        rows = await self._read(lambda conn: conn.execute(
+            f"SELECT name, {METRIC_COLUMNS} FROM concentrate_quality WHERE {MONTH_CONDITION} ORDER BY id;",
+            (user_id, year, month)
+        ).fetchall())
+        return [
+            {"name": row[0],
+             **{metric: hundredths_to_decimal(value) for metric, value in zip(CONCENTRATE_METRICS, row[1:])}}
+            for row in rows
+        ]
+
+    async def get_concentrate_summary(self, month: int, year: int, user_id: int,
+                                      extended: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Агрегаты за месяц векторно по колонкам показателей месяца.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :param extended: Считать дополнительные показатели
+        :return:
+        """
+        rows = await self._read(lambda conn: conn.execute(
+            f"SELECT {METRIC_COLUMNS} FROM concentrate_quality WHERE {MONTH_CONDITION};", (user_id, year, month)
+        ).fetchall())
+        columns = np.array(rows, dtype=np.int32).reshape(len(rows), len(CONCENTRATE_METRICS)).T
+        return aggregate_columns(columns, extended)
+
+    async def get_data_version(self, month: int, year: int, user_id: int) -> int:
+        """
+        Версия данных пользователя за месяц.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :return:
+        """
+        row = await self._read(lambda conn: conn.execute(
+            f"SELECT version FROM concentrate_data_versions WHERE {MONTH_CONDITION};", (user_id, year, month)
+        ).fetchone())
+        return row[0] if row else 0
+
+    async def get_period_version(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int]) -> int:
+        """
+        Версия данных пользователя за период.
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :return:
+        """
+        row = await self._read(lambda conn: conn.execute(
+            """SELECT MAX(version) FROM concentrate_data_versions
+            WHERE created_by = ? AND (year, month) >= (?, ?) AND (year, month) <= (?, ?);""",
+            (user_id, *period_from, *period_to)
+        ).fetchone())
+        return row[0] or 0
+
+    async def get_concentrate_trends(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int],
+                                     names: Optional[List[str]] = None,
+                                     window: int = 3) -> List[Dict[str, Any]]:
+        """
+        Ряды по концентратам за период одним запросом с оконной функцией по индексу (created_by, name, year, month).
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param names: Наименования концентратов, по умолчанию - все
+        :param window: Окно скользящего среднего в месяцах
+        :return:
+        """
+        conditions = ["created_by = ?", "(year, month) >= (?, ?)", "(year, month) <= (?, ?)"]
+        args: List[Any] = [user_id, *shift_period(period_from, 1 - window), *period_to]
+        if names:
+            conditions.append(f"name IN ({', '.join('?' for _ in names)})")
+            args += names
+        # Сумма в сотых долях точная, поэтому среднее получается одним делением, как AVG по NUMERIC в PostgreSQL
+        rolling = ", ".join(f"SUM({metric}) OVER w * 1.0 / (COUNT(*) OVER w * 100)" for metric in CONCENTRATE_METRICS)
+        query = f"""SELECT * FROM (
+            SELECT name, year, month, {METRIC_COLUMNS}, {rolling} FROM concentrate_quality
+            WHERE {" AND ".join(conditions)}
+            WINDOW w AS (PARTITION BY name ORDER BY year * 12 + month RANGE BETWEEN ? PRECEDING AND CURRENT ROW)
+        ) WHERE (year, month) >= (?, ?) ORDER BY name, year, month;"""
+
+        rows = await self._read(lambda conn: conn.execute(query, (*args, window - 1, *period_from)).fetchall())
+        metrics = len(CONCENTRATE_METRICS)
+        return [
+            {"name": row[0], "year": row[1], "month": row[2],
+             **{metric: hundredths_to_decimal(value) for metric, value in zip(CONCENTRATE_METRICS, row[3:3 + metrics])},
+             **{f"{metric}_rolling": value for metric, value in zip(CONCENTRATE_METRICS, row[3 + metrics:])}}
+            for row in rows
+        ]
+
+    async def iter_concentrate_rows(self, user_id: int, period_from: Optional[Tuple[int, int]] = None,
+                                    period_to: Optional[Tuple[int, int]] = None,
+                                    batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Строки пользователя за период пачками по batch_size. Пачки читаются отдельными запросами с продолжением
+        после последней прочитанной строки, поэтому между пачками соединение не занято.
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц), по умолчанию - вся история
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param batch_size: Размер пачки
+        :return:
+        """
+        conditions = ["created_by = ?", "(year, month, id) > (?, ?, ?)"]
+        position = (*(period_from or (0, 0)), 0)
+        args: List[Any] = []
+        if period_to:
+            conditions.append("(year, month) <= (?, ?)")
+            args += period_to
+        query = f"""SELECT year, month, id, name, {METRIC_COLUMNS} FROM concentrate_quality
+        WHERE {" AND ".join(conditions)} ORDER BY year, month, id LIMIT ?;"""
+
+        while True:
+            rows = await self._read(
+                lambda conn, after: conn.execute(query, (user_id, *after, *args, batch_size)).fetchall(), position
+            )
+            if not rows:
+                return
+            yield [
+                {"year": row[0], "month": row[1], "name": row[3],
+                 **{metric: hundredths_to_decimal(value) for metric, value in zip(CONCENTRATE_METRICS, row[4:])}}
+                for row in rows
+            ]
+            if len(rows) < batch_size:
+                return
+            position = rows[-1][:3]
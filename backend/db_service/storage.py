@@ -0,0 +1,530 @@
+import numpy as np
+
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from config import STORAGE_BACKEND
+from exceptions.app_exceptions import DuplicateConcentrateException, StorageFeatureNotSupportedException
+from model.concentrate_models import MonthData, ConcentrateRecord, CONCENTRATE_METRICS
+from utils.period_utils import shift_period
+from utils.vector_stats import records_to_matrix, rolling_means, percentile_cont_columns
+
+
+# Режимы записи данных за месяц: append - дозапись новых концентратов, replace - замена всех данных за месяц,
+# upsert - добавление новых и обновление измененных строк, sync - как upsert, но строки, которых нет в таблице,
+# удаляются
+WRITE_MODES = ("append", "replace", "upsert", "sync")
+
+# Хранилища, доступные в STORAGE_BACKEND
+STORAGE_BACKENDS = ("postgres", "sqlite", "memory")
+
+
+class WriteResult(NamedTuple):
+    """
+    Итог записи данных за месяц: получено строк, добавлено, изменено, удалено и оставлено без изменений.
+    """
+    rows: int
+    inserted: int
+    updated: int
+    deleted: int
+    unchanged: int
+
+
+class MonthWriteOutcome(NamedTuple):
+    """
+    Итог записи месяца в пакетной записи: result - при успешной записи, error - текст ошибки, если месяц не записан.
+    """
+    month: int
+    year: int
+    result: Optional[WriteResult]
+    error: Optional[str]
+
+
+# Ошибка месяцев, откатанных вместе с пакетом при atomic=True
+BATCH_ROLLED_BACK_MESSAGE = "Месяц не записан: пакет отменен из-за ошибок в других месяцах"
+
+
+async def single_batch(records: List[ConcentrateRecord]) -> AsyncIterator[List[ConcentrateRecord]]:
+    """
+    Записи одной пачкой в виде асинхронного итератора для insert_concentrate_batches.
+
+    :param records: Записи
+    :return:
+    """
+    yield records
+
+
+class MonthWritePlan(NamedTuple):
+    """
+    Изменения данных за месяц для встроенных хранилищ: добавляемые и изменяемые строки (наименование, показатели в
+    сотых долях процента), удаляемые наименования и итог записи.
+    """
+    inserts: List[Tuple[str, Tuple[int, ...]]]
+    updates: List[Tuple[str, Tuple[int, ...]]]
+    deletes: List[str]
+    result: WriteResult
+
+
+def to_hundredths(record: ConcentrateRecord) -> Tuple[int, ...]:
+    """
+    Показатели записи в сотых долях процента. Встроенные хранилища держат значения целыми числами, как NUMERIC(5,2)
+    в PostgreSQL, поэтому суммы и сравнения при записи точные.
+
+    :param record: Запись концентрата
+    :return:
+    """
+    return tuple(round(getattr(record, metric) * 100) for metric in CONCENTRATE_METRICS)
+
+
+def plan_month_write(existing: Mapping[str, Tuple[int, ...]], records: List[ConcentrateRecord],
+                     mode: str) -> MonthWritePlan:
+    """
+    Изменения данных за месяц при записи в режиме mode, с теми же правилами и итогом, что у
+    PostgreSQLService.insert_concentrate_batches.
+
+    :param existing: Текущие данные за месяц: наименование -> показатели в сотых долях
+    :param records: Записываемые записи
+    :param mode: Режим записи, см. WRITE_MODES
+    :return:
+    """
+    rows: Dict[str, Tuple[int, ...]] = {}
+    duplicates = set()
+    for record in records:
+        if record.name in rows:
+            duplicates.add(record.name)
+        rows[record.name] = to_hundredths(record)
+    if mode == "append":
+        duplicates.update(name for name in rows if name in existing)
+    if duplicates:
+        raise DuplicateConcentrateException(sorted(duplicates)[:10])
+
+    if mode in ("append", "replace"):
+        deletes = list(existing) if mode == "replace" else []
+        result = WriteResult(rows=len(records), inserted=len(rows), updated=0, deleted=len(deletes), unchanged=0)
+        return MonthWritePlan(list(rows.items()), [], deletes, result)
+
+    inserts = [(name, values) for name, values in rows.items() if name not in existing]
+    updates = [(name, values) for name, values in rows.items() if name in existing and existing[name] != values]
+    deletes = [name for name in existing if name not in rows] if mode == "sync" else []
+    result = WriteResult(
+        rows=len(records), inserted=len(inserts), updated=len(updates), deleted=len(deletes),
+        unchanged=len(records) - len(inserts) - len(updates)
+    )
+    return MonthWritePlan(inserts, updates, deletes, result)
+
+
+def hundredths_to_decimal(value: int) -> Decimal:
+    """
+    Значение в сотых долях как Decimal, как NUMERIC из PostgreSQL.
+
+    :param value: Значение в сотых долях
+    :return:
+    """
+    return Decimal(int(value)).scaleb(-2)
+
+
+def aggregate_columns(columns: np.ndarray, extended: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Агрегаты за месяц по колонкам показателей в сотых долях (строка массива - показатель в порядке
+    CONCENTRATE_METRICS). Колонки совпадают с PostgreSQLService.get_concentrate_summary и сводкой
+    concentrate_monthly_stats: сумма, минимум, максимум и сумма квадратов - Decimal, дополнительные показатели - float.
+
+    :param columns: Массив (показатели x строки) целых значений
+    :param extended: Считать стандартное отклонение, медиану и 5-й/95-й процентили
+    :return: Агрегаты или None, если строк нет
+    """
+    count = columns.shape[1]
+    if not count:
+        return None
+
+    wide = columns.astype(np.int64)
+    sums, squares = wide.sum(axis=1), (wide * wide).sum(axis=1)
+    minimums, maximums = wide.min(axis=1), wide.max(axis=1)
+    row: Dict[str, Any] = {"count": count}
+    for index, metric in enumerate(CONCENTRATE_METRICS):
+        row[f"{metric}_sum"] = hundredths_to_decimal(sums[index])
+        row[f"{metric}_min"] = hundredths_to_decimal(minimums[index])
+        row[f"{metric}_max"] = hundredths_to_decimal(maximums[index])
+        row[f"{metric}_sumsq"] = Decimal(int(squares[index])).scaleb(-4)
+
+    if extended:
+        values = columns / 100
+        # np.percentile интерполирует по другой формуле и на середине между сотыми может округлиться иначе, чем
+        # percentile_cont в PostgreSQL, поэтому процентили считаются по той же арифметике, что и в БД
+        sorted_values = np.sort(values, axis=1).T
+        percentiles = [percentile_cont_columns(sorted_values, fraction) for fraction in (0.5, 0.05, 0.95)]
+        stddev = values.std(axis=1, ddof=1) if count > 1 else None
+        for index, metric in enumerate(CONCENTRATE_METRICS):
+            row[f"{metric}_stddev"] = float(stddev[index]) if stddev is not None else None
+            row[f"{metric}_median"] = float(percentiles[0][index])
+            row[f"{metric}_p5"] = float(percentiles[1][index])
+            row[f"{metric}_p95"] = float(percentiles[2][index])
+    return row
+
+
+class StorageBackend(ABC):
+    """
+    Хранилище данных приложения. Реализации: PostgreSQLService (по умолчанию), SQLiteService - встроенная БД в
+    одном файле и MemoryStorageService - данные в памяти процесса. Встроенные хранилища не требуют отдельного сервера
+    БД и подходят для установки на одной площадке, CI и бенчмарков.
+
+    Методы, которые есть только у PostgreSQL (отчеты за период и по организации, фоновые задачи), во встроенных
+    хранилищах отвечают 501.
+    """
+    # Имя хранилища в STORAGE_BACKEND
+    name: str = ""
+    # Фоновые задачи (таблица jobs и LISTEN/NOTIFY) доступны только в PostgreSQL
+    supports_jobs: bool = False
+
+    def __init__(self):
+        super().__init__()
+        # Обработчики изменения пользователя (например, инвалидация кэша в Authenticator), принимают логин. Список
+        # у каждого хранилища свой; конструктор синглтона вызывается повторно, поэтому создаем его один раз
+        if "user_change_listeners" not in self.__dict__:
+            self.user_change_listeners: List[Callable[[str], None]] = []
+
+    @abstractmethod
+    async def init_pool(self):
+        """
+        Подготовка соединений с хранилищем. Вызывается один раз при старте приложения.
+
+        :return:
+        """
+
+    @abstractmethod
+    async def close_pool(self):
+        """
+        Закрытие соединений с хранилищем при остановке приложения.
+
+        :return:
+        """
+
+    @abstractmethod
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        Текущее состояние соединений с хранилищем.
+
+        :return:
+        """
+
+    @asynccontextmanager
+    async def startup_lock(self):
+        """
+        Блокировка на время подготовки хранилища при старте. По умолчанию не нужна: подготовка встроенных хранилищ
+        идемпотентна.
+
+        :return:
+        """
+        yield
+
+    @abstractmethod
+    async def create_tables(self):
+        """
+        Приводим схему хранилища к актуальной версии.
+
+        :return:
+        """
+
+    async def schema_is_current(self) -> bool:
+        """
+        Схема уже в актуальной версии, и подготовку при старте можно пропустить без блокировки. По умолчанию
+        False: подготовка встроенных хранилищ дешевая.
+
+        :return:
+        """
+        return False
+
+    async def warm_up(self):
+        """
+        Прогрев соединений после init_pool, чтобы первые запросы не ждали их открытия. По умолчанию не нужен.
+
+        :return:
+        """
+
+    @abstractmethod
+    async def get_user(self, username: str) -> Optional[Mapping[str, Any]]:
+        """
+        Пользователь по логину.
+
+        :param username: Логин пользователя
+        :return: Колонки id, username, hashed_password, is_active или None
+        """
+
+    @abstractmethod
+    async def get_existing_usernames(self, usernames: List[str]) -> List[str]:
+        """
+        Логины из списка, которые уже есть в хранилище.
+
+        :param usernames: Логины
+        :return:
+        """
+
+    @abstractmethod
+    async def insert_user(self, username: str, hashed_password: str) -> Mapping[str, Any]:
+        """
+        Добавляем нового пользователя. Если логин занят - UserAlreadyExistException.
+
+        :param username: Логин пользователя
+        :param hashed_password: Хешированный пароль
+        :return: Колонки id, username, is_active
+        """
+
+    @abstractmethod
+    async def update_user_password(self, username: str, hashed_password: str):
+        """
+        Обновляем хэш пароля пользователя.
+
+        :param username: Логин пользователя
+        :param hashed_password: Хешированный пароль
+        :return:
+        """
+
+    def add_user_change_listener(self, listener: Callable[[str], None]):
+        """
+        Подписываем обработчик на изменения пользователей, повторная подписка того же обработчика игнорируется.
+
+        :param listener: Обработчик, принимает логин
+        :return:
+        """
+        if listener not in self.user_change_listeners:
+            self.user_change_listeners.append(listener)
+
+    def notify_user_changed(self, username: str):
+        """
+        Оповещаем обработчики об изменении пользователя.
+
+        :param username: Логин пользователя
+        :return:
+        """
+        for listener in self.user_change_listeners:
+            listener(username)
+
+    async def set_concentrate_data(self, month_data: MonthData, current_user: Mapping[str, Any],
+                                   mode: str = "append") -> WriteResult:
+        """
+        Запись данных концентратов за месяц.
+
+        :param month_data: Модель данных
+        :param current_user: Пользователь
+        :param mode: Режим записи, см. WRITE_MODES
+        :return: Количество полученных, добавленных, измененных, удаленных и неизмененных строк
+        """
+        return await self.insert_concentrate_batches(
+            month_data.month, month_data.year, current_user, single_batch(month_data.data), mode
+        )
+
+    @abstractmethod
+    async def insert_concentrate_batches(self, month: int, year: int, current_user: Mapping[str, Any],
+                                         batches: AsyncIterable[List[ConcentrateRecord]],
+                                         mode: str = "append") -> WriteResult:
+        """
+        Запись данных за месяц пачками в одной транзакции, см. PostgreSQLService.insert_concentrate_batches.
+
+        :param month: Месяц
+        :param year: Год
+        :param current_user: Пользователь
+        :param batches: Асинхронный итератор пачек записей
+        :param mode: Режим записи, см. WRITE_MODES
+        :return:
+        """
+
+    @abstractmethod
+    async def insert_concentrate_months(self, months: List[MonthData], current_user: Mapping[str, Any],
+                                        mode: str = "append", atomic: bool = False) -> List[MonthWriteOutcome]:
+        """
+        Пакетная запись данных за несколько месяцев, см. PostgreSQLService.insert_concentrate_months.
+
+        :param months: Данные за месяцы, месяцы не должны повторяться
+        :param current_user: Пользователь
+        :param mode: Режим записи, см. WRITE_MODES
+        :param atomic: Записать все месяцы или ни одного
+        :return: Итог по каждому месяцу в порядке (год, месяц)
+        """
+
+    @abstractmethod
+    async def get_concentrate_data(self, month: int, year: int, user_id: int) -> List[Mapping[str, Any]]:
+        """
+        Данные пользователя за месяц.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :return: Строки с колонками name, iron, silicon, aluminum, calcium, sulfur
+        """
+
+    @abstractmethod
+    async def get_concentrate_summary(self, month: int, year: int, user_id: int,
+                                      extended: bool = False) -> Optional[Mapping[str, Any]]:
+        """
+        Агрегаты по всем показателям за месяц, колонки - как в aggregate_columns.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :param extended: Считать дополнительные показатели
+        :return: Строка с агрегатами или None, если данных нет
+        """
+
+    async def get_monthly_stats(self, month: int, year: int, user_id: int) -> Optional[Mapping[str, Any]]:
+        """
+        Сводка за месяц: количество, сумма, минимум и максимум по каждому показателю. Встроенные хранилища
+        отдельную сводку не ведут и считают ее по данным месяца.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :return: Строка сводки или None, если данных нет
+        """
+        return await self.get_concentrate_summary(month, year, user_id)
+
+    @abstractmethod
+    async def get_data_version(self, month: int, year: int, user_id: int) -> int:
+        """
+        Версия данных пользователя за месяц, меняется при каждой записи. 0 - данные не записывались.
+
+        :param month: Месяц
+        :param year: Год
+        :param user_id: Id пользователя
+        :return:
+        """
+
+    @abstractmethod
+    def iter_concentrate_rows(self, user_id: int, period_from: Optional[Tuple[int, int]] = None,
+                              period_to: Optional[Tuple[int, int]] = None,
+                              batch_size: int = 1000) -> AsyncIterator[List[Mapping[str, Any]]]:
+        """
+        Строки пользователя за период пачками по batch_size в порядке (год, месяц, запись).
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц), по умолчанию - вся история
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param batch_size: Размер пачки
+        :return:
+        """
+
+    @abstractmethod
+    async def get_period_version(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int]) -> int:
+        """
+        Версия данных пользователя за период: наибольшая версия месяцев периода. Версии берутся из общей
+        возрастающей последовательности и не удаляются, поэтому она меняется при любой записи в периоде.
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :return:
+        """
+
+    async def get_concentrate_trends(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int],
+                                     names: Optional[List[str]] = None,
+                                     window: int = 3) -> List[Mapping[str, Any]]:
+        """
+        Ряды по концентратам за период: показатели и их скользящее среднее ({показатель}_rolling) за window
+        календарных месяцев, заканчивающихся месяцем строки. Строки в порядке (наименование, год, месяц).
+        По умолчанию строки периода читаются через iter_concentrate_rows, а средние считаются векторно по значениям
+        в сотых долях; месяцы перед началом периода читаются, чтобы среднее в начале периода считалось по полному
+        окну.
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param names: Наименования концентратов, по умолчанию - все
+        :param window: Окно скользящего среднего в месяцах
+        :return:
+        """
+        wanted = set(names) if names else None
+        batches = self.iter_concentrate_rows(user_id, shift_period(period_from, 1 - window), period_to)
+        rows = [row async for batch in batches for row in batch if wanted is None or row["name"] in wanted]
+        if not rows:
+            return []
+        rows.sort(key=lambda row: (row["name"], row["year"], row["month"]))
+
+        codes = {name: code for code, name in enumerate(dict.fromkeys(row["name"] for row in rows))}
+        groups = np.fromiter((codes[row["name"]] for row in rows), dtype=np.int64, count=len(rows))
+        periods = np.fromiter((row["year"] * 12 + row["month"] for row in rows), dtype=np.int64, count=len(rows))
+        hundredths = np.rint(records_to_matrix(rows) * 100).astype(np.int64)
+        means = rolling_means(groups, periods, hundredths, window, scale=100).tolist()
+        return [
+            {**row, **{f"{metric}_rolling": value for metric, value in zip(CONCENTRATE_METRICS, row_means)}}
+            for row, row_means in zip(rows, means) if (row["year"], row["month"]) >= period_from
+        ]
+
+    def iter_period_summary(self, user_id: int, period_from: Tuple[int, int], period_to: Tuple[int, int],
+                            by_name: bool = False) -> AsyncIterator[Mapping[str, Any]]:
+        """
+        Отчет за период одним запросом с GROUPING SETS, есть только в PostgreSQL.
+
+        :param user_id: Id пользователя
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param by_name: Добавить разбивку по концентратам
+        :return:
+        """
+        raise StorageFeatureNotSupportedException("Отчет за период", self.name)
+
+    async def get_organization_summary(self, period_from: Tuple[int, int], period_to: Tuple[int, int],
+                                       usernames: Optional[List[str]] = None,
+                                       by_name: bool = False) -> List[Mapping[str, Any]]:
+        """
+        Отчет по организации из помесячной сводки, есть только в PostgreSQL.
+
+        :param period_from: Начало периода (год, месяц)
+        :param period_to: Окончание периода (год, месяц) включительно
+        :param usernames: Логины пользователей
+        :param by_name: Добавить разбивку по концентратам
+        :return:
+        """
+        raise StorageFeatureNotSupportedException("Отчет по организации", self.name)
+
+    async def submit_job(self, kind: str, user_id: int, params: Dict[str, Any], payload: Optional[bytes] = None):
+        """
+        Очередь фоновых задач хранится в PostgreSQL.
+
+        :param kind: Вид задачи
+        :param user_id: Id пользователя
+        :param params: Параметры задачи
+        :param payload: Входные данные
+        :return:
+        """
+        raise StorageFeatureNotSupportedException("Фоновые задачи", self.name)
+
+    async def get_job(self, job_id: int, user_id: int):
+        """
+        Очередь фоновых задач хранится в PostgreSQL.
+
+        :param job_id: Id задачи
+        :param user_id: Id пользователя
+        :return:
+        """
+        raise StorageFeatureNotSupportedException("Фоновые задачи", self.name)
+
+    async def get_job_result(self, job_id: int, user_id: int):
+        """
+        Очередь фоновых задач хранится в PostgreSQL.
+
+        :param job_id: Id задачи
+        :param user_id: Id пользователя
+        :return:
+        """
+        raise StorageFeatureNotSupportedException("Фоновые задачи", self.name)
+
+
+def get_storage() -> StorageBackend:
+    """
+    Хранилище, выбранное в STORAGE_BACKEND. Модули встроенных хранилищ импортируются только при выборе.
+
+    :return:
+    """
+    if STORAGE_BACKEND == "sqlite":
+        from db_service.sqlite_storage import SQLiteService
+        return SQLiteService()
+    if STORAGE_BACKEND == "memory":
+        from db_service.memory_storage import MemoryStorageService
+        return MemoryStorageService()
+    if STORAGE_BACKEND != "postgres":
+        raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={STORAGE_BACKEND}, допустимо: "
+                         f"{', '.join(STORAGE_BACKENDS)}")
+
+    from db_service.database_api import PostgreSQLService
+    return PostgreSQLService()
@@ -1,4 +1,7 @@
+import math
+
 from fastapi import HTTPException, status
+from typing import Any, Dict, List
 
 
 class NoDataException(HTTPException):
@@ -15,3 +18,136 @@ class UserAlreadyExistException(HTTPException):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Пользователь уже зарегистрирован"
         )
+
+
+class DatabaseUnavailableException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="База данных временно недоступна, повторите запрос позже"
+        )
+
+
+class SheetParseException(HTTPException):
+    def __init__(self, message: str):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Ошибка разбора таблицы. {message}"
+        )
+
+
+class RowValidationException(HTTPException):
+    def __init__(self, report: Dict[str, Any]):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Строки не прошли проверку, данные не сохранены", **report}
+        )
+
+
+class PartialWriteModeException(HTTPException):
+    def __init__(self, mode: str):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Частичная запись (partial=true) недоступна в режиме {mode}: строки с ошибками были бы удалены "
+                   f"из сохраненных данных"
+        )
+
+
+class InvalidPeriodException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Начало периода должно быть не позже его окончания"
+        )
+
+
+class DuplicateConcentrateException(HTTPException):
+    def __init__(self, names: List[str]):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Концентраты уже есть в данных за месяц или повторяются в таблице: {', '.join(names)}. "
+                   f"Для обновления существующих строк используйте mode=upsert или mode=sync"
+        )
+
+
+class InvalidBatchException(HTTPException):
+    def __init__(self, message: str):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Некорректный пакет данных. {message}"
+        )
+
+
+class StorageFeatureNotSupportedException(HTTPException):
+    def __init__(self, feature: str, storage: str):
+        super().__init__(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"Функция «{feature}» недоступна в хранилище {storage}, требуется STORAGE_BACKEND=postgres"
+        )
+
+
+class JobNotFoundException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задача не найдена"
+        )
+
+
+class JobNotFinishedException(HTTPException):
+    def __init__(self, job_status: str):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Результат недоступен, статус задачи: {job_status}"
+        )
+
+
+class RateLimitExceededException(HTTPException):
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много запросов, повторите запрос позже",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+class ServiceOverloadedException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис перегружен, повторите запрос позже",
+            headers={"Retry-After": "1"}
+        )
+
+
+class ServiceNotReadyException(HTTPException):
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис запускается, повторите запрос позже",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+class RequestTooLargeException(HTTPException):
+    def __init__(self, max_size: int):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Размер запроса превышает допустимый ({max_size} байт)"
+        )
+
+
+class MonthChangedException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Данные за месяц изменились во время закрытия, повторите запрос"
+        )
+
+
+class InvalidReportParamsException(HTTPException):
+    def __init__(self, message: str):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Некорректные параметры отчета. {message}"
+        )
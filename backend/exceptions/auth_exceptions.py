@@ -22,3 +22,17 @@ class WrongCredentialsException(HTTPException):
 class CorruptedTokenException(HTTPException):
     def __init__(self):
         super().__init__(status_code=401, detail="Невалидный заголовок аутентификации")
+
+
+class PermissionDeniedException(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав для этого запроса")
+
+
+class PasswordHashingOverloadedException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис аутентификации перегружен, повторите запрос позже",
+            headers={"Retry-After": "1"},
+        )
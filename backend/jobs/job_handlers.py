@@ -0,0 +1,82 @@
+import json
+import time
+
+from asyncpg import Record
+from typing import AsyncIterator, Awaitable, Callable, Dict, Tuple
+
+from config import BULK_INSERT_BATCH_SIZE
+from db_service.database_api import PostgreSQLService
+from exceptions.app_exceptions import NoDataException
+from utils.column_validation import RowErrors
+from utils.import_utils import iter_sheet_batches
+from utils.json_utils import dumps
+from utils.stat_utils import range_summary_item
+
+# Размер части входных данных, которыми таблица подается в разбор
+PAYLOAD_CHUNK_SIZE = 64 * 1024
+
+# Обработчик задачи: (сервис БД, задача) -> (результат, MIME-тип результата)
+JobHandler = Callable[[PostgreSQLService, Record], Awaitable[Tuple[bytes, str]]]
+
+
+async def iter_payload(payload: bytes) -> AsyncIterator[bytes]:
+    """
+    Входные данные задачи частями, как тело запроса в request.stream().
+
+    :param payload: Входные данные
+    :return:
+    """
+    for start in range(0, len(payload), PAYLOAD_CHUNK_SIZE):
+        yield payload[start:start + PAYLOAD_CHUNK_SIZE]
+
+
+async def run_import_job(db_service: PostgreSQLService, job: Record) -> Tuple[bytes, str]:
+    """
+    Импорт таблицы за месяц, как POST /api/concentrate-quality/import. Результат - итог записи в JSON, с partial -
+    вместе с отклоненными строками и их ошибками.
+
+    :param db_service: Сервис БД
+    :param job: Задача
+    :return:
+    """
+    params = json.loads(job["params"])
+    partial = params.get("partial", False)
+    started = time.perf_counter()
+    errors = RowErrors()
+    batches = iter_sheet_batches(
+        iter_payload(job["payload"] or b""), BULK_INSERT_BATCH_SIZE, params.get("delimiter"), errors, partial
+    )
+    result = await db_service.insert_concentrate_batches(
+        params["month"], params["year"], {"id": job["created_by"]}, batches, params["mode"]
+    )
+    elapsed = time.perf_counter() - started
+    return dumps({
+        **result._asdict(), "elapsed": round(elapsed, 3), **(errors.as_dict() if partial else {})
+    }), "application/json"
+
+
+async def run_report_job(db_service: PostgreSQLService, job: Record) -> Tuple[bytes, str]:
+    """
+    Отчет за период, как GET /api/concentrate-quality/range. Результат - NDJSON, по одному RangeSummaryItem в строке.
+
+    :param db_service: Сервис БД
+    :param job: Задача
+    :return:
+    """
+    params = json.loads(job["params"])
+    lines = []
+    async for row in db_service.iter_period_summary(
+            job["created_by"], tuple(params["from"]), tuple(params["to"]), params["by_name"]
+    ):
+        lines.append(range_summary_item(row).model_dump_json(exclude_none=True) + "\n")
+
+    if not lines:
+        raise NoDataException
+    return "".join(lines).encode("utf-8"), "application/x-ndjson"
+
+
+# Вид задачи -> обработчик
+JOB_HANDLERS: Dict[str, JobHandler] = {
+    "import": run_import_job,
+    "report": run_report_job,
+}
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import socket
+import traceback
+import uuid
+
+from asyncpg import Record
+from fastapi import HTTPException
+from loguru import logger
+from typing import Dict, List, Optional
+
+from config import JOB_POLL_INTERVAL, JOB_STALE_AFTER, JOB_MAX_ATTEMPTS, JOB_RETENTION_DAYS
+from db_service.database_api import PostgreSQLService, JOBS_CHANNEL
+from jobs.job_handlers import JOB_HANDLERS
+from utils.json_utils import dumps
+
+
+class JobWorker:
+    """
+    Воркер фоновых задач из таблицы jobs. Выполняет до concurrency задач одновременно: каждый слот забирает задачу
+    через FOR UPDATE SKIP LOCKED, поэтому воркеры в процессах приложения и отдельные воркеры (manage.py worker)
+    работают с одной очередью без брокера. О новых задачах воркер узнает через LISTEN/NOTIFY, а если уведомление
+    потеряно или подписка недоступна - при опросе очереди раз в JOB_POLL_INTERVAL секунд.
+
+    Пока задача выполняется, воркер обновляет heartbeat. Задачи воркера, который перестал это делать (остановлен
+    или упал), возвращаются в очередь любым из работающих воркеров.
+    """
+
+    def __init__(self, db_service: PostgreSQLService, concurrency: int = 1):
+        """
+        :param db_service: Сервис БД
+        :param concurrency: Количество одновременно выполняемых задач
+        """
+        self.db_service = db_service
+        self.concurrency = max(concurrency, 1)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = 0
+        self._done = 0
+        self._failed = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики воркера: выполняемые, выполненные и завершенные с ошибкой задачи.
+
+        :return:
+        """
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "done": self._done,
+            "failed": self._failed,
+        }
+
+    def wakeup(self, payload: str = ""):
+        """
+        Будим свободные слоты: в очереди появилась задача.
+
+        :param payload: Содержимое уведомления (id задачи)
+        :return:
+        """
+        self._wakeup.set()
+
+    def start(self) -> asyncio.Task:
+        """
+        Запускаем воркер в фоне текущего цикла событий (в процессе приложения).
+
+        :return:
+        """
+        self._stopping.clear()
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def request_stop(self):
+        """
+        Просим run() завершиться, например, из обработчика сигнала.
+
+        :return:
+        """
+        self._stopping.set()
+        self._wakeup.set()
+
+    async def stop(self):
+        """
+        Останавливаем воркер. Выполняемые задачи прерываются и после JOB_STALE_AFTER секунд возвращаются в очередь.
+
+        :return:
+        """
+        self.request_stop()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """
+        Основной цикл воркера: подписка на уведомления, слоты выполнения задач и обслуживание очереди.
+        Завершается после stop().
+
+        :return:
+        """
+        logger.info(f"Воркер фоновых задач {self.worker_id} запущен, одновременно задач: {self.concurrency}")
+        tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._maintain())]
+        tasks += [asyncio.create_task(self._slot()) for _ in range(self.concurrency)]
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"Воркер фоновых задач {self.worker_id} остановлен")
+
+    async def _listen(self):
+        """
+        Подписка на канал новых задач. При обрыве соединения подписка восстанавливается, задачи тем временем
+        забираются опросом очереди.
+
+        :return:
+        """
+        while not self._stopping.is_set():
+            try:
+                async with self.db_service.listen(JOBS_CHANNEL, self.wakeup) as conn:
+                    while not conn.is_closed():
+                        await asyncio.sleep(JOB_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Подписка на новые задачи недоступна, используется опрос очереди: {e}")
+            await asyncio.sleep(JOB_STALE_AFTER)
+
+    async def _slot(self):
+        """
+        Слот выполнения: забираем задачу из очереди и выполняем, если очередь пуста - ждем уведомления или
+        следующего опроса.
+
+        :return:
+        """
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                job = await self.db_service.claim_job(self.worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error(f"Ошибка получения задачи из очереди: {traceback.format_exc()}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.execute(job)
+
+    async def execute(self, job: Record):
+        """
+        Выполняем задачу обработчиком ее вида и сохраняем результат или ошибку.
+
+        :param job: Задача
+        :return:
+        """
+        handler = JOB_HANDLERS.get(job["kind"])
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        self._running += 1
+        logger.info(f"Задача {job['id']} ({job['kind']}) выполняется, попытка {job['attempts']}")
+        try:
+            if handler is None:
+                raise ValueError(f"Неизвестный вид задачи {job['kind']}")
+            result, result_type = await handler(self.db_service, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed += 1
+            if isinstance(e, HTTPException):
+                # Подробности ошибки (например, ошибки строк импорта) сохраняются как JSON
+                error = e.detail if isinstance(e.detail, str) else dumps(e.detail).decode()
+                logger.warning(f"Задача {job['id']} завершилась с ошибкой: {error}")
+            else:
+                error = str(e) or type(e).__name__
+                logger.error(f"Задача {job['id']} завершилась с ошибкой: {traceback.format_exc()}")
+            await self.db_service.fail_job(job["id"], self.worker_id, error)
+        else:
+            if await self.db_service.finish_job(job["id"], self.worker_id, result, result_type):
+                self._done += 1
+                logger.info(f"Задача {job['id']} выполнена, результат {len(result)} байт")
+            else:
+                logger.warning(f"Задача {job['id']} была передана другому воркеру, результат не сохранен")
+        finally:
+            self._running -= 1
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: int):
+        """
+        Отмечаем выполнение задачи, пока она не завершится.
+
+        :param job_id: Id задачи
+        :return:
+        """
+        while True:
+            await asyncio.sleep(JOB_STALE_AFTER / 3)
+            try:
+                await self.db_service.heartbeat_job(job_id, self.worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Не удалось обновить heartbeat задачи {job_id}: {e}")
+
+    async def _maintain(self):
+        """
+        Обслуживание очереди: возврат зависших задач и удаление старых.
+
+        :return:
+        """
+        while True:
+            try:
+                requeued: List[Record] = await self.db_service.requeue_stale_jobs(JOB_STALE_AFTER, JOB_MAX_ATTEMPTS)
+                for job in requeued:
+                    logger.warning(f"Задача {job['id']} зависла, новый статус: {job['status']}")
+                if any(job["status"] == "queued" for job in requeued):
+                    self._wakeup.set()
+
+                deleted = await self.db_service.delete_old_jobs(JOB_RETENTION_DAYS)
+                if deleted:
+                    logger.info(f"Удалено старых задач: {deleted}")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error(f"Ошибка обслуживания очереди задач: {traceback.format_exc()}")
+            await asyncio.sleep(JOB_STALE_AFTER)
@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import random
+import signal
+
+from decimal import Decimal
+
+from loguru import logger
+from db_service.database_api import PostgreSQLService
+from db_service.migrations import MIGRATIONS, get_applied_versions
+from db_service.rollup import rebuild_monthly_stats
+from jobs.job_worker import JobWorker
+from model.concentrate_models import CONCENTRATE_METRICS
+from utils.stat_utils import summarize_records
+from utils.vector_stats import records_to_matrix, calculate_stats_matrix
+
+
+async def migrate(args):
+    """
+    Применяем непримененные миграции схемы. Блокировка та же, что при старте приложения, поэтому миграции не
+    выполняются одновременно с запускающимися воркерами.
+
+    :param args: Аргументы командной строки
+    :return:
+    """
+    db_service = PostgreSQLService()
+    async with db_service.startup_lock():
+        await db_service.create_tables()
+
+
+async def show_migrations(args):
+    """
+    Выводим список миграций и их статус.
+
+    :param args: Аргументы командной строки
+    :return:
+    """
+    async with PostgreSQLService().connect() as con:
+        applied = set(await get_applied_versions(con))
+
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            status = "применена"
+        elif migration.enabled():
+            status = "ожидает"
+        else:
+            status = "отключена"
+        print(f"{migration.version:>4}  {status:<10}  {migration.description}")
+
+
+async def backfill_rollup(args):
+    """
+    Перестраиваем помесячную сводку concentrate_monthly_stats по истории данных.
+
+    :param args: Аргументы командной строки
+    :return:
+    """
+    async with PostgreSQLService().connect() as con:
+        rows = await rebuild_monthly_stats(con, args.user_id, args.year)
+    logger.info(f"Помесячная сводка перестроена: {rows} строк")
+
+
+async def stats_parity(args):
+    """
+    Сверка векторного расчета отчета (utils/vector_stats.py) с эталонным (utils/stat_utils.py) на случайных данных
+    в формате БД (Decimal с двумя знаками после запятой).
+
+    :param args: Аргументы командной строки
+    :return:
+    """
+    rng = random.Random(args.seed)
+    mismatches = 0
+    for sample in range(args.samples):
+        records = [
+            {metric: Decimal(rng.randint(0, 10000)) / 100 for metric in CONCENTRATE_METRICS}
+            for _ in range(rng.randint(1, args.max_rows))
+        ]
+        reference = {metric: {key: float(value) for key, value in stats.items()}
+                     for metric, stats in summarize_records(records, extended=True).items()}
+        vectorized = calculate_stats_matrix(records_to_matrix(records), extended=True)
+        if reference != vectorized:
+            mismatches += 1
+            logger.warning(f"Расхождение в выборке {sample} ({len(records)} строк): {reference} != {vectorized}")
+
+    if mismatches:
+        raise RuntimeError(f"Расхождений: {mismatches} из {args.samples}")
+    logger.info(f"Расчеты совпадают на {args.samples} выборках")
+
+
+async def run_worker(args):
+    """
+    Отдельный воркер фоновых задач. Работает с той же очередью, что и воркеры в процессах приложения, и
+    останавливается по SIGINT/SIGTERM.
+
+    :param args: Аргументы командной строки
+    :return:
+    """
+    db_service = PostgreSQLService()
+    await db_service.init_pool()
+    worker = JobWorker(db_service, args.concurrency)
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, worker.request_stop)
+    try:
+        await worker.run()
+    finally:
+        await db_service.close_pool()
+
+
+# Команда: (обработчик, описание, аргументы для argparse)
+COMMANDS = {
+    "migrate": (migrate, "Применить миграции схемы БД", []),
+    "migrations": (show_migrations, "Показать статус миграций", []),
+    "backfill-rollup": (backfill_rollup, "Перестроить помесячную сводку по истории", [
+        (("--user-id",), {"type": int, "help": "Только для пользователя с указанным id"}),
+        (("--year",), {"type": int, "help": "Только за указанный год"}),
+    ]),
+    "stats-parity": (stats_parity, "Сверить векторный расчет отчета с эталонным", [
+        (("--samples",), {"type": int, "default": 1000, "help": "Количество случайных выборок"}),
+        (("--max-rows",), {"type": int, "default": 500, "help": "Максимальный размер выборки"}),
+        (("--seed",), {"type": int, "default": 0, "help": "Начальное значение генератора"}),
+    ]),
+    "worker": (run_worker, "Запустить воркер фоновых задач", [
+        (("--concurrency",), {"type": int, "default": 2, "help": "Количество одновременно выполняемых задач"}),
+    ]),
+}
+
+
+def main():
+    """
+    Служебные команды бэкенда: python manage.py <команда>.
+
+    :return:
+    """
+    parser = argparse.ArgumentParser(description="Служебные команды API данных железного концентрата")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text, arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        for flags, options in arguments:
+            subparser.add_argument(*flags, **options)
+
+    args = parser.parse_args()
+    handler = COMMANDS[args.command][0]
+    try:
+        asyncio.run(handler(args))
+    except Exception:
+        logger.exception(f"Команда {args.command} завершилась с ошибкой")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
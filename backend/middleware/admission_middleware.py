@@ -0,0 +1,204 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Any, Callable, Dict, Optional
+
+from config import RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST, RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST, \
+    RATE_LIMIT_TOKEN_RATE, RATE_LIMIT_TOKEN_BURST, RATE_LIMIT_MAX_KEYS, ADMISSION_TOKEN_CONCURRENCY, \
+    ADMISSION_TOKEN_QUEUE, ADMISSION_WRITE_CONCURRENCY, ADMISSION_WRITE_QUEUE, ADMISSION_REPORT_CONCURRENCY, \
+    ADMISSION_REPORT_QUEUE, ADMISSION_QUEUE_TIMEOUT, MAX_REQUEST_BODY_SIZE, MAX_IMPORT_BODY_SIZE
+from exceptions.app_exceptions import RateLimitExceededException, ServiceOverloadedException, \
+    RequestTooLargeException
+from utils.metrics import ADMISSION_REJECTED
+from utils.rate_limit import RateLimiter, ConcurrencyLimiter, ConcurrencyLimitExceeded
+
+
+# Группы маршрутов с ограничением одновременных запросов: (метод, путь) -> группа
+ROUTE_GROUPS = {
+    ("POST", "/token"): "token",
+    ("POST", "/api/concentrate-quality"): "write",
+    ("POST", "/api/concentrate-quality/import"): "write",
+    ("POST", "/api/concentrate-quality/batch"): "write",
+    ("POST", "/api/concentrate-quality/batch/import"): "write",
+    ("POST", "/api/jobs/import"): "write",
+    ("GET", "/api/concentrate-quality/range"): "report",
+    ("GET", "/api/concentrate-quality/trends"): "report",
+    ("GET", "/api/concentrate-quality/export"): "report",
+    ("POST", "/api/concentrate-quality/close"): "report",
+    ("GET", "/api/organization/summary"): "report",
+}
+
+# Маршруты импорта таблиц и пакетной записи, для них действует MAX_IMPORT_BODY_SIZE
+IMPORT_PATHS = {
+    "/api/concentrate-quality/import", "/api/concentrate-quality/batch", "/api/concentrate-quality/batch/import",
+    "/api/jobs/import",
+}
+
+# Маршруты без ограничений: метрики и служебная информация не должны отказывать при перегрузке
+EXEMPT_PATH_PREFIXES = ("/metrics", "/api/service/")
+
+
+class AdmissionController:
+    """
+    Состояние контроля нагрузки процесса: ограничители частоты запросов и одновременных запросов по группам
+    маршрутов. Создается в приложении и передается в AdmissionMiddleware, чтобы счетчики были доступны в /metrics.
+    """
+
+    def __init__(self, peek_username: Callable[[Optional[str]], Optional[str]]):
+        """
+        :param peek_username: Логин из заголовка Authorization или None (Authenticator.peek_username)
+        """
+        self.peek_username = peek_username
+        self.user_limiter = RateLimiter(RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST, RATE_LIMIT_MAX_KEYS)
+        self.ip_limiter = RateLimiter(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST, RATE_LIMIT_MAX_KEYS)
+        self.token_limiter = RateLimiter(RATE_LIMIT_TOKEN_RATE, RATE_LIMIT_TOKEN_BURST, RATE_LIMIT_MAX_KEYS)
+        self.groups = {
+            "token": ConcurrencyLimiter(ADMISSION_TOKEN_CONCURRENCY, ADMISSION_TOKEN_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+            "write": ConcurrencyLimiter(ADMISSION_WRITE_CONCURRENCY, ADMISSION_WRITE_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+            "report": ConcurrencyLimiter(ADMISSION_REPORT_CONCURRENCY, ADMISSION_REPORT_QUEUE,
+                                         ADMISSION_QUEUE_TIMEOUT),
+        }
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Состояние ограничителей частоты и групп маршрутов.
+
+        :return:
+        """
+        return {
+            "rate_user": self.user_limiter.stats(),
+            "rate_ip": self.ip_limiter.stats(),
+            "rate_token": self.token_limiter.stats(),
+            **{f"concurrency_{name}": limiter.stats() for name, limiter in self.groups.items()},
+        }
+
+    def check_rate(self, scope: Scope, headers: Headers, path: str):
+        """
+        Проверяем частоту запросов клиента.
+
+        :param scope: ASGI scope
+        :param headers: Заголовки запроса
+        :param path: Путь запроса
+        :return: None или (исключение, причина отказа)
+        """
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+
+        if path == "/token":
+            retry_after = self.token_limiter.acquire(ip)
+            if retry_after:
+                return RateLimitExceededException(retry_after), "rate_token"
+
+        retry_after = self.ip_limiter.acquire(ip)
+        if retry_after:
+            return RateLimitExceededException(retry_after), "rate_ip"
+
+        if self.user_limiter.enabled:
+            username = self.peek_username(headers.get("authorization"))
+            if username is not None:
+                retry_after = self.user_limiter.acquire(username)
+                if retry_after:
+                    return RateLimitExceededException(retry_after), "rate_user"
+        return None
+
+
+class AdmissionMiddleware:
+    """
+    ASGI-middleware контроля нагрузки. Проверки выполняются до маршрутизации и обработки запроса, отказ стоит
+    несколько микросекунд и не занимает соединение с БД или пул bcrypt:
+
+    - размер тела: по Content-Length сразу, для запросов без него - по мере чтения тела (413);
+    - частота запросов: корзины токенов по пользователю из JWT и по IP, для /token - отдельная корзина по IP (429);
+    - одновременные запросы по группам маршрутов (вход, запись, отчеты) с ограниченной очередью: при заполненной
+      очереди или долгом ожидании запрос отклоняется (503), а не ждет неограниченно.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        """
+        :param app: ASGI-приложение
+        :param controller: Ограничители процесса
+        """
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"].startswith(EXEMPT_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        path, method = scope["path"], scope["method"]
+        headers = Headers(scope=scope)
+        group = ROUTE_GROUPS.get((method, path))
+
+        max_size = MAX_IMPORT_BODY_SIZE if path in IMPORT_PATHS else MAX_REQUEST_BODY_SIZE
+        content_length = headers.get("content-length")
+        if max_size and content_length and content_length.isdigit() and int(content_length) > max_size:
+            await self.reject(scope, receive, send, RequestTooLargeException(max_size), "body_too_large", group)
+            return
+
+        rejection = self.controller.check_rate(scope, headers, path)
+        if rejection is not None:
+            await self.reject(scope, receive, send, *rejection, group)
+            return
+
+        limiter = self.controller.groups.get(group)
+        if limiter is not None:
+            try:
+                await limiter.acquire()
+            except ConcurrencyLimitExceeded as e:
+                await self.reject(scope, receive, send, ServiceOverloadedException(), e.reason, group)
+                return
+
+        try:
+            await self.app(scope, self.limit_body(receive, max_size, group), send)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    @staticmethod
+    def limit_body(receive: Receive, max_size: int, group: Optional[str]) -> Receive:
+        """
+        Обертка receive, прерывающая чтение тела больше max_size байт (для запросов без Content-Length).
+        Исключение HTTPException проходит через разбор тела FastAPI и обработчики без изменений и превращается в
+        ответ 413.
+
+        :param receive: Исходный receive
+        :param max_size: Максимальный размер тела, байт (0 - без ограничения)
+        :param group: Группа маршрута
+        :return:
+        """
+        if not max_size:
+            return receive
+
+        received = 0
+
+        async def wrapper() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_size:
+                    ADMISSION_REJECTED.inc(reason="body_too_large", group=group or "other")
+                    raise RequestTooLargeException(max_size)
+            return message
+
+        return wrapper
+
+    @staticmethod
+    async def reject(scope: Scope, receive: Receive, send: Send, exception: HTTPException, reason: str,
+                     group: Optional[str]):
+        """
+        Отказ в обработке запроса в формате ответов HTTPException.
+
+        :param scope: ASGI scope
+        :param receive: ASGI receive
+        :param send: ASGI send
+        :param exception: Исключение с кодом ответа и текстом
+        :param reason: Причина для метрики
+        :param group: Группа маршрута
+        :return:
+        """
+        ADMISSION_REJECTED.inc(reason=reason, group=group or "other")
+        response = JSONResponse({"detail": exception.detail}, exception.status_code, exception.headers)
+        await response(scope, receive, send)
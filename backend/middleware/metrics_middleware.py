@@ -0,0 +1,46 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_FLIGHT, HTTP_RESPONSE_BYTES
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware метрик HTTP: длительность обработки по маршруту и коду ответа, число обрабатываемых запросов и
+    размер тела ответа. Реализовано на уровне ASGI, а не через BaseHTTPMiddleware, чтобы не буферизовать потоковые
+    ответы. Маршрут берется из шаблона пути (/api/concentrate-quality), а не из фактического URL, чтобы число
+    меток не зависело от параметров запроса.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status)
+            HTTP_RESPONSE_BYTES.observe(size, method=scope["method"], route=route)
@@ -0,0 +1,35 @@
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import STARTUP_RETRY_INTERVAL
+from exceptions.app_exceptions import ServiceNotReadyException
+from utils.startup import StartupTracker
+
+
+# Маршруты, доступные до готовности: проверка готовности, метрики, служебная информация и документация
+EXEMPT_PATH_PREFIXES = ("/ready", "/metrics", "/api/service/", "/docs", "/openapi.json")
+
+
+class ReadinessMiddleware:
+    """
+    ASGI-middleware, отклоняющее запросы (503 с Retry-After), пока приложение не готово: при STARTUP_MODE=background
+    сервер принимает соединения до подготовки БД, и запросы не должны доходить до хранилища без пула и схемы.
+    После готовности стоит одну проверку флага на запрос.
+    """
+
+    def __init__(self, app: ASGIApp, startup: StartupTracker):
+        """
+        :param app: ASGI-приложение
+        :param startup: Состояние старта приложения
+        """
+        self.app = app
+        self.startup = startup
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if self.startup.ready or scope["type"] != "http" or scope["path"].startswith(EXEMPT_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        exception = ServiceNotReadyException(STARTUP_RETRY_INTERVAL)
+        response = JSONResponse({"detail": exception.detail}, exception.status_code, exception.headers)
+        await response(scope, receive, send)
@@ -1,8 +1,13 @@
-from typing import Optional, Dict, List
+from datetime import datetime
+from typing import Any, Optional, Dict, List, NamedTuple
 
 from pydantic import BaseModel, field_validator, confloat, constr
 
 
+# Качественные показатели концентрата (колонки таблицы concentrate_quality)
+CONCENTRATE_METRICS = ("iron", "silicon", "aluminum", "calcium", "sulfur")
+
+
 class UserBase(BaseModel):
     username: str
 
@@ -40,12 +45,36 @@ class ConcentrateRecord(BaseModel):
         return round(value, 2)
 
 
+class ConcentrateRow(NamedTuple):
+    """
+    Строка концентрата, проверенная по колонкам (см. utils/column_validation.py): те же поля и значения, что у
+    ConcentrateRecord, но без модели pydantic на каждую строку. Запись в хранилище читает только атрибуты, поэтому
+    принимает и то, и другое.
+    """
+    name: str
+    iron: float
+    silicon: float
+    aluminum: float
+    calcium: float
+    sulfur: float
+
+
 class MonthData(BaseModel):
     month: int
     year: int
     data: List[ConcentrateRecord]
 
 
+class MonthRows(BaseModel):
+    """
+    Данные за месяц с непроверенными строками: строки проверяются по колонкам после разбора тела, чтобы собрать
+    ошибки всех строк за один проход.
+    """
+    month: int
+    year: int
+    data: List[Dict[str, Any]]
+
+
 class SummaryResponse(BaseModel):
     month: int
     year: int
@@ -54,4 +83,87 @@ class SummaryResponse(BaseModel):
     silicon: Dict[str, float]
     aluminum: Dict[str, float]
     calcium: Dict[str, float]
-    sulfur: Dict[str, float]
\ No newline at end of file
+    sulfur: Dict[str, float]
+
+
+class RangeSummaryItem(SummaryResponse):
+    """
+    Элемент отчета за период: kind=month - месяц целиком, kind=name - концентрат за месяц,
+    kind=overall - весь период (month и year не заполняются).
+    """
+    kind: str
+    month: Optional[int] = None
+    year: Optional[int] = None
+    name: Optional[str] = None
+
+
+class OrganizationSummaryItem(RangeSummaryItem):
+    """
+    Элемент отчета по организации: как RangeSummaryItem, но по данным всех (или выбранных) пользователей.
+    users - количество пользователей, у которых есть данные. Показатели дополнены стандартным отклонением.
+    """
+    users: int
+
+
+class TrendPoint(BaseModel):
+    """
+    Показатели концентрата за месяц: rolling_mean - скользящее среднее за окно месяцев, заканчивающееся этим,
+    out_of_spec - показатели за пределами норм.
+    """
+    year: int
+    month: int
+    values: Dict[str, float]
+    rolling_mean: Dict[str, float]
+    out_of_spec: List[str]
+
+
+class TrendSeries(BaseModel):
+    """
+    Ряд показателей концентрата по месяцам периода, out_of_spec_months - месяцев с нарушением норм.
+    """
+    name: str
+    points: List[TrendPoint]
+    out_of_spec_months: int
+
+
+class TrendsResponse(BaseModel):
+    """
+    Тренды по концентратам за период: window - окно скользящего среднего в месяцах, spec - нормы показателей
+    (min/max), по которым выставлены флаги.
+    """
+    period_from: str
+    period_to: str
+    window: int
+    metrics: List[str]
+    spec: Dict[str, Dict[str, float]]
+    series: List[TrendSeries]
+
+
+class ClosedMonth(BaseModel):
+    """
+    Закрытый месяц: данные и отчеты отдаются из снимка, построенного по версии данных version. Запись данных за
+    месяц после закрытия снова его открывает.
+    """
+    month: int
+    year: int
+    version: int
+    count: int
+    closed_at: datetime
+
+
+class JobStatus(BaseModel):
+    """
+    Состояние фоновой задачи: status - queued, running, done или failed. result_size - размер результата в байтах
+    для завершенной задачи.
+    """
+    id: int
+    kind: str
+    status: str
+    params: Dict[str, Any]
+    attempts: int
+    error: Optional[str] = None
+    result_type: Optional[str] = None
+    result_size: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,103 @@
+import random
+import numpy as np
+import pytest
+
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from db_service.storage import aggregate_columns
+from model.concentrate_models import CONCENTRATE_METRICS
+from utils.stat_utils import summarize_records, summarize_aggregates
+from utils.vector_stats import records_to_matrix, calculate_stats_matrix
+
+
+def make_records(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    """
+    Строки концентратов в формате БД: показатели - Decimal с двумя знаками после запятой.
+
+    :param rng: Генератор случайных чисел
+    :param count: Количество строк
+    :return:
+    """
+    return [
+        {"name": f"K{index}", **{metric: Decimal(rng.randint(0, 10000)) / 100 for metric in CONCENTRATE_METRICS}}
+        for index in range(count)
+    ]
+
+
+def to_columns(records: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Колонки показателей в сотых долях, как в хранилище в памяти.
+
+    :param records: Строки концентратов
+    :return:
+    """
+    return np.array(
+        [[int(record[metric] * 100) for record in records] for metric in CONCENTRATE_METRICS], dtype=np.int32
+    ).reshape(len(CONCENTRATE_METRICS), len(records))
+
+
+def reference_summary(records: List[Dict[str, Any]], extended: bool) -> Dict[str, Dict[str, float]]:
+    """
+    Эталонный отчет (SUMMARY_ENGINE=python) с float-значениями, как в ответе API.
+
+    :param records: Строки концентратов
+    :param extended: Добавить дополнительные показатели
+    :return:
+    """
+    return {metric: {key: float(value) for key, value in stats.items()}
+            for metric, stats in summarize_records(records, extended).items()}
+
+
+def aggregates_summary(records: List[Dict[str, Any]], extended: bool) -> Dict[str, Dict[str, float]]:
+    """
+    Отчет из агрегатов по колонкам (встроенные хранилища, SUMMARY_ENGINE=sql и rollup).
+
+    :param records: Строки концентратов
+    :param extended: Добавить дополнительные показатели
+    :return:
+    """
+    return {metric: {key: float(value) for key, value in stats.items()}
+            for metric, stats in summarize_aggregates(aggregate_columns(to_columns(records), extended), extended).items()}
+
+
+@pytest.mark.parametrize("extended", [False, True])
+@pytest.mark.parametrize("count", [1, 2, 3, 20, 101, 1000])
+def test_vector_stats_match_reference(count: int, extended: bool):
+    rng = random.Random(count)
+    for _ in range(20):
+        records = make_records(rng, count)
+        reference = reference_summary(records, extended)
+        assert calculate_stats_matrix(records_to_matrix(records), extended) == reference
+        assert aggregates_summary(records, extended) == reference
+
+
+@pytest.mark.parametrize("extended", [False, True])
+def test_single_row(extended: bool):
+    records = make_records(random.Random(1), 1)
+    summary = calculate_stats_matrix(records_to_matrix(records), extended)
+    assert summary == reference_summary(records, extended)
+    assert summary == aggregates_summary(records, extended)
+    for metric in CONCENTRATE_METRICS:
+        value = float(records[0][metric])
+        assert summary[metric]["avg"] == summary[metric]["min"] == summary[metric]["max"] == value
+        # Выборочное стандартное отклонение одной строки не определено и в отчет не попадает
+        assert "stddev" not in summary[metric]
+
+
+def test_empty_month():
+    assert records_to_matrix([]).shape == (0, len(CONCENTRATE_METRICS))
+    assert aggregate_columns(np.empty((len(CONCENTRATE_METRICS), 0), dtype=np.int32)) is None
+    assert aggregate_columns(np.empty((len(CONCENTRATE_METRICS), 0), dtype=np.int32), extended=True) is None
+
+
+@pytest.mark.parametrize("extended", [False, True])
+def test_rounding_ties(extended: bool):
+    # Среднее и процентили ровно посередине между сотыми: округление должно совпадать с эталонным
+    records = [
+        {"name": name, **{metric: Decimal(value) for metric in CONCENTRATE_METRICS}}
+        for name, value in (("A", "0.01"), ("B", "0.02"), ("C", "2.67"), ("D", "2.68"))
+    ]
+    reference = reference_summary(records, extended)
+    assert calculate_stats_matrix(records_to_matrix(records), extended) == reference
+    assert aggregates_summary(records, extended) == reference
@@ -0,0 +1,197 @@
+import re
+
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+
+from exceptions.app_exceptions import SheetParseException
+from model.concentrate_models import MonthData, MonthRows, ConcentrateRow
+from utils.column_validation import RowErrors, validate_records
+from utils.import_utils import iter_sheet_lines, is_header, validate_sheet_rows
+
+
+# Ошибок одного месяца в ответе пакетной записи, остальные только подсчитываются
+MAX_ERRORS_PER_MONTH = 20
+
+# Месяц в первой колонке таблицы пакетной записи: ГГГГ-ММ или ММ.ГГГГ (как Excel показывает даты с русской локалью)
+SHEET_PERIOD_PATTERNS = (
+    (re.compile(r"^(\d{4})-(\d{1,2})$"), 1, 2),
+    (re.compile(r"^(\d{1,2})\.(\d{4})$"), 2, 1),
+)
+
+
+def check_period(month: int, year: int) -> Optional[Tuple[str, str]]:
+    """
+    Проверка месяца и года, как в параметрах POST /api/concentrate-quality/import.
+
+    :param month: Месяц
+    :param year: Год
+    :return: (поле, текст ошибки) или None
+    """
+    if not 1 <= month <= 12:
+        return "month", f"Некорректный месяц {month}"
+    if year <= 2000:
+        return "year", f"Некорректный год {year}"
+    return None
+
+
+def parse_sheet_period(value: str) -> Tuple[int, int]:
+    """
+    Разбор месяца из ячейки таблицы пакетной записи.
+
+    :param value: Значение ячейки
+    :return: (год, месяц)
+    """
+    value = value.strip()
+    for pattern, year_group, month_group in SHEET_PERIOD_PATTERNS:
+        match = pattern.match(value)
+        if match:
+            year, month = int(match.group(year_group)), int(match.group(month_group))
+            if check_period(month, year) is None:
+                return year, month
+    raise ValueError(f"некорректный месяц '{value}', ожидается ГГГГ-ММ или ММ.ГГГГ")
+
+
+def month_errors(month: Optional[int], year: Optional[int], errors: RowErrors,
+                 item: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Итог месяца, не прошедшего проверку, для ответа пакетной записи. Ошибки - в формате ответа
+    POST /api/concentrate-quality: строка, колонка, значение и текст, у ошибок всего месяца строки нет.
+
+    :param month: Месяц (None, если не удалось определить)
+    :param year: Год (None, если не удалось определить)
+    :param errors: Ошибки месяца
+    :param item: Индекс элемента тела запроса для JSON
+    :return:
+    """
+    result = {"month": month, "year": year, "status": "error"}
+    if item is not None:
+        result["item"] = item
+    return {**result, **errors.as_dict()}
+
+
+def month_error(month: Optional[int], year: Optional[int], message: str, column: Optional[str] = None,
+                value: Any = None) -> Dict[str, Any]:
+    """
+    Итог месяца с одной ошибкой всего месяца, например, ошибкой записи в БД.
+
+    :param month: Месяц
+    :param year: Год
+    :param message: Текст ошибки
+    :param column: Поле, к которому относится ошибка
+    :param value: Значение поля
+    :return:
+    """
+    errors = RowErrors(MAX_ERRORS_PER_MONTH)
+    errors.add(None, column, value, message)
+    return month_errors(month, year, errors)
+
+
+def add_validation_errors(errors: RowErrors, error: ValidationError):
+    """
+    Ошибки pydantic в структуре элемента пакета (месяц, год, список строк) в ошибки месяца: ошибка элемента data -
+    ошибка строки, остальные - ошибки всего месяца с полем.
+
+    :param errors: Ошибки месяца
+    :param error: Ошибка валидации
+    :return:
+    """
+    for item in error.errors():
+        location = item["loc"]
+        value = item["input"] if not isinstance(item["input"], (dict, list)) else None
+        if len(location) > 1 and location[0] == "data":
+            errors.add(location[1], None, value, item["msg"])
+        else:
+            errors.add(None, ".".join(map(str, location)) or None, value, item["msg"])
+
+
+def validate_months(items: List[Any]) -> Tuple[List[MonthData], List[Dict[str, Any]]]:
+    """
+    Проверяем данные пакетной записи за один проход: каждый месяц проверяется отдельно, поэтому ошибка в одном
+    месяце не мешает проверить и записать остальные. Месяц и год проверяются моделью MonthRows, строки - по колонкам,
+    как в POST /api/concentrate-quality. Повторяющиеся в пакете месяцы отклоняются все, так как неясно, какой из
+    них записывать.
+
+    :param items: Элементы тела запроса (словари в формате MonthData)
+    :return: (прошедшие проверку месяцы, итоги отклоненных месяцев)
+    """
+    valid, rejected = [], []
+    for index, item in enumerate(items):
+        errors = RowErrors(MAX_ERRORS_PER_MONTH)
+        try:
+            month_rows = MonthRows.model_validate(item)
+        except ValidationError as e:
+            add_validation_errors(errors, e)
+            period = item if isinstance(item, dict) else {}
+            month, year = period.get("month"), period.get("year")
+            rejected.append(month_errors(
+                month if isinstance(month, int) else None, year if isinstance(year, int) else None, errors, index
+            ))
+            continue
+
+        period_error = check_period(month_rows.month, month_rows.year)
+        if period_error:
+            column, message = period_error
+            errors.add(None, column, getattr(month_rows, column), message)
+        else:
+            records = validate_records(month_rows.data, errors)
+
+        if errors.total:
+            rejected.append(month_errors(month_rows.month, month_rows.year, errors, index))
+        else:
+            valid.append(MonthData.model_construct(month=month_rows.month, year=month_rows.year, data=records))
+
+    counts = Counter((month_data.year, month_data.month) for month_data in valid)
+    repeated = [month_data for month_data in valid if counts[(month_data.year, month_data.month)] > 1]
+    for year, month in sorted({(month_data.year, month_data.month) for month_data in repeated}):
+        rejected.append(month_error(month, year, f"Месяц повторяется в пакете {counts[(year, month)]} раз", "month",
+                                    month))
+    return [month_data for month_data in valid if counts[(month_data.year, month_data.month)] == 1], rejected
+
+
+async def parse_months_sheet(chunks: AsyncIterator[bytes],
+                             delimiter: Optional[str] = None) -> Tuple[List[MonthData], List[Dict[str, Any]]]:
+    """
+    Разбираем таблицу пакетной записи: первая колонка - месяц, далее колонки как в POST /api/concentrate-quality/import.
+    Строки каждой части тела группируются по месяцам и проверяются по колонкам (см. validate_sheet_rows), ошибки
+    строк собираются за один проход и относятся к своему месяцу. Строки, для которых месяц определить нельзя,
+    отклоняют всю таблицу: иначе при записи с заменой месяц потерял бы данные.
+
+    :param chunks: Тело запроса по частям
+    :param delimiter: Разделитель колонок, по умолчанию определяется по первой строке
+    :return: (прошедшие проверку месяцы, итоги отклоненных месяцев)
+    """
+    records: Dict[Tuple[int, int], List[ConcentrateRow]] = {}
+    errors: Dict[Tuple[int, int], RowErrors] = {}
+    sheet_errors = []
+
+    async for rows in iter_sheet_lines(chunks, delimiter):
+        periods: Dict[Tuple[int, int], List[Tuple[int, List[str]]]] = {}
+        for line_number, cells in rows:
+            if line_number == 1 and is_header(cells[1:]):
+                continue
+            try:
+                period = parse_sheet_period(cells[0])
+            except ValueError as e:
+                sheet_errors.append(f"Строка {line_number}: {e}")
+                continue
+            periods.setdefault(period, []).append((line_number, cells[1:]))
+
+        for period, period_rows in periods.items():
+            period_errors = errors.setdefault(period, RowErrors(MAX_ERRORS_PER_MONTH))
+            period_records = validate_sheet_rows(period_rows, period_errors)
+            if not period_errors.total:
+                records.setdefault(period, []).extend(period_records)
+
+    if sheet_errors:
+        raise SheetParseException("; ".join(sheet_errors[:MAX_ERRORS_PER_MONTH]))
+
+    valid = [
+        MonthData.model_construct(month=month, year=year, data=records[(year, month)])
+        for (year, month), period_errors in errors.items() if not period_errors.total
+    ]
+    rejected = [
+        month_errors(month, year, period_errors) for (year, month), period_errors in errors.items()
+        if period_errors.total
+    ]
+    return valid, rejected
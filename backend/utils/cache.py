@@ -0,0 +1,102 @@
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру LRU-кэш с временем жизни записей. Рассчитан на использование из одного event loop,
+    блокировок не содержит.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        :param max_size: Максимальное количество записей, при превышении вытесняется самая давно использованная
+        :param ttl: Время жизни записи по умолчанию, в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Значение по ключу или default, если записи нет или она устарела.
+
+        :param key: Ключ
+        :param default: Значение по умолчанию
+        :return:
+        """
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Сохраняем значение.
+
+        :param key: Ключ
+        :param value: Значение
+        :param ttl: Время жизни записи, по умолчанию - ttl кэша
+        :return:
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable):
+        """
+        Удаляем запись (инвалидация).
+
+        :param key: Ключ
+        :return:
+        """
+        self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Очищаем кэш.
+
+        :return:
+        """
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики кэша.
+
+        :return:
+        """
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
@@ -0,0 +1,212 @@
+import math
+import re
+import numpy as np
+
+from itertools import compress
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Tuple
+
+from model.concentrate_models import ConcentrateRow, CONCENTRATE_METRICS
+
+
+# Ошибок проверки строк в ответе, остальные только подсчитываются
+MAX_ROW_ERRORS = 100
+
+# Допустимые значения показателей, как confloat(ge=0, le=100) в ConcentrateRecord
+METRIC_MIN = 0.0
+METRIC_MAX = 100.0
+
+# Окрестность половины сотой, в которой умножение на 100 может дать другое округление, чем round(value, 2)
+ROUNDING_TIE_TOLERANCE = 1e-6
+
+# Число из ASCII-цифр со знаком, десятичной точкой и порядком. float() и numpy принимают также цифры других
+# алфавитов и разделитель "_", такие значения считаются некорректными
+NUMBER_PATTERN = re.compile(r"\s*[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?\s*")
+# Символы записи NUMBER_PATTERN: строку только из них numpy разбирает так же, как parse_text_number, или не разбирает
+NUMBER_CHARS = re.compile(r"[0-9eE+\-.\s]*")
+
+
+class RowErrors:
+    """
+    Ошибки строк, собранные за один проход по документу: в ответ попадают первые MAX_ROW_ERRORS, остальные только
+    подсчитываются. Строка ошибки - номер строки документа для таблиц и индекс элемента data для JSON.
+    """
+
+    def __init__(self, limit: int = MAX_ROW_ERRORS):
+        """
+        :param limit: Максимум ошибок в ответе
+        """
+        self.limit = limit
+        self.items: List[Dict[str, Any]] = []
+        self.total = 0
+        self.rejected_rows = 0
+
+    def add(self, row: int, column: str, value: Any, message: str):
+        """
+        Добавляем ошибку ячейки.
+
+        :param row: Строка
+        :param column: Колонка
+        :param value: Исходное значение ячейки
+        :param message: Текст ошибки
+        :return:
+        """
+        self.total += 1
+        if len(self.items) >= self.limit:
+            return
+        if isinstance(value, float) and not math.isfinite(value):
+            # NaN и бесконечность из JSON нельзя вернуть в JSON-ответе
+            value = str(value)
+        self.items.append({"row": row, "column": column, "value": value, "message": message})
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Ошибки для ответа.
+
+        :return:
+        """
+        item = {"rows_rejected": self.rejected_rows, "errors": self.items}
+        if self.total > len(self.items):
+            item["errors_total"] = self.total
+        return item
+
+
+def parse_text_number(text: str) -> float:
+    """
+    Разбор строки с числом в записи NUMBER_PATTERN.
+
+    :param text: Строка
+    :return:
+    """
+    if NUMBER_PATTERN.fullmatch(text) is None:
+        raise ValueError(f"Некорректное число {text!r}")
+    return float(text)
+
+
+def to_number(value: Any) -> float:
+    """
+    Разбор показателя из JSON: числа и строки с числом из ASCII-цифр, как для поля float в pydantic.
+
+    :param value: Значение
+    :return:
+    """
+    if isinstance(value, str):
+        return parse_text_number(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    raise TypeError(f"Некорректный тип {type(value).__name__}")
+
+
+def parse_column(cells: Sequence[Any], parse: Callable[[Any], float]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Колонка показателя в массив float64. Колонка из чисел или строк с числом в записи NUMBER_PATTERN
+    преобразуется целиком, иначе - по ячейкам через parse.
+
+    :param cells: Ячейки колонки, None - нет значения
+    :param parse: Разбор ячейки, при ошибке - ValueError или TypeError, OverflowError для целого вне диапазона float
+    :return: (значения, маска разобранных ячеек), неразобранные ячейки - NaN
+    """
+    if None not in cells and NUMBER_CHARS.fullmatch("".join(cell for cell in cells if isinstance(cell, str))):
+        try:
+            values = np.asarray(cells, dtype=np.float64)
+            if values.shape == (len(cells),):
+                return values, np.ones(len(cells), dtype=bool)
+        except (TypeError, ValueError, OverflowError):
+            pass
+
+    values = np.full(len(cells), np.nan)
+    parsed = np.zeros(len(cells), dtype=bool)
+    for index, cell in enumerate(cells):
+        if cell is None:
+            continue
+        try:
+            values[index] = parse(cell)
+            parsed[index] = True
+        except OverflowError:
+            # Целое JSON вне диапазона float - бесконечность, как строка "1e400", и ошибка диапазона
+            values[index] = math.inf if cell > 0 else -math.inf
+            parsed[index] = True
+        except (TypeError, ValueError):
+            pass
+    return values, parsed
+
+
+def round_columns(values: np.ndarray) -> np.ndarray:
+    """
+    Округление показателей до сотых, как round(value, 2) в ConcentrateRecord. Значения, у которых после умножения
+    на 100 дробная часть близка к половине, округляются по одному: там погрешность умножения может изменить
+    результат.
+
+    :param values: Показатели
+    :return:
+    """
+    scaled = values * 100
+    rounded = np.round(scaled) / 100
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < ROUNDING_TIE_TOLERANCE
+    for index in zip(*np.nonzero(ties)):
+        rounded[index] = round(float(values[index]), 2)
+    return rounded
+
+
+def is_blank(cell: Any) -> bool:
+    """
+    Пустая ячейка.
+
+    :param cell: Значение ячейки
+    :return:
+    """
+    return cell is None or isinstance(cell, str) and not cell.strip()
+
+
+def validate_rows(rows: Sequence[int], names: Sequence[Any], columns: Sequence[Sequence[Any]],
+                  parse: Callable[[Any], float], errors: RowErrors) -> List[ConcentrateRow]:
+    """
+    Проверка пачки строк по колонкам: разбор чисел, диапазон и округление выполняются над колонками целиком, все
+    ошибки пачки собираются в errors. Правила те же, что у ConcentrateRecord, но без создания модели pydantic на
+    каждую строку.
+
+    :param rows: Номера строк для ошибок
+    :param names: Наименования
+    :param columns: Ячейки показателей по колонкам в порядке CONCENTRATE_METRICS
+    :param parse: Разбор ячейки показателя
+    :param errors: Ошибки строк
+    :return: Записи прошедших проверку строк с округленными показателями
+    """
+    count = len(names)
+    values = np.empty((len(CONCENTRATE_METRICS), count))
+    parsed = np.empty((len(CONCENTRATE_METRICS), count), dtype=bool)
+    for index, cells in enumerate(columns):
+        values[index], parsed[index] = parse_column(cells, parse)
+
+    # NaN неразобранных ячеек не проходит ни одно сравнение
+    in_range = (values >= METRIC_MIN) & (values <= METRIC_MAX)
+    valid_names = np.fromiter((isinstance(name, str) for name in names), dtype=bool, count=count)
+    valid = valid_names & in_range.all(axis=0)
+
+    for index in np.flatnonzero(~valid):
+        if not valid_names[index]:
+            message = "нет значения" if names[index] is None else "ожидается строка"
+            errors.add(rows[index], "name", names[index], message)
+        for metric_index in np.flatnonzero(~in_range[:, index]):
+            cell = columns[metric_index][index]
+            if parsed[metric_index, index]:
+                message = f"значение вне диапазона от {METRIC_MIN:g} до {METRIC_MAX:g}"
+            else:
+                message = "нет значения" if is_blank(cell) else "некорректное число"
+            errors.add(rows[index], CONCENTRATE_METRICS[metric_index], cell, message)
+    errors.rejected_rows += count - int(valid.sum())
+
+    return list(map(ConcentrateRow._make, zip(compress(names, valid), *round_columns(values[:, valid]).tolist())))
+
+
+def validate_records(data: Sequence[Mapping[str, Any]], errors: RowErrors) -> List[ConcentrateRow]:
+    """
+    Проверка строк тела POST /api/concentrate-quality по колонкам.
+
+    :param data: Строки (словари в формате ConcentrateRecord)
+    :param errors: Ошибки строк
+    :return: Записи прошедших проверку строк
+    """
+    return validate_rows(
+        range(len(data)), [row.get("name") for row in data],
+        [[row.get(metric) for row in data] for metric in CONCENTRATE_METRICS], to_number, errors
+    )
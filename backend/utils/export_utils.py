@@ -0,0 +1,131 @@
+import csv
+import io
+import json
+import struct
+import sys
+
+from array import array
+from typing import Any, AsyncIterator, List, Mapping, Sequence
+
+from model.concentrate_models import CONCENTRATE_METRICS
+
+
+# Колонки выгрузки
+EXPORT_COLUMNS = ("year", "month", "name", *CONCENTRATE_METRICS)
+
+# Колоночный двоичный формат: заголовок COLUMNAR_MAGIC, uint32 длина JSON-описания и само описание, далее блоки.
+# Блок: uint32 число строк n (0 - конец данных), int32[n] year, int32[n] month, uint32[n] длины наименований в байтах,
+# наименования в UTF-8 подряд, затем float64[n] по каждому показателю. Все числа little-endian, поэтому числовые
+# колонки блока читаются без копирования через numpy.frombuffer(data, dtype="<f8", count=n, offset=...).
+COLUMNAR_MAGIC = b"CQCOL1\n"
+COLUMNAR_MEDIA_TYPE = "application/vnd.concentrate-quality.columnar"
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "columnar": COLUMNAR_MEDIA_TYPE,
+}
+
+
+def _packed(typecode: str, values: Sequence) -> bytes:
+    """
+    Упаковка колонки в little-endian массив.
+
+    :param typecode: Код типа модуля array
+    :param values: Значения
+    :return:
+    """
+    packed = array(typecode, values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def encode_csv_batch(rows: List[Mapping[str, Any]], header: bool) -> str:
+    """
+    Пачка строк в CSV. Числа выгружаются в десятичном виде, как хранятся в БД.
+
+    :param rows: Строки
+    :param header: Добавить заголовок
+    :return:
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([row[column] for column in EXPORT_COLUMNS] for row in rows)
+    return buffer.getvalue()
+
+
+def encode_ndjson_batch(rows: List[Mapping[str, Any]]) -> str:
+    """
+    Пачка строк в NDJSON.
+
+    :param rows: Строки
+    :return:
+    """
+    lines = []
+    for row in rows:
+        item = {"year": row["year"], "month": row["month"], "name": row["name"]}
+        item.update((metric, float(row[metric])) for metric in CONCENTRATE_METRICS)
+        lines.append(json.dumps(item, ensure_ascii=False))
+    return "\n".join(lines) + "\n"
+
+
+def encode_columnar_header() -> bytes:
+    """
+    Заголовок колоночного формата.
+
+    :return:
+    """
+    description = json.dumps({
+        "columns": list(EXPORT_COLUMNS),
+        "dtypes": {"year": "<i4", "month": "<i4", "name": "utf8", **{metric: "<f8" for metric in CONCENTRATE_METRICS}}
+    }).encode()
+    return COLUMNAR_MAGIC + struct.pack("<I", len(description)) + description
+
+
+def encode_columnar_batch(rows: List[Mapping[str, Any]]) -> bytes:
+    """
+    Пачка строк в блок колоночного формата.
+
+    :param rows: Строки
+    :return:
+    """
+    names = [row["name"].encode() for row in rows]
+    parts = [
+        struct.pack("<I", len(rows)),
+        _packed("i", [row["year"] for row in rows]),
+        _packed("i", [row["month"] for row in rows]),
+        _packed("I", [len(name) for name in names]),
+        b"".join(names),
+    ]
+    parts += [_packed("d", [float(row[metric]) for row in rows]) for metric in CONCENTRATE_METRICS]
+    return b"".join(parts)
+
+
+async def encode_export(batches: AsyncIterator[List[Mapping[str, Any]]], export_format: str) -> AsyncIterator[bytes]:
+    """
+    Потоковая выгрузка пачек строк в выбранном формате.
+
+    :param batches: Асинхронный итератор пачек строк
+    :param export_format: csv, ndjson или columnar
+    :return:
+    """
+    if export_format == "columnar":
+        yield encode_columnar_header()
+
+    first = True
+    async for rows in batches:
+        if export_format == "csv":
+            yield encode_csv_batch(rows, header=first).encode()
+        elif export_format == "ndjson":
+            yield encode_ndjson_batch(rows).encode()
+        else:
+            yield encode_columnar_batch(rows)
+        first = False
+
+    if export_format == "csv" and first:
+        yield encode_csv_batch([], header=True).encode()
+    if export_format == "columnar":
+        yield struct.pack("<I", 0)
@@ -0,0 +1,68 @@
+import hashlib
+
+from typing import Dict, Hashable, Optional
+
+
+def make_etag(kind: str, user_id: int, year: int, month: int, version: int) -> str:
+    """
+    Сильный ETag ответа за месяц. Версия данных меняется при каждой записи, поэтому ETag однозначно определяет
+    содержимое ответа данного вида.
+
+    :param kind: Вид ответа (данные, отчет и т.п.)
+    :param user_id: Id пользователя
+    :param year: Год
+    :param month: Месяц
+    :param version: Версия данных за месяц
+    :return:
+    """
+    return f'"{kind}-{user_id}-{year}-{month}-{version}"'
+
+
+def make_params_etag(kind: str, user_id: int, params: Hashable, version: int) -> str:
+    """
+    Сильный ETag ответа, зависящего от параметров запроса (например, отчета за период): параметры входят в ETag
+    хэшем, версия данных - как есть.
+
+    :param kind: Вид ответа
+    :param user_id: Id пользователя
+    :param params: Параметры запроса
+    :param version: Версия данных, по которым построен ответ
+    :return:
+    """
+    digest = hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+    return f'"{kind}-{user_id}-{digest}-{version}"'
+
+
+def make_job_etag(user_id: int, job_id: int) -> str:
+    """
+    Сильный ETag результата фоновой задачи. Результат сохраняется один раз и больше не меняется.
+
+    :param user_id: Id пользователя
+    :param job_id: Id задачи
+    :return:
+    """
+    return f'"job-{user_id}-{job_id}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Проверка заголовка If-None-Match.
+
+    :param if_none_match: Значение заголовка
+    :param etag: Текущий ETag
+    :return:
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    """
+    Заголовки кэширования: браузер хранит ответ, но перед использованием проверяет его через If-None-Match.
+
+    :param etag: ETag
+    :return:
+    """
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
@@ -0,0 +1,155 @@
+import codecs
+import csv
+
+from typing import AsyncIterator, List, Optional, Tuple
+
+from exceptions.app_exceptions import RowValidationException, SheetParseException
+from model.concentrate_models import ConcentrateRow, CONCENTRATE_METRICS
+from utils.column_validation import RowErrors, parse_text_number, validate_rows
+
+
+# Порядок колонок во вставляемой таблице, как в форме ввода
+SHEET_COLUMNS = ("name", *CONCENTRATE_METRICS)
+
+
+def detect_delimiter(line: str) -> str:
+    """
+    Определяем разделитель по первой строке. Excel при копировании отдает TSV, при экспорте в CSV с русской
+    локалью - разделитель ";".
+
+    :param line: Первая строка документа
+    :return:
+    """
+    for delimiter in ("\t", ";"):
+        if delimiter in line:
+            return delimiter
+    return ","
+
+
+def parse_number(value: str) -> float:
+    """
+    Разбор числа из ячейки, допускается десятичная запятая и пробелы между разрядами.
+
+    :param value: Значение ячейки
+    :return:
+    """
+    return parse_text_number(value.strip().replace(",", ".").replace("\xa0", "").replace(" ", ""))
+
+
+def is_header(cells: List[str]) -> bool:
+    """
+    Первая строка считается заголовком, если в колонке железа не число.
+
+    :param cells: Ячейки строки
+    :return:
+    """
+    try:
+        parse_number(cells[1])
+        return False
+    except (ValueError, IndexError):
+        return True
+
+
+def validate_sheet_rows(rows: List[Tuple[int, List[str]]], errors: RowErrors) -> List[ConcentrateRow]:
+    """
+    Проверка строк таблицы по колонкам, см. validate_rows.
+
+    :param rows: Номера строк документа и ячейки (наименование и показатели)
+    :param errors: Ошибки строк
+    :return: Записи прошедших проверку строк
+    """
+    # Недостающие ячейки коротких строк - None, такие ячейки попадают в ошибки как пустые
+    cells = [row_cells + [None] * (len(SHEET_COLUMNS) - len(row_cells)) for _, row_cells in rows]
+    return validate_rows(
+        [line_number for line_number, _ in rows],
+        [None if row_cells[0] is None else row_cells[0].strip() for row_cells in cells],
+        [[row_cells[index] for row_cells in cells] for index in range(1, len(SHEET_COLUMNS))],
+        parse_number, errors
+    )
+
+
+async def iter_sheet_lines(chunks: AsyncIterator[bytes],
+                           delimiter: Optional[str] = None) -> AsyncIterator[List[Tuple[int, List[str]]]]:
+    """
+    Потоково разбирает CSV/TSV, вставленный из Excel, на строки ячеек. Отдает непустые строки документа с их
+    номерами группами по мере чтения: по группе на часть тела запроса. Поля в кавычках с переводом строки не
+    поддерживаются. Текст не в UTF-8 - SheetParseException с номером строки.
+
+    :param chunks: Тело запроса по частям
+    :param delimiter: Разделитель колонок, по умолчанию определяется по первой строке
+    :return:
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    line_number = 0
+
+    def parse_lines(lines: List[str]) -> List[Tuple[int, List[str]]]:
+        nonlocal delimiter, line_number
+        if delimiter is None:
+            delimiter = detect_delimiter(lines[0])
+
+        rows = []
+        for cells in csv.reader(lines, delimiter=delimiter):
+            line_number += 1
+            if any(cell.strip() for cell in cells):
+                rows.append((line_number, cells))
+        return rows
+
+    def decode(chunk: bytes, final: bool = False) -> str:
+        try:
+            return decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            # Строки до tail уже разобраны, в tail переводов строки нет
+            line = line_number + e.object[:e.start].count(b"\n") + 1
+            raise SheetParseException(f"Строка {line}: текст не в кодировке UTF-8, сохраните таблицу в UTF-8")
+
+    async for chunk in chunks:
+        text = tail + decode(chunk)
+        lines = text.split("\n")
+        tail = lines.pop()
+        if lines:
+            yield parse_lines(lines)
+
+    tail += decode(b"", final=True)
+    if tail.strip():
+        yield parse_lines([tail])
+
+
+async def iter_sheet_batches(chunks: AsyncIterator[bytes], batch_size: int, delimiter: Optional[str] = None,
+                             errors: Optional[RowErrors] = None,
+                             partial: bool = False) -> AsyncIterator[List[ConcentrateRow]]:
+    """
+    Потоково разбирает CSV/TSV, вставленный из Excel, и отдает записи пачками по batch_size.
+    Заголовок (если есть) и пустые строки пропускаются. Строки проверяются по колонкам группами по мере чтения
+    (см. validate_sheet_rows), ошибки всех строк собираются в errors. Если partial, строки с ошибками пропускаются,
+    иначе после первой ошибки пачки больше не отдаются, таблица дочитывается для сбора остальных ошибок, и в конце
+    выбрасывается RowValidationException, откатывающее запись. С partial RowValidationException выбрасывается,
+    если ни одна строка не прошла проверку, как в POST /api/concentrate-quality.
+
+    :param chunks: Тело запроса по частям
+    :param batch_size: Размер пачки
+    :param delimiter: Разделитель колонок, по умолчанию определяется по первой строке
+    :param errors: Ошибки строк
+    :param partial: Пропускать строки с ошибками
+    :return:
+    """
+    errors = RowErrors() if errors is None else errors
+    batch = []
+    accepted = 0
+    async for rows in iter_sheet_lines(chunks, delimiter):
+        if rows and rows[0][0] == 1 and is_header(rows[0][1]):
+            rows = rows[1:]
+        records = validate_sheet_rows(rows, errors)
+        if errors.total and not partial:
+            continue
+
+        accepted += len(records)
+        batch.extend(records)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if errors.total and (not partial or not accepted):
+        raise RowValidationException(errors.as_dict())
+    if batch:
+        yield batch
@@ -0,0 +1,60 @@
+import json
+
+from typing import Any, Iterable, Mapping, Optional, Union
+
+from fastapi.responses import Response
+
+from model.concentrate_models import CONCENTRATE_METRICS
+
+try:
+    import orjson
+except ImportError:
+    # orjson необязателен, без него используется стандартный json
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """
+    JSON в байтах, побайтно совпадающий с выводом JSONResponse (компактные разделители, UTF-8 без экранирования).
+    При наличии orjson кодирование выполняется им. Форматы чисел orjson и json отличаются только экспоненциальной
+    записью (1e-05 и 1e-5), которая не встречается в ответах API: показатели лежат в диапазоне 0-100 и округлены до
+    двух знаков.
+
+    :param content: Данные
+    :return:
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(body: Union[bytes, memoryview], headers: Optional[Mapping[str, str]] = None) -> Response:
+    """
+    Ответ с заранее сериализованным JSON, например, из серверного кэша или снимка закрытого месяца.
+
+    :param body: JSON в байтах
+    :param headers: Заголовки
+    :return:
+    """
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def month_data_content(month: int, year: int, records: Iterable[Mapping[str, Any]]) -> dict:
+    """
+    Содержимое ответа MonthData по строкам из БД без валидации через ConcentrateRecord. Значения в БД хранятся
+    как NUMERIC(5,2) и уже прошли проверки при записи, а float от значения с двумя знаками после запятой совпадает
+    с round(value, 2), поэтому результат равен MonthData(...).model_dump().
+
+    :param month: Месяц
+    :param year: Год
+    :param records: Строки concentrate_quality
+    :return:
+    """
+    return {
+        "month": month,
+        "year": year,
+        "data": [
+            {"name": record["name"], **{metric: float(record[metric]) for metric in CONCENTRATE_METRICS}}
+            for record in records
+        ],
+    }
@@ -0,0 +1,304 @@
+import math
+
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Границы корзин гистограмм: длительности в секундах и размеры в байтах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Тип контента текстового формата Prometheus
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Отсчет метрики, которую формирует сборщик: (имя, метки, значение)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    """
+    Экранирование значения метки.
+
+    :param value: Значение
+    :return:
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    """
+    Метки в виде {name="value",...}.
+
+    :param labels: Метки
+    :return:
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    """
+    Значение отсчета: целые без дробной части, бесконечность как +Inf.
+
+    :param value: Значение
+    :return:
+    """
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Метрика с метками. Значения хранятся по кортежу значений меток в порядке labelnames.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        :param name: Имя метрики
+        :param documentation: Описание для строки HELP
+        :param labelnames: Имена меток
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> Iterable[Sample]:
+        """
+        Отсчеты метрики.
+
+        :return:
+        """
+        return []
+
+    def render(self) -> List[str]:
+        """
+        Строки метрики в текстовом формате Prometheus.
+
+        :return:
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return lines
+
+
+class Counter(Metric):
+    """
+    Монотонно растущий счетчик.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Увеличиваем значение.
+
+        :param amount: Приращение
+        :param labels: Значения меток
+        :return:
+        """
+        self.values[self._key(labels)] += amount
+
+    def samples(self) -> Iterable[Sample]:
+        return [(self.name, self._labels(key), value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """
+    Текущее значение, может как расти, так и уменьшаться.
+    """
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        """
+        Уменьшаем значение.
+
+        :param amount: Величина уменьшения
+        :param labels: Значения меток
+        :return:
+        """
+        self.values[self._key(labels)] -= amount
+
+    def set(self, value: float, **labels):
+        """
+        Устанавливаем значение.
+
+        :param value: Значение
+        :param labels: Значения меток
+        :return:
+        """
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    Распределение наблюдений по корзинам, с суммой и количеством наблюдений.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        :param name: Имя метрики
+        :param documentation: Описание для строки HELP
+        :param labelnames: Имена меток
+        :param buckets: Верхние границы корзин по возрастанию
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Метки -> (количество в каждой корзине без накопления, сумма, количество)
+        self.values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        """
+        Добавляем наблюдение.
+
+        :param value: Значение
+        :param labels: Значения меток
+        :return:
+        """
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self) -> Iterable[Sample]:
+        for key, (counts, total, count) in self.values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик приложения. Кроме собственных метрик, при выдаче опрашивает сборщики - функции, которые
+    возвращают текущее состояние компонентов (пул соединений, кэши и т.п.) в виде gauge-метрик.
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Tuple[str, str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Добавляем метрику в реестр.
+
+        :param metric: Метрика
+        :return:
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, name: str, documentation: str,
+                      collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        """
+        Добавляем сборщик gauge-метрики, значения которой вычисляются при каждой выдаче.
+
+        :param name: Имя метрики
+        :param documentation: Описание
+        :param collect: Функция, возвращающая пары (метки, значение)
+        :return:
+        """
+        self.collectors = [collector for collector in self.collectors if collector[0] != name]
+        self.collectors.append((name, documentation, collect))
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus.
+
+        :return:
+        """
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for name, documentation, collect in self.collectors:
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in collect()]
+        return "\n".join(lines) + "\n"
+
+
+def stats_samples(stats: Dict[str, object], label: str, extra: Optional[Dict[str, str]] = None):
+    """
+    Числовые поля словаря статистики (pool_stats, TTLCache.stats и т.п.) как отсчеты одной gauge-метрики,
+    имя поля передается меткой label.
+
+    :param stats: Словарь статистики
+    :param label: Имя метки для поля
+    :param extra: Дополнительные метки
+    :return:
+    """
+    return [
+        ({**(extra or {}), label: key}, float(value)) for key, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Длительность обработки HTTP-запроса", ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge("http_requests_in_flight", "Обрабатываемые HTTP-запросы")
+HTTP_RESPONSE_BYTES = registry.histogram(
+    "http_response_size_bytes", "Размер тела HTTP-ответа", ("method", "route"), SIZE_BUCKETS
+)
+DB_ACQUIRE_SECONDS = registry.histogram(
+    "db_acquire_duration_seconds", "Ожидание соединения с БД (пул или новое соединение)", ("method",)
+)
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "Выполнение метода PostgreSQLService без ожидания соединения", ("method",)
+)
+DB_ROWS_RETURNED = registry.histogram(
+    "db_rows_returned", "Строк, возвращенных методом PostgreSQLService", ("method",), ROWS_BUCKETS
+)
+DB_ERRORS = registry.counter("db_errors_total", "Ошибки методов PostgreSQLService", ("method",))
+DB_SLOW_QUERIES = registry.counter("db_slow_queries_total", "Медленные вызовы PostgreSQLService", ("method",))
+PASSWORD_HASH_WAIT_SECONDS = registry.histogram(
+    "password_hash_wait_seconds", "Ожидание места в пуле хэширования паролей", ("operation",)
+)
+PASSWORD_HASH_SECONDS = registry.histogram(
+    "password_hash_duration_seconds", "Выполнение bcrypt в пуле хэширования паролей", ("operation",)
+)
+JWT_SECONDS = registry.histogram("jwt_duration_seconds", "Кодирование и декодирование JWT", ("operation",))
+STARTUP_PHASE_SECONDS = registry.gauge(
+    "startup_phase_duration_seconds", "Длительность этапов старта приложения", ("phase",)
+)
+APP_READY = registry.gauge("app_ready", "Приложение готово принимать запросы (1 - да)")
+ADMISSION_REJECTED = registry.counter(
+    "admission_rejected_total", "Запросы, отклоненные контролем нагрузки", ("reason", "group")
+)
@@ -0,0 +1,293 @@
+import json
+import mmap
+import os
+import struct
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from model.concentrate_models import CONCENTRATE_METRICS
+
+
+# Файл снимка: SNAPSHOT_MAGIC, uint32 длина JSON-заголовка и сам заголовок, выравнивание нулями до 8 байт, далее
+# области данных. Смещения областей в заголовке отсчитываются от начала данных. Область columns - float64[5, n]
+# little-endian (строка - показатель в порядке CONCENTRATE_METRICS), names - JSON-список наименований, остальные -
+# готовые тела ответов GET /api/concentrate-quality и /summary.
+SNAPSHOT_MAGIC = b"CQSNAP1\n"
+SNAPSHOT_ALIGNMENT = 8
+SNAPSHOT_BODY_KINDS = ("data", "summary", "summary-extended")
+
+
+class MonthSnapshot:
+    """
+    Снимок закрытого месяца, отображенный в память. Тела ответов и колонки показателей отдаются представлениями
+    над отображением без копирования; отображение закрывается сборщиком мусора, когда на него не остается ссылок.
+    """
+    __slots__ = ("version", "count", "closed_at", "_view", "_sections")
+
+    def __init__(self, header: Mapping[str, Any], view: memoryview):
+        """
+        :param header: Заголовок файла снимка
+        :param view: Область данных файла
+        """
+        self.version = header["version"]
+        self.count = header["count"]
+        self.closed_at = datetime.fromisoformat(header["closed_at"])
+        self._view = view
+        self._sections = header["sections"]
+
+    def body(self, kind: str) -> memoryview:
+        """
+        Готовое тело ответа.
+
+        :param kind: Вид ответа, см. SNAPSHOT_BODY_KINDS
+        :return:
+        """
+        offset, size = self._sections[kind]
+        return self._view[offset:offset + size]
+
+    @property
+    def columns(self) -> np.ndarray:
+        """
+        Показатели месяца: массив float64 [показатель, концентрат] только для чтения.
+
+        :return:
+        """
+        offset, size = self._sections["columns"]
+        return np.frombuffer(self._view, dtype="<f8", count=size // 8, offset=offset).reshape(
+            len(CONCENTRATE_METRICS), self.count
+        )
+
+    @property
+    def names(self) -> List[str]:
+        """
+        Наименования концентратов в порядке колонок.
+
+        :return:
+        """
+        return json.loads(bytes(self.body("names")))
+
+
+def read_snapshot(path: str) -> Optional[MonthSnapshot]:
+    """
+    Открываем файл снимка.
+
+    :param path: Путь к файлу
+    :return: Снимок или None, если файла нет
+    """
+    try:
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+    view = memoryview(mapped)
+    if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+        raise ValueError(f"Файл {path} не является снимком месяца")
+    prefix = len(SNAPSHOT_MAGIC) + 4
+    (header_size,) = struct.unpack("<I", view[len(SNAPSHOT_MAGIC):prefix])
+    header = json.loads(bytes(view[prefix:prefix + header_size]))
+    return MonthSnapshot(header, view[_aligned(prefix + header_size):])
+
+
+def write_snapshot(path: str, version: int, names: List[str], columns: np.ndarray,
+                   bodies: Mapping[str, bytes]) -> MonthSnapshot:
+    """
+    Записываем файл снимка: сначала во временный файл, затем заменяем им прежний, поэтому читатели в других
+    процессах видят либо старый снимок, либо новый целиком.
+
+    :param path: Путь к файлу
+    :param version: Версия данных месяца, по которой построен снимок
+    :param names: Наименования концентратов
+    :param columns: Показатели [показатель, концентрат]
+    :param bodies: Тела ответов по видам SNAPSHOT_BODY_KINDS
+    :return:
+    """
+    parts = [
+        ("columns", np.ascontiguousarray(columns, dtype="<f8").tobytes()),
+        ("names", json.dumps(names, ensure_ascii=False).encode()),
+        *((kind, bytes(bodies[kind])) for kind in SNAPSHOT_BODY_KINDS),
+    ]
+    sections, offset = {}, 0
+    for kind, content in parts:
+        sections[kind] = (offset, len(content))
+        offset = _aligned(offset + len(content))
+
+    header = json.dumps({
+        "version": version,
+        "count": len(names),
+        "closed_at": datetime.now(timezone.utc).isoformat(),
+        "sections": sections,
+    }).encode()
+    prefix = SNAPSHOT_MAGIC + struct.pack("<I", len(header)) + header
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(prefix.ljust(_aligned(len(prefix)), b"\0"))
+        for _, content in parts:
+            file.write(content.ljust(_aligned(len(content)), b"\0"))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    return read_snapshot(path)
+
+
+def _aligned(size: int) -> int:
+    """
+    Размер, дополненный до SNAPSHOT_ALIGNMENT.
+
+    :param size: Размер
+    :return:
+    """
+    return -(-size // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+class MonthSnapshotStore:
+    """
+    Снимки закрытых месяцев на локальном диске. Снимок привязан к версии данных месяца: если данные изменились
+    после закрытия (в этом или другом процессе), снимок не используется и удаляется при ближайшем чтении.
+    Открытые снимки хранятся в LRU ограниченного размера. Рассчитан на использование из одного event loop.
+    """
+
+    def __init__(self, directory: str, max_open: int):
+        """
+        :param directory: Каталог файлов снимков
+        :param max_open: Максимум открытых снимков в процессе
+        """
+        self.directory = directory
+        self.max_open = max_open
+        self._open: "OrderedDict[Tuple[int, int, int], MonthSnapshot]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def path(self, user_id: int, year: int, month: int) -> str:
+        """
+        Путь к файлу снимка месяца.
+
+        :param user_id: Id пользователя
+        :param year: Год
+        :param month: Месяц
+        :return:
+        """
+        return os.path.join(self.directory, str(user_id), f"{year}-{month:02d}.snap")
+
+    def get(self, user_id: int, year: int, month: int, version: int) -> Optional[MonthSnapshot]:
+        """
+        Снимок месяца, построенный по текущей версии данных.
+
+        :param user_id: Id пользователя
+        :param year: Год
+        :param month: Месяц
+        :param version: Текущая версия данных месяца
+        :return: Снимок или None, если месяц не закрыт или данные изменились после закрытия
+        """
+        key = (user_id, year, month)
+        snapshot = self._open.get(key)
+        if snapshot is None or snapshot.version != version:
+            # Месяц мог быть закрыт или изменен в другом процессе, поэтому перечитываем файл
+            snapshot = self._load(key)
+        if snapshot is None or snapshot.version > version:
+            self.misses += 1
+            return None
+        if snapshot.version < version:
+            logger.info(f"Данные за {month}/{year} пользователя {user_id} изменены после закрытия месяца, "
+                        f"снимок удален")
+            self.invalidate(user_id, year, month)
+            self.misses += 1
+            return None
+
+        self._remember(key, snapshot)
+        self.hits += 1
+        return snapshot
+
+    def write(self, user_id: int, year: int, month: int, version: int, names: List[str], columns: np.ndarray,
+              bodies: Mapping[str, bytes]) -> MonthSnapshot:
+        """
+        Сохраняем снимок месяца. Выполняет файловый ввод-вывод, поэтому вызывается в потоке.
+
+        :param user_id: Id пользователя
+        :param year: Год
+        :param month: Месяц
+        :param version: Версия данных месяца, по которой построен снимок
+        :param names: Наименования концентратов
+        :param columns: Показатели [показатель, концентрат]
+        :param bodies: Тела ответов по видам SNAPSHOT_BODY_KINDS
+        :return:
+        """
+        return write_snapshot(self.path(user_id, year, month), version, names, columns, bodies)
+
+    def remember(self, user_id: int, year: int, month: int, snapshot: MonthSnapshot):
+        """
+        Запоминаем только что записанный снимок как открытый.
+
+        :param user_id: Id пользователя
+        :param year: Год
+        :param month: Месяц
+        :param snapshot: Снимок
+        :return:
+        """
+        self._remember((user_id, year, month), snapshot)
+
+    def invalidate(self, user_id: int, year: int, month: int) -> bool:
+        """
+        Удаляем снимок месяца (месяц снова открыт).
+
+        :param user_id: Id пользователя
+        :param year: Год
+        :param month: Месяц
+        :return: Был ли снимок
+        """
+        self._open.pop((user_id, year, month), None)
+        try:
+            os.remove(self.path(user_id, year, month))
+        except FileNotFoundError:
+            return False
+        self.invalidations += 1
+        return True
+
+    def _load(self, key: Tuple[int, int, int]) -> Optional[MonthSnapshot]:
+        """
+        Читаем снимок с диска. Поврежденный файл считается отсутствующим.
+
+        :param key: (пользователь, год, месяц)
+        :return:
+        """
+        self._open.pop(key, None)
+        try:
+            return read_snapshot(self.path(*key))
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Не удалось прочитать снимок месяца {key}: {e}")
+            return None
+
+    def _remember(self, key: Tuple[int, int, int], snapshot: MonthSnapshot):
+        """
+        Добавляем снимок в LRU открытых снимков.
+
+        :param key: (пользователь, год, месяц)
+        :param snapshot: Снимок
+        :return:
+        """
+        self._open[key] = snapshot
+        self._open.move_to_end(key)
+        while len(self._open) > self.max_open:
+            self._open.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики снимков.
+
+        :return:
+        """
+        return {
+            "open": len(self._open),
+            "max_open": self.max_open,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations
+        }
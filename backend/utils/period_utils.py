@@ -0,0 +1,54 @@
+from typing import Tuple
+
+from exceptions.app_exceptions import InvalidPeriodException
+
+
+# Формат месяца в параметрах периода: ГГГГ-ММ
+PERIOD_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+
+def parse_period(value: str) -> Tuple[int, int]:
+    """
+    Разбор месяца периода в формате ГГГГ-ММ.
+
+    :param value: Строка периода
+    :return: (год, месяц)
+    """
+    year, month = value.split("-")
+    return int(year), int(month)
+
+
+def parse_period_range(period_from: str, period_to: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Разбор границ периода с проверкой порядка.
+
+    :param period_from: Начало периода
+    :param period_to: Окончание периода
+    :return: ((год, месяц) начала, (год, месяц) окончания)
+    """
+    start, end = parse_period(period_from), parse_period(period_to)
+    if start > end:
+        raise InvalidPeriodException
+    return start, end
+
+
+def shift_period(period: Tuple[int, int], months: int) -> Tuple[int, int]:
+    """
+    Месяц, отстоящий от данного на months месяцев (отрицательное значение - назад).
+
+    :param period: (год, месяц)
+    :param months: Сдвиг в месяцах
+    :return: (год, месяц)
+    """
+    index = period[0] * 12 + period[1] - 1 + months
+    return index // 12, index % 12 + 1
+
+
+def format_period(period: Tuple[int, int]) -> str:
+    """
+    Месяц периода в формате ГГГГ-ММ.
+
+    :param period: (год, месяц)
+    :return:
+    """
+    return f"{period[0]:04d}-{period[1]:02d}"
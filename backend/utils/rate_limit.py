@@ -0,0 +1,195 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+
+class TokenBucket:
+    """
+    Корзина токенов: пополняется со скоростью rate токенов в секунду до burst, каждый запрос забирает один токен.
+    """
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """
+        Забираем токен.
+
+        :param rate: Скорость пополнения, токенов в секунду
+        :param burst: Емкость корзины
+        :param now: Текущее время (time.monotonic)
+        :return: 0, если токен получен, иначе время до появления токена, с
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов по ключу (пользователь, IP) корзинами токенов. Корзины хранятся в памяти процесса,
+    число ключей ограничено max_keys: при превышении вытесняются давно не использовавшиеся корзины (они к этому
+    времени, как правило, уже полные, поэтому вытеснение не ослабляет ограничение).
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        """
+        :param rate: Скорость пополнения, запросов в секунду (0 - без ограничения)
+        :param burst: Допустимая пачка запросов
+        :param max_keys: Максимум хранимых корзин
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: Hashable) -> float:
+        """
+        Учитываем запрос с ключом key.
+
+        :param key: Ключ
+        :return: 0, если запрос допущен, иначе рекомендуемая пауза перед повтором, с
+        """
+        if not self.enabled:
+            return 0.0
+
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        retry_after = bucket.take(self.rate, self.burst, now)
+        if retry_after:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Счетчики ограничителя.
+
+        :return:
+        """
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """
+    Запрос не допущен: очередь заполнена или ожидание слота превысило таймаут.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class ConcurrencyLimiter:
+    """
+    Ограничение числа одновременно обрабатываемых запросов группы маршрутов с ограниченной очередью. Если очередь
+    заполнена, запрос сразу отклоняется, а не ждет: так задержка допущенных запросов остается ограниченной.
+    """
+
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        """
+        :param limit: Максимум одновременных запросов (0 - без ограничения)
+        :param max_queue: Максимум ожидающих запросов
+        :param timeout: Максимальное ожидание слота, с
+        """
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    async def acquire(self):
+        """
+        Ждем свободный слот.
+
+        :return:
+        """
+        if not self.enabled:
+            self.active += 1
+            return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+
+        if not self._semaphore.locked():
+            # Свободный слот занимается сразу, без wait_for: он выполняет acquire в отдельной задаче, и до ее
+            # запуска слот выглядит свободным для следующих запросов
+            await self._semaphore.acquire()
+            self.active += 1
+            return
+
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise ConcurrencyLimitExceeded("queue_full")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise ConcurrencyLimitExceeded("queue_timeout")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        """
+        Освобождаем слот.
+
+        :return:
+        """
+        self.active -= 1
+        self.completed += 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Состояние группы: выполняемые и ожидающие запросы, отклоненные.
+
+        :return:
+        """
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
@@ -0,0 +1,86 @@
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from utils.metrics import STARTUP_PHASE_SECONDS, APP_READY
+
+
+class StartupTracker:
+    """
+    Этапы старта приложения и готовность принимать запросы. Длительности этапов накапливаются (этап может
+    повторяться при повторных попытках подготовки) и публикуются в startup_phase_duration_seconds.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        """
+        :param started: Момент начала старта по time.perf_counter(), по умолчанию - создание объекта
+        """
+        self.started = time.perf_counter() if started is None else started
+        self.phases: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        APP_READY.set(0)
+
+    @property
+    def ready(self) -> bool:
+        """
+        Приложение готово принимать запросы.
+
+        :return:
+        """
+        return self.ready_after is not None
+
+    def record(self, phase: str, seconds: float):
+        """
+        Добавляем длительность этапа.
+
+        :param phase: Этап
+        :param seconds: Длительность, с
+        :return:
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        STARTUP_PHASE_SECONDS.set(self.phases[phase], phase=phase)
+
+    @contextmanager
+    def phase(self, phase: str):
+        """
+        Замер этапа старта. Длительность учитывается и при ошибке этапа.
+
+        :param phase: Этап
+        :return:
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started)
+
+    def set_ready(self):
+        """
+        Отмечаем готовность и логируем длительности этапов.
+
+        :return:
+        """
+        self.ready_after = time.perf_counter() - self.started
+        self.last_error = None
+        APP_READY.set(1)
+        phases = ", ".join(f"{phase} {seconds:.3f} с" for phase, seconds in self.phases.items())
+        logger.info(f"Приложение готово через {self.ready_after:.3f} с после начала импорта: {phases}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Состояние старта для /ready.
+
+        :return:
+        """
+        return {
+            "ready": self.ready,
+            "ready_after_seconds": None if self.ready_after is None else round(self.ready_after, 3),
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "phases": {phase: round(seconds, 3) for phase, seconds in self.phases.items()}
+        }
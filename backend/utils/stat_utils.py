@@ -1,4 +1,11 @@
-from typing import List, Dict
+import math
+import statistics
+
+from decimal import Decimal
+
+from typing import List, Dict, Iterable, Mapping, Any
+
+from model.concentrate_models import CONCENTRATE_METRICS, RangeSummaryItem
 
 
 def calculate_stats(values: List[float]) -> Dict[str, float]:
@@ -14,4 +21,121 @@ def calculate_stats(values: List[float]) -> Dict[str, float]:
         'avg': round(avg, 2),
         'min': round(min(values), 2),
         'max': round(max(values), 2)
-    }
\ No newline at end of file
+    }
+
+
+def percentile_cont(sorted_values: List[float], fraction: float) -> float:
+    """
+    Процентиль с линейной интерполяцией. Повторяет арифметику percentile_cont из PostgreSQL, чтобы результаты
+    расчета в приложении и в БД совпадали до округления.
+
+    :param sorted_values: Отсортированные данные
+    :param fraction: Доля от 0 до 1
+    :return:
+    """
+    position = fraction * (len(sorted_values) - 1)
+    first = math.floor(position)
+    second = math.ceil(position)
+    return sorted_values[first] + (sorted_values[second] - sorted_values[first]) * (position - first)
+
+
+def calculate_extended_stats(values: List[float]) -> Dict[str, float]:
+    """
+    Дополнительные показатели отчета: стандартное отклонение (выборочное), медиана, 5-й и 95-й процентили.
+
+    :param values: Данные
+    :return:
+    """
+    values = sorted(float(value) for value in values)
+    stats = {'median': round(percentile_cont(values, 0.5), 2)}
+    if len(values) > 1:
+        stats['stddev'] = round(statistics.stdev(values), 2)
+    stats['p5'] = round(percentile_cont(values, 0.05), 2)
+    stats['p95'] = round(percentile_cont(values, 0.95), 2)
+    return stats
+
+
+def summarize_records(records: Iterable[Mapping[str, Any]], extended: bool = False) -> Dict[str, Dict[str, float]]:
+    """
+    Расчет отчета по строкам концентратов в приложении. Эталонная реализация для сверки с расчетом в БД.
+
+    :param records: Строки концентратов
+    :param extended: Добавить дополнительные показатели
+    :return:
+    """
+    summary = {}
+    for metric in CONCENTRATE_METRICS:
+        values = [record[metric] for record in records]
+        summary[metric] = calculate_stats(values)
+        if extended:
+            summary[metric].update(calculate_extended_stats(values))
+    return summary
+
+
+def summarize_aggregates(row: Mapping[str, Any], extended: bool = False) -> Dict[str, Dict[str, float]]:
+    """
+    Формирует отчет из агрегатов, посчитанных в БД (см. PostgreSQLService.get_concentrate_summary).
+    Среднее считается как сумма / количество, чтобы округление совпадало с calculate_stats.
+
+    :param row: Строка с агрегатами <metric>_sum, <metric>_min, <metric>_max и count
+    :param extended: Добавить дополнительные показатели
+    :return:
+    """
+    summary = {}
+    for metric in CONCENTRATE_METRICS:
+        summary[metric] = {
+            'avg': round(row[f'{metric}_sum'] / row['count'], 2),
+            'min': round(row[f'{metric}_min'], 2),
+            'max': round(row[f'{metric}_max'], 2)
+        }
+        if extended:
+            summary[metric]['median'] = round(row[f'{metric}_median'], 2)
+            if row[f'{metric}_stddev'] is not None:
+                summary[metric]['stddev'] = round(row[f'{metric}_stddev'], 2)
+            summary[metric]['p5'] = round(row[f'{metric}_p5'], 2)
+            summary[metric]['p95'] = round(row[f'{metric}_p95'], 2)
+    return summary
+
+
+def combined_stddev(count: int, total: Decimal, sum_of_squares: Decimal) -> Decimal:
+    """
+    Выборочное стандартное отклонение по количеству, сумме и сумме квадратов значений. Значения показателей
+    хранятся с двумя знаками после запятой, а суммы - в NUMERIC без округления, поэтому дисперсия считается точно
+    (без потери точности на вычитании, как было бы во float) и совпадает со statistics.stdev по исходным значениям.
+
+    :param count: Количество значений (больше 1)
+    :param total: Сумма значений
+    :param sum_of_squares: Сумма квадратов значений
+    :return:
+    """
+    variance = (Decimal(sum_of_squares) - Decimal(total) * Decimal(total) / count) / (count - 1)
+    return max(variance, Decimal(0)).sqrt()
+
+
+def summarize_partials(row: Mapping[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Отчет по объединенным частичным агрегатам (см. PostgreSQLService.get_organization_summary): среднее, минимум,
+    максимум и, если значений больше одного, стандартное отклонение.
+
+    :param row: Строка с агрегатами <metric>_sum, <metric>_min, <metric>_max, <metric>_sumsq и count
+    :return:
+    """
+    summary = summarize_aggregates(row)
+    if row['count'] > 1:
+        for metric in CONCENTRATE_METRICS:
+            stddev = combined_stddev(row['count'], row[f'{metric}_sum'], row[f'{metric}_sumsq'])
+            summary[metric]['stddev'] = round(float(stddev), 2)
+    return summary
+
+
+def range_summary_item(row: Mapping[str, Any]) -> RangeSummaryItem:
+    """
+    Элемент отчета за период из строки PostgreSQLService.iter_period_summary.
+
+    :param row: Строка с агрегатами, kind, year, month и name
+    :return:
+    """
+    return RangeSummaryItem(
+        kind=row["kind"], month=row["month"], year=row["year"], name=row["name"],
+        count=row["count"], **summarize_aggregates(row)
+    )
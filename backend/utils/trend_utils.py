@@ -0,0 +1,108 @@
+import re
+
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from exceptions.app_exceptions import InvalidReportParamsException
+from model.concentrate_models import TrendPoint, TrendSeries, CONCENTRATE_METRICS
+
+
+# Норма показателя: <показатель>>=<значение> или <показатель><=<значение>, например iron>=62 или sulfur<=0.3
+SPEC_PATTERN = re.compile(rf"^({'|'.join(CONCENTRATE_METRICS)})\s*(>=|<=)\s*(\d+(?:\.\d+)?)$")
+
+# Нормы показателей: показатель -> {"min": ..., "max": ...}
+SpecLimits = Dict[str, Dict[str, float]]
+
+
+def parse_spec(items: Iterable[str], base: Optional[SpecLimits] = None) -> SpecLimits:
+    """
+    Разбор норм показателей. Нормы из items заменяют одноименные границы из base.
+
+    :param items: Нормы в формате SPEC_PATTERN
+    :param base: Нормы по умолчанию
+    :return:
+    """
+    spec = {metric: dict(limits) for metric, limits in (base or {}).items()}
+    for item in items:
+        match = SPEC_PATTERN.match(item.strip())
+        if not match:
+            raise InvalidReportParamsException(
+                f"Некорректная норма '{item}', ожидается <показатель>>=<значение> или <показатель><=<значение>"
+            )
+        metric, operator, value = match.groups()
+        spec.setdefault(metric, {})["min" if operator == ">=" else "max"] = float(value)
+    return spec
+
+
+def parse_metrics(items: Optional[List[str]]) -> List[str]:
+    """
+    Показатели отчета в порядке CONCENTRATE_METRICS, по умолчанию - все.
+
+    :param items: Показатели из запроса
+    :return:
+    """
+    if not items:
+        return list(CONCENTRATE_METRICS)
+    unknown = sorted(set(items) - set(CONCENTRATE_METRICS))
+    if unknown:
+        raise InvalidReportParamsException(
+            f"Неизвестные показатели: {', '.join(unknown)}, допустимо: {', '.join(CONCENTRATE_METRICS)}"
+        )
+    return [metric for metric in CONCENTRATE_METRICS if metric in items]
+
+
+def out_of_spec(values: Mapping[str, float], spec: SpecLimits) -> List[str]:
+    """
+    Показатели за пределами норм.
+
+    :param values: Значения показателей
+    :param spec: Нормы
+    :return:
+    """
+    return [
+        metric for metric, value in values.items()
+        if value < spec.get(metric, {}).get("min", value) or value > spec.get(metric, {}).get("max", value)
+    ]
+
+
+def build_trend_series(rows: Iterable[Mapping[str, Any]], metrics: List[str], spec: SpecLimits) -> List[TrendSeries]:
+    """
+    Ряды по концентратам из строк get_concentrate_trends, в порядке наименований.
+
+    :param rows: Строки в порядке (наименование, год, месяц)
+    :param metrics: Показатели отчета
+    :param spec: Нормы показателей
+    :return:
+    """
+    points: Dict[str, List[TrendPoint]] = {}
+    for row in rows:
+        values = {metric: round(float(row[metric]), 2) for metric in metrics}
+        points.setdefault(row["name"], []).append(TrendPoint(
+            year=row["year"],
+            month=row["month"],
+            values=values,
+            rolling_mean={metric: round(float(row[f"{metric}_rolling"]), 2) for metric in metrics},
+            out_of_spec=out_of_spec(values, spec),
+        ))
+    return [
+        TrendSeries(name=name, points=series, out_of_spec_months=sum(1 for point in series if point.out_of_spec))
+        for name, series in sorted(points.items(), key=lambda item: item[0])
+    ]
+
+
+def trends_cache_params(start: Tuple[int, int], end: Tuple[int, int], names: Optional[List[str]], metrics: List[str],
+                        window: int, spec: SpecLimits) -> tuple:
+    """
+    Параметры отчета по трендам в виде ключа кэша.
+
+    :param start: Начало периода
+    :param end: Окончание периода
+    :param names: Наименования концентратов
+    :param metrics: Показатели
+    :param window: Окно скользящего среднего
+    :param spec: Нормы показателей
+    :return:
+    """
+    return (
+        start, end, tuple(sorted(set(names))) if names else None, tuple(metrics), window,
+        tuple(sorted((metric, tuple(sorted(limits.items()))) for metric, limits in spec.items())),
+    )
@@ -0,0 +1,104 @@
+import itertools
+import numpy as np
+
+from decimal import Decimal
+from typing import Dict, Iterable, Mapping, Any
+
+from model.concentrate_models import CONCENTRATE_METRICS
+
+
+def records_to_matrix(records: Iterable[Mapping[str, Any]]) -> np.ndarray:
+    """
+    Переносим строки концентратов за один проход в непрерывный двумерный массив float64:
+    строка массива - запись, колонка - показатель в порядке CONCENTRATE_METRICS.
+
+    :param records: Строки концентратов
+    :return:
+    """
+    records = list(records)
+    values = itertools.chain.from_iterable(
+        [record[metric] for metric in CONCENTRATE_METRICS] for record in records
+    )
+    matrix = np.fromiter(values, dtype=np.float64, count=len(records) * len(CONCENTRATE_METRICS))
+    return matrix.reshape(len(records), len(CONCENTRATE_METRICS))
+
+
+def percentile_cont_columns(sorted_matrix: np.ndarray, fraction: float) -> np.ndarray:
+    """
+    Процентиль по каждой колонке отсортированного массива. Арифметика та же, что в stat_utils.percentile_cont
+    и percentile_cont PostgreSQL.
+
+    :param sorted_matrix: Массив, отсортированный по колонкам
+    :param fraction: Доля от 0 до 1
+    :return:
+    """
+    position = fraction * (sorted_matrix.shape[0] - 1)
+    first = sorted_matrix[int(np.floor(position))]
+    second = sorted_matrix[int(np.ceil(position))]
+    return first + (second - first) * (position - np.floor(position))
+
+
+def calculate_stats_matrix(matrix: np.ndarray, extended: bool = False) -> Dict[str, Dict[str, float]]:
+    """
+    Отчет по всем показателям сразу над массивом из records_to_matrix. Результат совпадает с
+    stat_utils.summarize_records: значения в БД имеют два знака после запятой, поэтому сумма считается точно в
+    целых сотых, а среднее и округление - в Decimal, как в calculate_stats.
+
+    :param matrix: Массив (записи x показатели)
+    :param extended: Добавить медиану, стандартное отклонение, 5-й и 95-й процентили
+    :return:
+    """
+    count = matrix.shape[0]
+    sums = np.rint(matrix * 100).astype(np.int64).sum(axis=0)
+    minimums = matrix.min(axis=0)
+    maximums = matrix.max(axis=0)
+
+    if extended:
+        sorted_matrix = np.sort(matrix, axis=0)
+        medians = percentile_cont_columns(sorted_matrix, 0.5)
+        p5 = percentile_cont_columns(sorted_matrix, 0.05)
+        p95 = percentile_cont_columns(sorted_matrix, 0.95)
+        stddevs = matrix.std(axis=0, ddof=1) if count > 1 else None
+
+    summary = {}
+    for index, metric in enumerate(CONCENTRATE_METRICS):
+        summary[metric] = {
+            'avg': float(round(Decimal(int(sums[index])) / (100 * count), 2)),
+            'min': round(float(minimums[index]), 2),
+            'max': round(float(maximums[index]), 2)
+        }
+        if extended:
+            summary[metric]['median'] = round(float(medians[index]), 2)
+            if stddevs is not None:
+                summary[metric]['stddev'] = round(float(stddevs[index]), 2)
+            summary[metric]['p5'] = round(float(p5[index]), 2)
+            summary[metric]['p95'] = round(float(p95[index]), 2)
+    return summary
+
+
+def rolling_means(groups: np.ndarray, periods: np.ndarray, matrix: np.ndarray, window: int,
+                  scale: int = 1) -> np.ndarray:
+    """
+    Скользящее среднее каждой колонки за window последних календарных месяцев внутри группы, векторно через
+    накопленные суммы. Строки должны быть отсортированы по (группа, месяц), месяцы внутри группы не повторяются.
+    Совпадает с AVG(...) OVER (PARTITION BY группа ORDER BY месяц RANGE BETWEEN window - 1 PRECEDING AND CURRENT ROW).
+    Для целочисленного matrix суммы точные, и среднее получается одним делением суммы на count * scale, поэтому
+    совпадает с точным средним, округленным до float, как AVG по NUMERIC в PostgreSQL.
+
+    :param groups: Номер группы каждой строки
+    :param periods: Номер месяца каждой строки (год * 12 + месяц)
+    :param matrix: Значения, строка массива - запись, колонка - показатель
+    :param window: Окно в месяцах
+    :param scale: Делитель значений (100 для значений в сотых долях)
+    :return: Массив средних той же формы, что matrix
+    """
+    if not len(matrix):
+        return np.empty(matrix.shape, dtype=np.float64)
+
+    # Группы разносятся дальше окна, чтобы окно не захватывало строки соседней группы
+    offset = periods - periods.min()
+    keys = groups.astype(np.int64) * (int(offset.max()) + window + 1) + offset
+    starts = np.searchsorted(keys, keys - (window - 1), side="left")
+    ends = np.arange(1, len(keys) + 1)
+    sums = np.vstack([np.zeros((1, matrix.shape[1]), dtype=matrix.dtype), np.cumsum(matrix, axis=0)])
+    return (sums[ends] - sums[starts]) / ((ends - starts) * scale)[:, None]
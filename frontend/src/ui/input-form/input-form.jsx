@@ -108,16 +108,26 @@ const ConcentrateQualitySystem = () => {
   const saveData = async () => {
     try {
       const structure = getTableData()
+      // Форма содержит все данные за месяц, поэтому сохраняем в режиме sync: записываются только изменения
       await axios.post(backend_url + '/api/concentrate-quality',
         {
             "month": month,
             "year": year,
             data: structure
-      });
+        },
+        { params: { mode: 'sync' } }
+      );
       alert('Данные успешно сохранены');
     } catch (error) {
       console.error('Ошибка при сохранении данных:', error);
-      alert('Ошибка при сохранении данных');
+      // Сервер возвращает ошибки всех строк таблицы сразу (номер строки - с единицы, без пустых строк)
+      const detail = error.response && error.response.data && error.response.data.detail;
+      if (detail && detail.errors) {
+        const errors = detail.errors.map(item => `Строка ${item.row + 1}, ${item.column}: ${item.message}`);
+        alert(`${detail.message}\n${errors.join('\n')}`);
+      } else {
+        alert('Ошибка при сохранении данных');
+      }
     }
   };
 